@@ -0,0 +1,372 @@
+"""
+Benchmarks for the memory service.
+
+retrieval: episodic-memory retrieval latency from 100 to 100k episodes per
+           session, the old per-document cosine loop + full sort against
+           EpisodeIndex (one matrix-vector product + argpartition). Both run on
+           episodes already in memory, so the old path's MongoDB scan on every
+           turn (which the cache also removes) is not even counted.
+chat:      /api/chat handler latency against a fake Ollama (fixed per-call
+           latencies, served concurrently) and the MongoDB at MONGODB_URI,
+           with memory maintenance inline vs in the background. A real
+           Ollama shares its GPU between background jobs and replies, so
+           expect a smaller gap under load. Also prints the per-stage
+           timings the handler reports with debug=True: the context stage
+           waits for its slowest source, not the sum of all of them.
+db:        MongoDB time per chat turn (the handler's reads and writes plus
+           the summarize-or-not check) on a seeded database of --messages
+           messages, first without indexes and with count_documents, then
+           with memory.INDEXES and the counters documents.
+
+    python benchmark.py retrieval --sizes 100 1000 10000 100000
+    python benchmark.py chat --turns 30 --users 3
+    python benchmark.py db --messages 1000000
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import zlib
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+import httpx
+import numpy as np
+
+import memory
+from memory import EpisodeIndex, cosine_similarity
+
+
+def percentile_ms(values: List[float], pct: float) -> float:
+    return float(np.percentile(values, pct)) * 1000 if values else 0.0
+
+
+def timed(fn, runs: int, budget_seconds: float) -> List[float]:
+    """Latencies of up to runs calls of fn, stopping early once budget_seconds have passed"""
+    latencies = []
+    deadline = time.perf_counter() + budget_seconds
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+        if time.perf_counter() > deadline:
+            break
+    return latencies
+
+
+def synthetic_episodes(count: int, dim: int, rng: np.random.Generator) -> List[Dict]:
+    vectors = rng.standard_normal((count, dim)).astype(np.float32)
+    return [
+        {"_id": i, "fact": f"fact {i}", "importance": round(random.random(), 2), "embedding": vectors[i].tolist()}
+        for i in range(count)
+    ]
+
+
+def loop_retrieval(episodes: List[Dict], query_embedding: List[float], top_k: int) -> List[Dict]:
+    """The previous retrieve_relevant_episodes scoring, minus the MongoDB cursor"""
+    scored = []
+    for episode in episodes:
+        if "embedding" in episode and episode["embedding"]:
+            scored.append({
+                "fact": episode["fact"],
+                "importance": episode["importance"],
+                "similarity": cosine_similarity(query_embedding, episode["embedding"])
+            })
+    scored.sort(key=lambda x: x["similarity"] * x["importance"], reverse=True)
+    return scored[:top_k]
+
+
+def run_retrieval(args):
+    rng = np.random.default_rng(args.seed)
+    random.seed(args.seed)
+    print(f"\n{'episodes':>9} | {'loop p50':>10} | {'loop p95':>10} | {'index p50':>10} | {'index p95':>10} | "
+          f"{'speedup':>8} | {'build':>8} | {'append':>8} | {'MB':>6}")
+    print("-" * 100)
+    for size in args.sizes:
+        episodes = synthetic_episodes(size, args.dim, rng)
+        queries = [rng.standard_normal(args.dim).astype(np.float32).tolist() for _ in range(args.queries)]
+
+        build_start = time.perf_counter()
+        index = EpisodeIndex()
+        for start in range(0, size, 1000):  # the cache loads a session in batches of 1000
+            index.append(episodes[start:start + 1000])
+        build_time = time.perf_counter() - build_start
+
+        # Both must rank the same facts first
+        for query in queries[:3]:
+            expected = [e["fact"] for e in loop_retrieval(episodes, query, args.top_k)]
+            assert [e["fact"] for e in index.top_k(query, args.top_k)] == expected, "rankings differ"
+
+        query_cycle = iter(queries * (args.queries + 1))
+        loop_latencies = timed(lambda: loop_retrieval(episodes, next(query_cycle), args.top_k),
+                               args.queries, args.budget)
+        index_latencies = timed(lambda: index.top_k(next(query_cycle), args.top_k), args.queries, args.budget)
+
+        new_episodes = synthetic_episodes(100, args.dim, rng)
+        for i, episode in enumerate(new_episodes):
+            episode["_id"] = size + i
+        append_latencies = timed(lambda: index.append([new_episodes.pop()]), 100, args.budget)
+
+        megabytes = index._matrix.nbytes / 1e6
+        speedup = percentile_ms(loop_latencies, 50) / max(percentile_ms(index_latencies, 50), 1e-9)
+        print(f"{size:>9,} | {percentile_ms(loop_latencies, 50):>8.2f}ms | {percentile_ms(loop_latencies, 95):>8.2f}ms | "
+              f"{percentile_ms(index_latencies, 50):>8.3f}ms | {percentile_ms(index_latencies, 95):>8.3f}ms | "
+              f"{speedup:>7.0f}x | {build_time:>7.2f}s | {percentile_ms(append_latencies, 50):>6.3f}ms | {megabytes:>6.1f}")
+
+
+SAMPLE_MESSAGES = [
+    "I just moved to Oslo and I am looking for a good coffee place",
+    "My sister is visiting next week, any ideas for a day trip?",
+    "I prefer vegetarian food, remember that",
+    "What was the name of the cafe you suggested earlier?",
+    "I work as a nurse, so my schedule is mostly night shifts",
+]
+
+
+def fake_vector(text: str, dim: int) -> List[float]:
+    vector = np.random.default_rng(zlib.crc32(text.encode())).standard_normal(dim)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def fake_ollama(chat_latency: float, generate_latency: float, embed_latency: float, dim: int) -> httpx.AsyncClient:
+    """An Ollama stand-in answering /api/chat, /api/generate and both embedding endpoints after fixed delays"""
+    async def handler(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        path = request.url.path
+        if path == "/api/embed":
+            await asyncio.sleep(embed_latency)
+            return httpx.Response(200, json={"embeddings": [fake_vector(text, dim) for text in body["input"]]})
+        if path == "/api/embeddings":
+            await asyncio.sleep(embed_latency)
+            return httpx.Response(200, json={"embedding": fake_vector(body["prompt"], dim)})
+        if path == "/api/generate":
+            await asyncio.sleep(generate_latency)
+            if body["prompt"].startswith("Extract"):
+                text = "FACT: The user lives in Oslo\nIMPORTANCE: 0.8\nFACT: The user is vegetarian\nIMPORTANCE: 0.9"
+            else:
+                text = "- The user talked about daily plans"
+            return httpx.Response(200, json={"response": text})
+        if path == "/api/chat":
+            await asyncio.sleep(chat_latency)
+            return httpx.Response(200, json={"message": {"role": "assistant", "content": "Sure, here is an idea."}})
+        return httpx.Response(404, text="404 page not found")
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url=memory.OLLAMA_BASE_URL)
+
+
+async def chat_turns(args, background: bool) -> Dict:
+    """Replay args.turns chat requests round-robin over args.users users on an empty benchmark database"""
+    import main
+    from models import ChatRequest
+
+    await main.client.drop_database(args.database)
+    main.db = main.client[args.database]
+    main.BACKGROUND_MAINTENANCE = background
+    memory.episode_cache = memory.EpisodeCache()
+
+    latencies, stages = [], {}
+    start = time.perf_counter()
+    for turn in range(args.turns):
+        request = ChatRequest(user_id=f"bench-user-{turn % args.users}", session_id="bench",
+                              message=SAMPLE_MESSAGES[turn % len(SAMPLE_MESSAGES)], debug=True)
+        turn_start = time.perf_counter()
+        response = await main.chat(request)
+        latencies.append(time.perf_counter() - turn_start)
+        for stage, ms in response.timings.items():
+            stages.setdefault(stage, []).append(ms)
+    replies_done = time.perf_counter() - start
+    await main.maintenance.drain()
+    return {
+        "latencies": latencies,
+        "stages": stages,
+        "replies_seconds": replies_done,
+        "all_done_seconds": time.perf_counter() - start,
+        "episodes": await main.db.episodes.count_documents({}),
+        "summaries": await main.db.summaries.count_documents({}),
+    }
+
+
+async def run_chat(args):
+    memory._http_client = fake_ollama(args.chat_latency, args.generate_latency, args.embed_latency, args.dim)
+    print(f"Fake Ollama: chat {args.chat_latency}s, generate {args.generate_latency}s, embed {args.embed_latency}s; "
+          f"{args.turns} turns over {args.users} users")
+    results = {}
+    for name, background in [("inline", False), ("background", True)]:
+        results[name] = await chat_turns(args, background)
+
+    import main
+    await main.client.drop_database(args.database)
+    await memory.close_http_client()
+
+    print(f"\n{'maintenance':>11} | {'chat p50':>9} | {'chat p95':>9} | {'chat max':>9} | {'replies':>8} | "
+          f"{'all done':>8} | {'episodes':>8} | {'summaries':>9}")
+    print("-" * 92)
+    for name, result in results.items():
+        latencies = result["latencies"]
+        print(f"{name:>11} | {percentile_ms(latencies, 50):>7.0f}ms | {percentile_ms(latencies, 95):>7.0f}ms | "
+              f"{max(latencies) * 1000:>7.0f}ms | {result['replies_seconds']:>7.2f}s | "
+              f"{result['all_done_seconds']:>7.2f}s | {result['episodes']:>8} | {result['summaries']:>9}")
+
+    stages = results["background"]["stages"]
+    print("\nPer-stage p50 with background maintenance:")
+    for stage, values in stages.items():
+        print(f"  {stage:>16}: {np.median(values):>8.1f}ms")
+    context_sources = ["short_term", "session_summary", "lifetime_summary", "embedding", "retrieval"]
+    sequential = np.median(np.sum([stages[stage] for stage in context_sources], axis=0))
+    print(f"  context took {np.median(stages['context']):.1f}ms vs {sequential:.1f}ms for its sources one after another")
+
+
+async def seed_database(db, args, rng: random.Random) -> Dict:
+    """
+    args.messages alternating user/assistant messages spread evenly over
+    args.users users with args.sessions sessions each, a session summary
+    every SUMMARIZE_EVERY user messages, and counters that agree with both
+    """
+    sessions = [(f"bench-user-{u}", f"session-{s}") for u in range(args.users) for s in range(args.sessions)]
+    per_session = args.messages // len(sessions)
+    start = datetime.utcnow() - timedelta(seconds=args.messages)
+    messages, summaries, counters = [], [], []
+    for i, (user_id, session_id) in enumerate(sessions):
+        for n in range(per_session):
+            created_at = start + timedelta(seconds=n * len(sessions) + i)
+            messages.append({"user_id": user_id, "session_id": session_id, "role": ("user", "assistant")[n % 2],
+                             "content": rng.choice(SAMPLE_MESSAGES), "created_at": created_at})
+            if n % (2 * memory.SUMMARIZE_EVERY) == 2 * memory.SUMMARIZE_EVERY - 1:
+                summaries.append({"user_id": user_id, "session_id": session_id, "scope": "session",
+                                  "text": "- The user talked about daily plans", "created_at": created_at})
+        counters.append({"_id": {"user_id": user_id, "session_id": session_id},
+                         "user_messages": (per_session + 1) // 2})
+    for u in range(args.users):
+        user_summaries = sum(1 for s in summaries if s["user_id"] == f"bench-user-{u}")
+        counters.append({"_id": {"user_id": f"bench-user-{u}", "session_id": None}, "session_summaries": user_summaries})
+
+    # Insert in created_at order, as the service would have
+    messages.sort(key=lambda m: m["created_at"])
+    for batch_start in range(0, len(messages), 10_000):
+        await db.messages.insert_many(messages[batch_start:batch_start + 10_000], ordered=False)
+    await db.summaries.insert_many(summaries, ordered=False)
+    await db.counters.insert_many(counters, ordered=False)
+    return {"sessions": sessions, "messages": len(messages), "summaries": len(summaries)}
+
+
+async def db_turn(db, user_id: str, session_id: str, indexed: bool) -> Dict[str, float]:
+    """The MongoDB operations of one chat turn; seconds spent in the handler and in the maintenance check"""
+    message_time = datetime.utcnow()
+    user_msg = {"user_id": user_id, "session_id": session_id, "role": "user",
+                "content": SAMPLE_MESSAGES[0], "created_at": message_time}
+
+    start = time.perf_counter()
+    if indexed:
+        _, message_number = await asyncio.gather(
+            db.messages.insert_one(user_msg),
+            memory.increment_counter(db, user_id, session_id, "user_messages", message_time)
+        )
+    else:
+        await db.messages.insert_one(user_msg)
+    await asyncio.gather(
+        db.messages.find({"user_id": user_id, "session_id": session_id})
+            .sort("created_at", -1).limit(memory.SHORT_TERM_N).to_list(None),
+        db.summaries.find_one({"user_id": user_id, "session_id": session_id, "scope": "session"},
+                              sort=[("created_at", -1)]),
+        db.summaries.find_one({"user_id": user_id, "session_id": None, "scope": "user"},
+                              sort=[("created_at", -1)])
+    )
+    await db.messages.insert_one({"user_id": user_id, "session_id": session_id, "role": "assistant",
+                                  "content": "Sure, here is an idea.", "created_at": datetime.utcnow()})
+    handler_done = time.perf_counter()
+
+    # The summaries themselves need the LLM, so only the checks are timed
+    if not indexed:
+        message_number = await db.messages.count_documents({
+            "user_id": user_id, "session_id": session_id, "role": "user", "created_at": {"$lte": message_time}
+        })
+    if message_number % memory.SUMMARIZE_EVERY == 0:
+        if indexed:
+            await memory.increment_counter(db, user_id, None, "session_summaries", message_time)
+        else:
+            await db.summaries.count_documents({"user_id": user_id, "scope": "session"})
+    return {"handler": handler_done - start, "maintenance": time.perf_counter() - handler_done}
+
+
+async def run_db(args):
+    import main
+    db = main.client[args.database]
+    rng = random.Random(args.seed)
+    await main.client.drop_database(args.database)
+
+    print(f"Seeding {args.messages:,} messages over {args.users} users x {args.sessions} sessions...")
+    seed_start = time.perf_counter()
+    seeded = await seed_database(db, args, rng)
+    print(f"✓ {seeded['messages']:,} messages and {seeded['summaries']:,} summaries in "
+          f"{time.perf_counter() - seed_start:.1f}s")
+
+    results = {}
+    for name, indexed in [("no indexes, count_documents", False), ("indexes, counters", True)]:
+        if indexed:
+            index_start = time.perf_counter()
+            await memory.ensure_indexes(db)
+            print(f"✓ Built indexes in {time.perf_counter() - index_start:.1f}s")
+        turns = [await db_turn(db, *rng.choice(seeded["sessions"]), indexed) for _ in range(args.turns)]
+        results[name] = turns
+
+    await main.client.drop_database(args.database)
+
+    print(f"\n{'':>27} | {'handler p50':>11} | {'handler p95':>11} | {'check p50':>10} | {'check p95':>10} | "
+          f"{'turn p50':>9}")
+    print("-" * 92)
+    for name, turns in results.items():
+        handler = [turn["handler"] for turn in turns]
+        check = [turn["maintenance"] for turn in turns]
+        total = [turn["handler"] + turn["maintenance"] for turn in turns]
+        print(f"{name:>27} | {percentile_ms(handler, 50):>9.2f}ms | {percentile_ms(handler, 95):>9.2f}ms | "
+              f"{percentile_ms(check, 50):>8.2f}ms | {percentile_ms(check, 95):>8.2f}ms | "
+              f"{percentile_ms(total, 50):>7.2f}ms")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks for the memory service")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+
+    retrieval = subcommands.add_parser("retrieval", help="episodic retrieval: Python loop vs EpisodeIndex")
+    retrieval.add_argument("--sizes", type=int, nargs="+", default=[100, 1_000, 10_000, 100_000])
+    retrieval.add_argument("--dim", type=int, default=768, help="embedding size (nomic-embed-text: 768)")
+    retrieval.add_argument("--queries", type=int, default=100, help="retrievals timed per size")
+    retrieval.add_argument("--top-k", type=int, default=3)
+    retrieval.add_argument("--budget", type=float, default=10.0, help="seconds per timing loop before stopping early")
+    retrieval.add_argument("--seed", type=int, default=42)
+
+    chat = subcommands.add_parser("chat", help="/api/chat latency with inline vs background memory maintenance")
+    chat.add_argument("--turns", type=int, default=30)
+    chat.add_argument("--users", type=int, default=3, help="users the turns rotate over")
+    chat.add_argument("--chat-latency", type=float, default=1.0, help="seconds per fake /api/chat call")
+    chat.add_argument("--generate-latency", type=float, default=0.8, help="seconds per fake /api/generate call")
+    chat.add_argument("--embed-latency", type=float, default=0.05, help="seconds per fake embedding call")
+    chat.add_argument("--dim", type=int, default=768)
+    chat.add_argument("--database", default="hw06_benchmark", help="scratch database, dropped before and after")
+
+    database = subcommands.add_parser("db", help="MongoDB time per chat turn without vs with indexes and counters")
+    database.add_argument("--messages", type=int, default=1_000_000, help="messages to seed")
+    database.add_argument("--users", type=int, default=100)
+    database.add_argument("--sessions", type=int, default=10, help="sessions per user")
+    database.add_argument("--turns", type=int, default=200, help="chat turns timed per configuration")
+    database.add_argument("--seed", type=int, default=42)
+    database.add_argument("--database", default="hw06_benchmark", help="scratch database, dropped before and after")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    print("=" * 60)
+    print(f"MEMORY SERVICE BENCHMARK: {args.command}")
+    print("=" * 60)
+    if args.command == "retrieval":
+        run_retrieval(args)
+    elif args.command == "chat":
+        asyncio.run(run_chat(args))
+    elif args.command == "db":
+        asyncio.run(run_db(args))
+
+
+if __name__ == "__main__":
+    main()
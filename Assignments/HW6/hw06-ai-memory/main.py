@@ -1,8 +1,10 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from collections import defaultdict, deque
 from datetime import datetime
-from typing import List
+from typing import Dict, List
+import asyncio
 import os
 from dotenv import load_dotenv
 
@@ -10,12 +12,17 @@ from models import ChatRequest, ChatResponse, MemoryResponse, AggregateResponse
 from memory import (
     call_ollama_chat,
     get_embedding,
-    extract_facts,
-    generate_summary,
     retrieve_relevant_episodes,
     compose_prompt,
+    ensure_indexes,
+    increment_counter,
+    maintain_memory,
+    MemoryMaintenance,
+    StageTimer,
+    start_http_client,
+    close_http_client,
     SHORT_TERM_N,
-    SUMMARIZE_EVERY
+    BACKGROUND_MAINTENANCE
 )
 
 load_dotenv()
@@ -36,14 +43,25 @@ MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017/hw06_db")
 client = AsyncIOMotorClient(MONGODB_URI)
 db = client.hw06_db
 
+# Fact extraction and summaries run here, after /api/chat has replied
+maintenance = MemoryMaintenance()
+
+# Recent per-stage /api/chat timings (ms) for /api/metrics
+METRICS_WINDOW = 1000
+stage_timings: Dict[str, deque] = defaultdict(lambda: deque(maxlen=METRICS_WINDOW))
+
 
 @app.on_event("startup")
 async def startup_db():
+    await start_http_client()
+    await ensure_indexes(db)
     print("✅ Connected to MongoDB")
 
 
 @app.on_event("shutdown")
 async def shutdown_db():
+    await maintenance.stop()
+    await close_http_client()
     client.close()
 
 
@@ -60,7 +78,9 @@ async def chat(request: ChatRequest):
     session_id = request.session_id or "default"
     message = request.message
     
-    # 1. Save user message
+    timer = StageTimer()
+    
+    # 1. Save user message and number it within the session
     user_msg = {
         "user_id": user_id,
         "session_id": session_id,
@@ -68,53 +88,49 @@ async def chat(request: ChatRequest):
         "content": message,
         "created_at": datetime.utcnow()
     }
-    await db.messages.insert_one(user_msg)
+    _, message_number = await timer.run("save_message", asyncio.gather(
+        db.messages.insert_one(user_msg),
+        increment_counter(db, user_id, session_id, "user_messages", user_msg["created_at"])
+    ))
     
     # 2. Get short-term memory (last N messages)
-    short_term = []
-    async for msg in db.messages.find({
-        "user_id": user_id,
-        "session_id": session_id
-    }).sort("created_at", -1).limit(SHORT_TERM_N):
-        short_term.append(msg)
-    short_term.reverse()  # Chronological order
-    
-    # 3. Get long-term summaries
-    session_summary_doc = await db.summaries.find_one({
-        "user_id": user_id,
-        "session_id": session_id,
-        "scope": "session"
-    }, sort=[("created_at", -1)])
-    
-    lifetime_summary_doc = await db.summaries.find_one({
-        "user_id": user_id,
-        "session_id": None,
-        "scope": "user"
-    }, sort=[("created_at", -1)])
-    
-    session_summary = session_summary_doc["text"] if session_summary_doc else None
-    lifetime_summary = lifetime_summary_doc["text"] if lifetime_summary_doc else None
+    async def load_short_term() -> List[Dict]:
+        short_term = []
+        async for msg in db.messages.find({
+            "user_id": user_id,
+            "session_id": session_id
+        }).sort("created_at", -1).limit(SHORT_TERM_N):
+            short_term.append(msg)
+        short_term.reverse()  # Chronological order
+        return short_term
     
-    # 4. Extract and save episodic facts from user message
-    facts = await extract_facts(message)
-    message_embedding = await get_embedding(message)
+    # 4-5. Embed the message and retrieve relevant episodic memories
+    # (its facts are extracted in the background)
+    async def embed_and_retrieve() -> List[Dict]:
+        message_embedding = await timer.run("embedding", get_embedding(message))
+        return await timer.run("retrieval", retrieve_relevant_episodes(
+            db, user_id, session_id, message_embedding, top_k=3
+        ))
     
-    for fact_data in facts:
-        fact_embedding = await get_embedding(fact_data["fact"])
-        episode = {
+    # The context sources are independent, so the prompt is ready when the slowest one is
+    short_term, session_summary_doc, lifetime_summary_doc, relevant_episodes = await timer.run("context", asyncio.gather(
+        timer.run("short_term", load_short_term()),
+        # 3. Get long-term summaries
+        timer.run("session_summary", db.summaries.find_one({
             "user_id": user_id,
             "session_id": session_id,
-            "fact": fact_data["fact"],
-            "importance": fact_data["importance"],
-            "embedding": fact_embedding,
-            "created_at": datetime.utcnow()
-        }
-        await db.episodes.insert_one(episode)
+            "scope": "session"
+        }, sort=[("created_at", -1)])),
+        timer.run("lifetime_summary", db.summaries.find_one({
+            "user_id": user_id,
+            "session_id": None,
+            "scope": "user"
+        }, sort=[("created_at", -1)])),
+        embed_and_retrieve()
+    ))
     
-    # 5. Retrieve relevant episodic memories
-    relevant_episodes = await retrieve_relevant_episodes(
-        db, user_id, session_id, message_embedding, top_k=3
-    )
+    session_summary = session_summary_doc["text"] if session_summary_doc else None
+    lifetime_summary = lifetime_summary_doc["text"] if lifetime_summary_doc else None
     
     # 6. Compose prompt with all memory types
     prompt_messages = await compose_prompt(
@@ -123,7 +139,7 @@ async def chat(request: ChatRequest):
     )
     
     # 7. Call Ollama chat
-    assistant_reply = await call_ollama_chat(prompt_messages)
+    assistant_reply = await timer.run("reply", call_ollama_chat(prompt_messages))
     
     # 8. Save assistant message
     assistant_msg = {
@@ -133,73 +149,43 @@ async def chat(request: ChatRequest):
         "content": assistant_reply,
         "created_at": datetime.utcnow()
     }
-    await db.messages.insert_one(assistant_msg)
+    await timer.run("save_reply", db.messages.insert_one(assistant_msg))
     
-    # 9. Check if we need to summarize
-    user_msg_count = await db.messages.count_documents({
-        "user_id": user_id,
-        "session_id": session_id,
-        "role": "user"
-    })
-    
-    if user_msg_count % SUMMARIZE_EVERY == 0:
-        # Generate session summary
-        recent_msgs = []
-        async for msg in db.messages.find({
-            "user_id": user_id,
-            "session_id": session_id
-        }).sort("created_at", -1).limit(SUMMARIZE_EVERY * 2):
-            recent_msgs.append(msg)
-        recent_msgs.reverse()
-        
-        summary_text = await generate_summary(recent_msgs, "session")
-        
-        await db.summaries.insert_one({
-            "user_id": user_id,
-            "session_id": session_id,
-            "scope": "session",
-            "text": summary_text,
-            "created_at": datetime.utcnow()
-        })
-        
-        # Update lifetime summary every 3 session summaries
-        session_summary_count = await db.summaries.count_documents({
-            "user_id": user_id,
-            "scope": "session"
-        })
-        
-        if session_summary_count % 3 == 0:
-            all_summaries = []
-            async for s in db.summaries.find({
-                "user_id": user_id,
-                "scope": "session"
-            }).sort("created_at", -1).limit(5):
-                all_summaries.append(s)
-            
-            if all_summaries:
-                combined = "\n\n".join([s["text"] for s in all_summaries])
-                lifetime_text = await generate_summary(
-                    [{"role": "user", "content": combined}],
-                    "user"
-                )
-                
-                await db.summaries.insert_one({
-                    "user_id": user_id,
-                    "session_id": None,
-                    "scope": "user",
-                    "text": lifetime_text,
-                    "created_at": datetime.utcnow()
-                })
+    # 9. Fact extraction and summarization do not change this reply, so they run after it
+    job = lambda: maintain_memory(db, user_id, session_id, message, message_number, assistant_msg["created_at"])
+    if BACKGROUND_MAINTENANCE:
+        maintenance.submit(user_id, job)
+    else:
+        await job()
     
     # 10. Return response
+    timer.finish()
+    for stage, ms in timer.timings.items():
+        stage_timings[stage].append(ms)
     return ChatResponse(
         reply=assistant_reply,
         short_term_count=len(short_term),
         long_term_summary=session_summary or lifetime_summary,
-        episodic_facts=[e["fact"] for e in relevant_episodes]
+        episodic_facts=[e["fact"] for e in relevant_episodes],
+        timings=timer.timings if request.debug else None
     )
 
 
+@app.get("/api/metrics")
+async def get_metrics():
+    """Per-stage /api/chat latency over the last METRICS_WINDOW requests"""
+    stages = {}
+    for stage, values in stage_timings.items():
+        ordered = sorted(values)
+        stages[stage] = {
+            "count": len(ordered),
+            "p50_ms": ordered[len(ordered) // 2],
+            "p95_ms": ordered[int(0.95 * (len(ordered) - 1))],
+            "max_ms": ordered[-1]
+        }
+    return {"window": METRICS_WINDOW, "stages": stages, "maintenance_backlog": maintenance.backlog}
+
+
 @app.get("/api/memory/{user_id}", response_model=MemoryResponse)
 async def get_memory(user_id: str, session_id: str = "default"):
     """Get memory view for a user"""
@@ -1,9 +1,14 @@
+import asyncio
 import httpx
 import numpy as np
+import time
+from collections import OrderedDict, deque
 from datetime import datetime
-from typing import List, Optional, Dict
+from typing import Awaitable, Callable, List, Optional, Dict, Tuple
 import os
 from dotenv import load_dotenv
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReturnDocument
+from pymongo.errors import DuplicateKeyError
 
 load_dotenv()
 
@@ -12,35 +17,118 @@ CHAT_MODEL = os.getenv("CHAT_MODEL", "phi3:mini")
 EMBED_MODEL = os.getenv("EMBED_MODEL", "nomic-embed-text")
 SHORT_TERM_N = int(os.getenv("SHORT_TERM_N", "10"))
 SUMMARIZE_EVERY = int(os.getenv("SUMMARIZE_EVERY", "5"))
+EPISODE_CACHE_SESSIONS = int(os.getenv("EPISODE_CACHE_SESSIONS", "256"))
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "16"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+BACKGROUND_MAINTENANCE = os.getenv("BACKGROUND_MAINTENANCE", "true").lower() != "false"
+MAINTENANCE_CONCURRENCY = int(os.getenv("MAINTENANCE_CONCURRENCY", "4"))
+
+# One keep-alive connection pool to Ollama for the whole application
+_http_client: Optional[httpx.AsyncClient] = None
+# Cleared when the Ollama server has no batch /api/embed endpoint (versions before 0.3)
+_batch_embed_supported = True
+
+
+async def start_http_client():
+    """Create the shared Ollama client (FastAPI startup)"""
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            base_url=OLLAMA_BASE_URL,
+            timeout=60.0,
+            limits=httpx.Limits(max_connections=OLLAMA_MAX_CONNECTIONS,
+                                max_keepalive_connections=OLLAMA_MAX_CONNECTIONS)
+        )
+
+
+async def close_http_client():
+    """Close the shared Ollama client (FastAPI shutdown)"""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+async def get_http_client() -> httpx.AsyncClient:
+    """The shared client, created on first use when startup did not run (scripts, benchmarks)"""
+    if _http_client is None:
+        await start_http_client()
+    return _http_client
 
 
 async def call_ollama_chat(messages: List[Dict[str, str]]) -> str:
     """Call Ollama chat API"""
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        response = await client.post(
-            f"{OLLAMA_BASE_URL}/api/chat",
-            json={
-                "model": CHAT_MODEL,
-                "messages": messages,
-                "stream": False
-            }
-        )
-        result = response.json()
-        return result["message"]["content"]
+    client = await get_http_client()
+    response = await client.post(
+        "/api/chat",
+        json={
+            "model": CHAT_MODEL,
+            "messages": messages,
+            "stream": False
+        },
+        timeout=60.0
+    )
+    result = response.json()
+    return result["message"]["content"]
 
 
 async def get_embedding(text: str) -> List[float]:
     """Get embedding from Ollama"""
-    async with httpx.AsyncClient(timeout=30.0) as client:
+    client = await get_http_client()
+    response = await client.post(
+        "/api/embeddings",
+        json={
+            "model": EMBED_MODEL,
+            "prompt": text
+        },
+        timeout=30.0
+    )
+    result = response.json()
+    return result["embedding"]
+
+
+def _ollama_error(response: httpx.Response) -> Optional[str]:
+    """The "error" of an Ollama JSON error body, or None (e.g. the plain-text 404 of an unknown endpoint)"""
+    try:
+        body = response.json()
+    except ValueError:
+        return None
+    return body.get("error") if isinstance(body, dict) else None
+
+
+async def get_embeddings(texts: List[str]) -> List[List[float]]:
+    """
+    Embed several texts in one request to Ollama's list-input /api/embed.
+    Servers without that endpoint get one /api/embeddings request per
+    text instead, at most EMBED_CONCURRENCY at a time. Ollama also answers
+    404 for a model that has not been pulled; that, like any other error
+    status, raises httpx.HTTPStatusError and leaves batching on.
+    """
+    global _batch_embed_supported
+    if not texts:
+        return []
+    if _batch_embed_supported:
+        client = await get_http_client()
         response = await client.post(
-            f"{OLLAMA_BASE_URL}/api/embeddings",
+            "/api/embed",
             json={
                 "model": EMBED_MODEL,
-                "prompt": text
-            }
+                "input": texts
+            },
+            timeout=30.0
         )
-        result = response.json()
-        return result["embedding"]
+        if response.status_code != 404 or _ollama_error(response) is not None:
+            response.raise_for_status()
+            return response.json()["embeddings"]
+        _batch_embed_supported = False
+    
+    semaphore = asyncio.Semaphore(EMBED_CONCURRENCY)
+    
+    async def embed_one(text: str) -> List[float]:
+        async with semaphore:
+            return await get_embedding(text)
+    
+    return list(await asyncio.gather(*(embed_one(text) for text in texts)))
 
 
 def cosine_similarity(a: List[float], b: List[float]) -> float:
@@ -65,17 +153,18 @@ IMPORTANCE: [0.0-1.0]
 
 (repeat for each fact, max 3)"""
 
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        response = await client.post(
-            f"{OLLAMA_BASE_URL}/api/generate",
-            json={
-                "model": CHAT_MODEL,
-                "prompt": prompt,
-                "stream": False
-            }
-        )
-        result = response.json()
-        text = result["response"]
+    client = await get_http_client()
+    response = await client.post(
+        "/api/generate",
+        json={
+            "model": CHAT_MODEL,
+            "prompt": prompt,
+            "stream": False
+        },
+        timeout=30.0
+    )
+    result = response.json()
+    text = result["response"]
     
     # Parse facts
     facts = []
@@ -114,38 +203,388 @@ Conversation:
 
 Summary (bullet points):"""
 
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        response = await client.post(
-            f"{OLLAMA_BASE_URL}/api/generate",
-            json={
-                "model": CHAT_MODEL,
-                "prompt": prompt,
-                "stream": False
-            }
+    client = await get_http_client()
+    response = await client.post(
+        "/api/generate",
+        json={
+            "model": CHAT_MODEL,
+            "prompt": prompt,
+            "stream": False
+        },
+        timeout=60.0
+    )
+    result = response.json()
+    return result["response"].strip()
+
+
+class EpisodeIndex:
+    """Episodes of one (user, session): unit-length float32 embeddings as rows of one matrix"""
+    
+    def __init__(self):
+        self.facts: List[str] = []
+        self.ids = set()
+        self._matrix = None
+        self._importance = np.empty(0, dtype=np.float32)
+        self._size = 0
+    
+    def __len__(self):
+        return self._size
+    
+    def append(self, episodes: List[Dict]):
+        """Add episodes with an embedding, skipping ones already indexed (by _id)"""
+        episodes = [e for e in episodes if e.get("embedding") and (e.get("_id") is None or e["_id"] not in self.ids)]
+        if self._matrix is not None:
+            # An embedding model change leaves old-sized vectors behind; they cannot be scored
+            episodes = [e for e in episodes if len(e["embedding"]) == self._matrix.shape[1]]
+        if not episodes:
+            return
+        
+        vectors = np.array([e["embedding"] for e in episodes], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms == 0, 1, norms)
+        
+        needed = self._size + len(vectors)
+        if self._matrix is None or needed > len(self._matrix):
+            # Grow by doubling so a stream of single appends stays amortized O(1)
+            matrix = np.empty((max(needed, 2 * self._size, 16), vectors.shape[1]), dtype=np.float32)
+            importance = np.empty(len(matrix), dtype=np.float32)
+            if self._matrix is not None:
+                matrix[:self._size] = self._matrix[:self._size]
+                importance[:self._size] = self._importance[:self._size]
+            self._matrix, self._importance = matrix, importance
+        self._matrix[self._size:needed] = vectors
+        self._importance[self._size:needed] = [e["importance"] for e in episodes]
+        self._size = needed
+        self.facts.extend(e["fact"] for e in episodes)
+        self.ids.update(e["_id"] for e in episodes if e.get("_id") is not None)
+    
+    def top_k(self, query_embedding: List[float], top_k: int = 3) -> List[Dict]:
+        """Best episodes by similarity * importance: one matrix-vector product, then argpartition"""
+        if not self._size or top_k <= 0:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        if query.shape[0] != self._matrix.shape[1]:
+            return []
+        query_norm = np.linalg.norm(query)
+        similarities = self._matrix[:self._size] @ (query / (query_norm or 1))
+        scores = similarities * self._importance[:self._size]
+        k = min(top_k, self._size)
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [
+            {"fact": self.facts[i], "importance": float(self._importance[i]), "similarity": float(similarities[i])}
+            for i in best
+        ]
+
+
+class EpisodeCache:
+    """
+    LRU of EpisodeIndex per (user_id, session_id), so retrieval reads a
+    session's episodes from MongoDB once and then scores them in memory.
+    Episodes saved with add_episodes() are appended to a loaded index. The
+    cache is per process: run a single worker, or episodes inserted by
+    another process only show up after this one evicts and reloads.
+    """
+    
+    def __init__(self, max_sessions: int = EPISODE_CACHE_SESSIONS):
+        self.max_sessions = max_sessions
+        self._indexes: "OrderedDict[Tuple[str, str], EpisodeIndex]" = OrderedDict()
+        self._loading: Dict[Tuple[str, str], List[Dict]] = {}  # episodes added while a load is in flight
+    
+    async def get(self, db, user_id: str, session_id: str) -> EpisodeIndex:
+        key = (user_id, session_id)
+        if key in self._indexes:
+            self._indexes.move_to_end(key)
+            return self._indexes[key]
+        
+        self._loading.setdefault(key, [])
+        index = EpisodeIndex()
+        batch = []
+        try:
+            async for episode in db.episodes.find(
+                {"user_id": user_id, "session_id": session_id},
+                {"fact": 1, "importance": 1, "embedding": 1}
+            ):
+                batch.append(episode)
+                if len(batch) == 1000:
+                    index.append(batch)
+                    batch = []
+        except Exception:
+            self._loading.pop(key, None)
+            raise
+        index.append(batch)
+        
+        if key in self._indexes:  # a concurrent request finished loading first
+            return self._indexes[key]
+        index.append(self._loading.pop(key, []))
+        self._indexes[key] = index
+        while len(self._indexes) > self.max_sessions:
+            self._indexes.popitem(last=False)
+        return index
+    
+    def add(self, user_id: str, session_id: str, episodes: List[Dict]):
+        """Append newly inserted episodes (with their _id) to the session's index, if it is loaded"""
+        key = (user_id, session_id)
+        if key in self._indexes:
+            self._indexes[key].append(episodes)
+        elif key in self._loading:
+            self._loading[key].extend(episodes)
+
+
+episode_cache = EpisodeCache()
+
+
+async def save_episodes(db, episodes: List[Dict]):
+    """Insert episode documents and append them to the in-memory retrieval cache"""
+    if not episodes:
+        return
+    await db.episodes.insert_many(episodes)  # sets each document's _id
+    for user_id, session_id in {(e["user_id"], e["session_id"]) for e in episodes}:
+        episode_cache.add(user_id, session_id,
+                          [e for e in episodes if e["user_id"] == user_id and e["session_id"] == session_id])
+
+
+# One compound index per query shape: equality fields first, then the created_at sort
+INDEXES = {
+    "messages": [
+        # short-term history, summary input, /api/memory; its user_id prefix serves /api/aggregate
+        IndexModel([("user_id", ASCENDING), ("session_id", ASCENDING), ("created_at", DESCENDING)],
+                   name="user_session_created"),
+    ],
+    "summaries": [
+        # latest session summary, and the lifetime summary (session_id None)
+        IndexModel([("user_id", ASCENDING), ("session_id", ASCENDING), ("scope", ASCENDING), ("created_at", DESCENDING)],
+                   name="user_session_scope_created"),
+        # recent session summaries across sessions, for the lifetime summary
+        IndexModel([("user_id", ASCENDING), ("scope", ASCENDING), ("created_at", DESCENDING)],
+                   name="user_scope_created"),
+        # recent summaries of any scope, for /api/aggregate
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)], name="user_created"),
+    ],
+    "episodes": [
+        # episode cache loads and /api/memory
+        IndexModel([("user_id", ASCENDING), ("session_id", ASCENDING), ("created_at", DESCENDING)],
+                   name="user_session_created"),
+    ],
+}
+
+
+async def ensure_indexes(db):
+    """Create INDEXES (FastAPI startup). A no-op for indexes that already exist"""
+    for collection, indexes in INDEXES.items():
+        await db[collection].create_indexes(indexes)
+
+
+async def count_before(db, user_id: str, session_id: Optional[str], field: str, before: datetime) -> int:
+    """What a counter would have reached from the documents written before `before`"""
+    if field == "user_messages":
+        return await db.messages.count_documents({
+            "user_id": user_id,
+            "session_id": session_id,
+            "role": "user",
+            "created_at": {"$lt": before}
+        })
+    if field == "session_summaries":
+        return await db.summaries.count_documents({
+            "user_id": user_id,
+            "scope": "session",
+            "created_at": {"$lt": before}
+        })
+    raise ValueError(f"Unknown counter: {field}")
+
+
+async def increment_counter(db, user_id: str, session_id: Optional[str], field: str, before: datetime) -> int:
+    """
+    Atomically add one to a counter and return its new value. Counters live
+    in one document per (user, session), and per user with session_id None,
+    so nothing has to count documents to find out where a session stands.
+    A counter used for the first time, e.g. by a session older than the
+    counters, is seeded once with count_before(..., before), `before` being
+    the creation time of the document being counted.
+    """
+    key = {"_id": {"user_id": user_id, "session_id": session_id}}
+    counters = await db.counters.find_one_and_update(
+        {**key, field: {"$exists": True}},
+        {"$inc": {field: 1}},
+        return_document=ReturnDocument.AFTER
+    )
+    if counters is None:
+        # Of concurrent first uses only one seed lands; the others find the field set
+        # (no match, and the upsert's insert collides with the existing _id)
+        seed = await count_before(db, user_id, session_id, field, before)
+        try:
+            await db.counters.update_one({**key, field: {"$exists": False}}, {"$set": {field: seed}}, upsert=True)
+        except DuplicateKeyError:
+            pass
+        counters = await db.counters.find_one_and_update(
+            key,
+            {"$inc": {field: 1}},
+            return_document=ReturnDocument.AFTER
         )
-        result = response.json()
-        return result["response"].strip()
+    return counters[field]
 
 
 async def retrieve_relevant_episodes(db, user_id: str, session_id: str, query_embedding: List[float], top_k: int = 3) -> List[Dict]:
-    """Retrieve top-k relevant episodic memories"""
+    """Retrieve top-k relevant episodic memories, ranked by similarity * importance"""
+    index = await episode_cache.get(db, user_id, session_id)
+    return index.top_k(query_embedding, top_k)
+
+
+class StageTimer:
+    """Wall-clock milliseconds of each named stage of one request"""
+    
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+        self._start = time.perf_counter()
+    
+    async def run(self, name: str, awaitable: Awaitable):
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.timings[name] = round((time.perf_counter() - start) * 1000, 2)
+    
+    def finish(self):
+        """Record the time since the timer was created as the "total" stage"""
+        self.timings["total"] = round((time.perf_counter() - self._start) * 1000, 2)
+
+
+async def maintain_memory(db, user_id: str, session_id: str, message: str, message_number: int,
+                          until: datetime):
+    """
+    Memory housekeeping for one user message, the message_number-th of its
+    session: extract and store its facts, then write a session summary every
+    SUMMARIZE_EVERY user messages and a lifetime summary every 3 session
+    summaries. Session summaries cover messages up to `until`, the end of
+    the message's turn, however late the job runs.
+    """
+    # 1. Extract and save episodic facts from the user message
+    facts = await extract_facts(message)
+    embeddings = await get_embeddings([fact_data["fact"] for fact_data in facts])
+    
     episodes = []
+    for fact_data, fact_embedding in zip(facts, embeddings):
+        episodes.append({
+            "user_id": user_id,
+            "session_id": session_id,
+            "fact": fact_data["fact"],
+            "importance": fact_data["importance"],
+            "embedding": fact_embedding,
+            "created_at": datetime.utcnow()
+        })
+    await save_episodes(db, episodes)
+    
+    # 2. Check if we need to summarize. The handler numbered the message, since
+    # the user may have sent more while this job waited in the queue
+    if message_number % SUMMARIZE_EVERY == 0:
+        # Generate session summary
+        recent_msgs = []
+        async for msg in db.messages.find({
+            "user_id": user_id,
+            "session_id": session_id,
+            "created_at": {"$lte": until}
+        }).sort("created_at", -1).limit(SUMMARIZE_EVERY * 2):
+            recent_msgs.append(msg)
+        recent_msgs.reverse()
+        
+        summary_text = await generate_summary(recent_msgs, "session")
+        
+        session_summary = {
+            "user_id": user_id,
+            "session_id": session_id,
+            "scope": "session",
+            "text": summary_text,
+            "created_at": datetime.utcnow()
+        }
+        await db.summaries.insert_one(session_summary)
+        
+        # Update lifetime summary every 3 session summaries (of any session;
+        # this user's jobs run one at a time, so the count cannot skip)
+        session_summary_count = await increment_counter(
+            db, user_id, None, "session_summaries", session_summary["created_at"]
+        )
+        
+        if session_summary_count % 3 == 0:
+            all_summaries = []
+            async for s in db.summaries.find({
+                "user_id": user_id,
+                "scope": "session"
+            }).sort("created_at", -1).limit(5):
+                all_summaries.append(s)
+            
+            if all_summaries:
+                combined = "\n\n".join([s["text"] for s in all_summaries])
+                lifetime_text = await generate_summary(
+                    [{"role": "user", "content": combined}],
+                    "user"
+                )
+                
+                await db.summaries.insert_one({
+                    "user_id": user_id,
+                    "session_id": None,
+                    "scope": "user",
+                    "text": lifetime_text,
+                    "created_at": datetime.utcnow()
+                })
+
+
+class MemoryMaintenance:
+    """
+    Background runner for maintain_memory jobs. At most `concurrency` jobs
+    run at once, and jobs of one user run one after another in submission
+    order (their summaries depend on the previous job's writes); different
+    users proceed in parallel. Failures are logged and do not stop the queue.
+    """
+    
+    def __init__(self, concurrency: int = MAINTENANCE_CONCURRENCY):
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._pending: Dict[str, deque] = {}  # user_id -> jobs, the head one running or waiting for a slot
+        self._tasks = set()
+    
+    @property
+    def backlog(self) -> int:
+        return sum(len(jobs) for jobs in self._pending.values())
+    
+    def submit(self, user_id: str, job: Callable[[], Awaitable]):
+        """Queue job (a coroutine function) behind the user's earlier jobs"""
+        if user_id in self._pending:
+            self._pending[user_id].append(job)
+            return
+        self._pending[user_id] = deque([job])
+        task = asyncio.create_task(self._run_user(user_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    async def _run_user(self, user_id: str):
+        jobs = self._pending[user_id]
+        try:
+            while jobs:
+                async with self._semaphore:
+                    try:
+                        await jobs[0]()
+                    except Exception as e:
+                        print(f"⚠️ Memory maintenance failed for {user_id}: {e!r}")
+                jobs.popleft()
+        finally:
+            del self._pending[user_id]
+    
+    async def drain(self, timeout: Optional[float] = None) -> bool:
+        """Wait for every queued job to finish; False if timeout passed first"""
+        deadline = None if timeout is None else asyncio.get_running_loop().time() + timeout
+        while self._tasks:
+            remaining = None if deadline is None else deadline - asyncio.get_running_loop().time()
+            if remaining is not None and remaining <= 0:
+                return False
+            await asyncio.wait(set(self._tasks), timeout=remaining)
+        return True
     
-    async for episode in db.episodes.find({
-        "user_id": user_id,
-        "session_id": session_id
-    }):
-        if "embedding" in episode and episode["embedding"]:
-            similarity = cosine_similarity(query_embedding, episode["embedding"])
-            episodes.append({
-                "fact": episode["fact"],
-                "importance": episode["importance"],
-                "similarity": similarity
-            })
-    
-    # Sort by similarity * importance
-    episodes.sort(key=lambda x: x["similarity"] * x["importance"], reverse=True)
-    return episodes[:top_k]
+    async def stop(self, timeout: float = 30.0):
+        """Finish queued jobs (up to timeout), then cancel what is left"""
+        if not await self.drain(timeout):
+            print(f"⚠️ Cancelling {self.backlog} unfinished memory maintenance jobs")
+            for task in list(self._tasks):
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
 
 
 async def compose_prompt(
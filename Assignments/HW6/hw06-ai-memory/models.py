@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Optional, List
+from typing import Dict, Optional, List
 from pydantic import BaseModel, Field
 
 # Pydantic Models for API
@@ -7,12 +7,14 @@ class ChatRequest(BaseModel):
     user_id: str
     session_id: Optional[str] = "default"
     message: str
+    debug: bool = False  # return per-stage timings with the reply
 
 class ChatResponse(BaseModel):
     reply: str
     short_term_count: int
     long_term_summary: Optional[str] = None
     episodic_facts: List[str] = []
+    timings: Optional[Dict[str, float]] = None  # milliseconds per stage, when debug was requested
 
 class MemoryResponse(BaseModel):
     messages: List[dict]
@@ -0,0 +1,468 @@
+import asyncio
+import os
+import queue
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Iterable
+
+import redis
+import redis.asyncio as aioredis
+
+from demo_og import (
+    DatabaseWithCache,
+    JsonCodec,
+    DIRTY_VIEWS_KEY,
+    INVALIDATE_TAGS_SCRIPT,
+    INVALIDATION_CHANNEL,
+    NEGATIVE_ENTRY,
+    SQLITE_MAX_PARAMS,
+    UPDATABLE_USER_FIELDS,
+    setup_database,
+    seed_users,
+    unwrap_entry,
+)
+
+class SQLitePool:
+    """
+    Fixed-size pool of SQLite connections, each used by one executor thread
+    at a time. The database runs in WAL mode: readers never block each other
+    or the writer, and a writer waits up to `timeout` seconds for another.
+    """
+
+    def __init__(self, db_name: str, size: int = 8, timeout: float = 30.0):
+        self._temp_path = None
+        if db_name == ":memory:":
+            # A plain :memory: database is private to one connection. A shared-cache one would
+            # put the pool on table-level locks, whose conflicts (SQLITE_LOCKED) busy_timeout
+            # does not retry, so use a private temporary file instead
+            fd, db_name = tempfile.mkstemp(prefix="async_cache_", suffix=".db")
+            os.close(fd)
+            self._temp_path = db_name
+        self.size = size
+        self._connections: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        for _ in range(size):
+            conn = sqlite3.connect(db_name, check_same_thread=False, timeout=timeout)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._connections.put(conn)
+
+    def run(self, fn):
+        """Call fn(conn) with a pooled connection (blocking; runs on an executor thread)"""
+        conn = self._connections.get()
+        try:
+            return fn(conn)
+        finally:
+            self._connections.put(conn)
+
+    def close(self):
+        for _ in range(self.size):
+            self._connections.get().close()
+        if self._temp_path is not None:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(self._temp_path + suffix):
+                    os.remove(self._temp_path + suffix)
+
+
+class AsyncDatabaseWithCache:
+    """
+    asyncio counterpart of DatabaseWithCache for async web servers.
+    Redis is reached through redis.asyncio with a bounded connection pool, and
+    SQLite queries run on a thread executor backed by a pool of connections,
+    so slow queries never block the event loop.
+
+    Keys, tags, codecs and the write-behind view counters are the same as in
+    DatabaseWithCache, so both can share one Redis. Entries are stored in the
+    plain (non stampede-safe) format; wrapped entries written by a
+    stampede-safe instance are unwrapped on read. Missing user ids are
+    cached as NEGATIVE_ENTRY for negative_ttl seconds (0 disables), but
+    there is no Bloom filter in front of them.
+    """
+
+    def __init__(self, db_name: str = "demo.db", redis_host: str = "localhost", redis_port: int = 6379,
+                 verbose: bool = True, simulate_latency: bool = True,
+                 max_connections: int = 64, sqlite_pool_size: int = 8,
+                 codec=None, view_flush_interval: float = 1.0, negative_ttl: int = 30):
+        self.verbose = verbose
+        self.simulate_latency = simulate_latency
+        self.codec = codec or JsonCodec()
+        self.view_flush_interval = view_flush_interval
+        self.negative_ttl = negative_ttl
+        self.db_queries = 0
+        self.l2_hits = self.l2_misses = 0
+        self.negative_hits = 0
+
+        # Callers beyond max_connections wait for a free connection instead of failing
+        self.redis_client = aioredis.Redis(connection_pool=aioredis.BlockingConnectionPool(
+            host=redis_host, port=redis_port, max_connections=max_connections, decode_responses=True))
+        # Cached values go through the codec as raw bytes
+        self.binary_client = aioredis.Redis(connection_pool=aioredis.BlockingConnectionPool(
+            host=redis_host, port=redis_port, max_connections=max_connections, decode_responses=False))
+        self._invalidate_tags_script = self.redis_client.register_script(INVALIDATE_TAGS_SCRIPT)
+
+        self._sqlite = SQLitePool(db_name, sqlite_pool_size)
+        self._executor = ThreadPoolExecutor(max_workers=sqlite_pool_size, thread_name_prefix="sqlite")
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def connect(self):
+        """Check Redis, prepare the database and start the view count flusher"""
+        try:
+            await self.redis_client.ping()
+            self._log("✓ Connected to Redis successfully")
+        except redis.ConnectionError:
+            print("✗ Failed to connect to Redis. Make sure Redis is running!")
+            raise
+
+        await self._run_db(lambda conn: setup_database(conn, self._log), count=False)
+        self._flush_task = asyncio.create_task(self._flush_loop())
+        return self
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _log(self, message: str):
+        """Print a progress message unless running quietly (benchmarks)"""
+        if self.verbose:
+            print(message)
+
+    async def _run_db(self, fn, delay: float = 0.0, count: bool = True):
+        """Run fn(conn) on the SQLite executor; `delay` simulates a slow query"""
+        def task(conn):
+            if self.simulate_latency and delay:
+                time.sleep(delay)  # A slow query holds its connection, like a real one
+            return fn(conn)
+
+        if count:
+            self.db_queries += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._sqlite.run, task)
+
+    async def seed_users(self, count: int):
+        """Add synthetic users until the table holds at least `count` rows"""
+        await self._run_db(lambda conn: seed_users(conn, count, self._log), count=False)
+
+    async def _fetch_user(self, user_id: int) -> Optional[Dict]:
+        def query(conn):
+            row = conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+            return dict(row) if row else None
+        return await self._run_db(query, delay=0.1)
+
+    async def _fetch_users_by_city(self, city: str) -> List[Dict]:
+        def query(conn):
+            return [dict(row) for row in conn.execute("SELECT * FROM users WHERE city = ?", (city,))]
+        return await self._run_db(query, delay=0.15)
+
+    async def _cache_get(self, cache_key: str):
+        cached_data = await self.binary_client.get(cache_key)
+        if cached_data is None:
+            self.l2_misses += 1
+            return None
+        self.l2_hits += 1
+        return unwrap_entry(self.codec.decode(cached_data))
+
+    async def _cache_set(self, cache_key: str, value, ttl: int, pipe=None, tags: Iterable[str] = ()):
+        """Write a value and register it under its tags (see DatabaseWithCache._cache_set)"""
+        own_pipe = pipe is None
+        pipe = pipe if pipe is not None else self.binary_client.pipeline(transaction=False)
+        pipe.setex(cache_key, ttl, self.codec.encode(value))
+        for tag in tags:
+            tag_key = f"tag:{tag}"
+            pipe.sadd(tag_key, cache_key)
+            pipe.expire(tag_key, ttl, nx=True)
+            pipe.expire(tag_key, ttl, gt=True)
+        if own_pipe:
+            await pipe.execute()
+
+    async def _invalidate_tags(self, tags: Iterable[str], extra_keys: Iterable[str] = ()) -> List[str]:
+        """Delete every key depending on the tags in one round trip and notify L1 caches"""
+        extra_keys = list(extra_keys)
+        deleted = await self._invalidate_tags_script(keys=[f"tag:{tag}" for tag in tags], args=extra_keys)
+        pipe = self.redis_client.pipeline(transaction=False)
+        for key in dict.fromkeys(deleted + extra_keys):
+            pipe.publish(INVALIDATION_CHANNEL, key)
+        await pipe.execute()
+        return deleted
+
+    def _from_cache(self, value):
+        """Translate a cached value for callers: negative entries mean 'no such row'"""
+        if value == NEGATIVE_ENTRY:
+            self.negative_hits += 1
+            return None
+        return value
+
+    async def get_user_by_id_no_cache(self, user_id: int) -> Optional[Dict]:
+        """Get user from database WITHOUT caching"""
+        return await self._fetch_user(user_id)
+
+    async def get_user_by_id_with_cache(self, user_id: int, ttl: int = 300) -> Optional[Dict]:
+        """Get user from database WITH Redis caching"""
+        cache_key = f"user:{user_id}"
+
+        cached_data = await self._cache_get(cache_key)
+        if cached_data is not None:
+            self._log(f"  → CACHE HIT for user {user_id}")
+            return self._from_cache(cached_data)
+
+        self._log(f"  → CACHE MISS for user {user_id} - querying database")
+        user_data = await self._fetch_user(user_id)
+        if user_data:
+            await self._cache_set(cache_key, user_data, ttl, tags=DatabaseWithCache._user_tags(user_data))
+            self._log(f"  → Cached user {user_id} for {ttl} seconds")
+        elif self.negative_ttl:
+            await self._cache_set(cache_key, NEGATIVE_ENTRY, self.negative_ttl)
+            self._log(f"  → Cached missing user {user_id} for {self.negative_ttl} seconds")
+        return user_data
+
+    async def get_users_by_city(self, city: str, use_cache: bool = True, ttl: int = 300) -> List[Dict]:
+        """Get all users from a specific city"""
+        cache_key = f"users:city:{city}"
+
+        if use_cache:
+            cached_data = await self._cache_get(cache_key)
+            if cached_data is not None:
+                self._log(f"  → CACHE HIT for city '{city}'")
+                return cached_data
+            self._log(f"  → CACHE MISS for city '{city}'")
+
+        users = await self._fetch_users_by_city(city)
+
+        if use_cache:
+            await self._cache_set(cache_key, users, ttl, tags=DatabaseWithCache._city_tags(city, users))
+            self._log(f"  → Cached {len(users)} users for city '{city}'")
+        return users
+
+    async def get_users_by_ids(self, user_ids: Iterable[int], ttl: int = 300) -> List[Optional[Dict]]:
+        """Batched lookup: one MGET, one SELECT ... IN (...) for the misses, one pipelined backfill"""
+        user_ids = list(user_ids)
+        if not user_ids:
+            return []
+
+        cached_values = await self.binary_client.mget([f"user:{user_id}" for user_id in user_ids])
+        results: List[Optional[Dict]] = [
+            unwrap_entry(self.codec.decode(cached_data)) if cached_data is not None else None
+            for cached_data in cached_values
+        ]
+        missing_ids = list(dict.fromkeys(uid for uid, value in zip(user_ids, results) if value is None))
+        self._log(f"  → Batch lookup: {len(user_ids) - results.count(None)} hits, {results.count(None)} misses")
+
+        if missing_ids:
+            def query(conn):
+                found = {}
+                for start in range(0, len(missing_ids), SQLITE_MAX_PARAMS):
+                    chunk = missing_ids[start:start + SQLITE_MAX_PARAMS]
+                    placeholders = ",".join("?" * len(chunk))
+                    for row in conn.execute(f"SELECT * FROM users WHERE id IN ({placeholders})", chunk):
+                        found[row["id"]] = dict(row)
+                return found
+
+            found = await self._run_db(query, delay=0.1)
+            pipe = self.binary_client.pipeline(transaction=False)
+            for user_id, user_data in found.items():
+                await self._cache_set(f"user:{user_id}", user_data, ttl, pipe,
+                                      tags=DatabaseWithCache._user_tags(user_data))
+            if self.negative_ttl:
+                for user_id in missing_ids:
+                    if user_id not in found:
+                        await self._cache_set(f"user:{user_id}", NEGATIVE_ENTRY, self.negative_ttl, pipe)
+            await pipe.execute()
+
+            results = [value if value is not None else found.get(uid) for uid, value in zip(user_ids, results)]
+        return [self._from_cache(value) for value in results]
+
+    async def invalidate_user_cache(self, user_id: int):
+        """Remove user (and every cached list containing them) from cache"""
+        deleted = await self._invalidate_tags([f"user:{user_id}"], extra_keys=[f"user:{user_id}"])
+        if deleted:
+            self._log(f"✓ Invalidated cache for user {user_id} ({len(deleted)} keys)")
+        else:
+            self._log(f"  No cache entry found for user {user_id}")
+
+    async def update_user(self, user_id: int, **fields) -> Optional[Dict]:
+        """Update a user and invalidate exactly the dependent cache entries (see DatabaseWithCache.update_user)"""
+        unknown = set(fields) - set(UPDATABLE_USER_FIELDS)
+        if unknown:
+            raise ValueError(f"Cannot update user fields: {', '.join(sorted(unknown))}")
+
+        def update(conn):
+            row = conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+            if row is None or not fields:
+                return dict(row) if row else None
+            assignments = ", ".join(f"{column} = ?" for column in fields)
+            with conn:
+                conn.execute(f"UPDATE users SET {assignments} WHERE id = ?", (*fields.values(), user_id))
+            return dict(row)
+
+        old_user = await self._run_db(update)
+        if old_user is None:
+            return None
+        new_user = {**old_user, **fields}
+
+        tags = {f"user:{user_id}", f"city:{old_user['city']}", f"city:{new_user['city']}"}
+        deleted = await self._invalidate_tags(sorted(tags), extra_keys=[f"user:{user_id}"])
+        self._log(f"✓ Updated user {user_id}; invalidated {len(deleted)} dependent keys")
+        return new_user
+
+    async def clear_all_cache(self):
+        """Clear all cached data"""
+        await self.redis_client.flushdb()
+        await self.redis_client.publish(INVALIDATION_CHANNEL, "*")
+        self._log("✓ Cleared all cache data")
+
+    async def increment_post_views(self, post_id: int) -> int:
+        """Increment a post's view count in Redis; the flusher syncs it to the database"""
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.incr(f"views:post:{post_id}")
+        pipe.sadd(DIRTY_VIEWS_KEY, post_id)
+        view_count, _ = await pipe.execute()
+        return view_count
+
+    async def flush_view_counts(self) -> int:
+        """Drain the dirty-post set and write every count in one transaction"""
+        pipe = self.redis_client.pipeline()
+        pipe.smembers(DIRTY_VIEWS_KEY)
+        pipe.delete(DIRTY_VIEWS_KEY)
+        post_ids, _ = await pipe.execute()
+        if not post_ids:
+            return 0
+
+        post_ids = sorted(post_ids, key=int)
+        counts = await self.redis_client.mget([f"views:post:{post_id}" for post_id in post_ids])
+        rows = [(int(count), int(post_id)) for post_id, count in zip(post_ids, counts) if count is not None]
+
+        def write(conn):
+            with conn:
+                conn.executemany("UPDATE users SET views = ? WHERE id = ?", rows)
+
+        try:
+            await self._run_db(write, count=False)
+        except Exception:
+            # Keep the posts dirty so the next flush retries them
+            await self.redis_client.sadd(DIRTY_VIEWS_KEY, *post_ids)
+            raise
+        self._log(f"✓ Synced views for {len(rows)} posts to database")
+        return len(rows)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.view_flush_interval)
+            try:
+                await self.flush_view_counts()
+            except Exception as e:
+                print(f"✗ View count flush failed: {e}")
+
+    async def close(self):
+        """Flush pending view counts and close database and Redis connections"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+        await self.flush_view_counts()
+        await self.redis_client.aclose()
+        await self.binary_client.aclose()
+        self._executor.shutdown(wait=True)
+        self._sqlite.close()
+
+
+def _pick_operation(rng: random.Random, users: int):
+    """80% user lookups, 10% city lookups, 8% view increments, 2% user updates (concurrent SQLite writers)"""
+    roll = rng.random()
+    if roll < 0.8:
+        return "user", rng.randint(1, users)
+    if roll < 0.9:
+        return "city", rng.choice(["New York", "Chicago", "Boston", "Seattle", "Austin"])
+    if roll < 0.98:
+        return "views", rng.randint(1, users)
+    return "update", rng.randint(1, users)
+
+
+def _run_sync_operation(db: DatabaseWithCache, operation):
+    kind, arg = operation
+    if kind == "user":
+        db.get_user_by_id_with_cache(arg)
+    elif kind == "city":
+        db.get_users_by_city(arg)
+    elif kind == "views":
+        db.increment_post_views(arg)
+    else:
+        db.update_user(arg, age=20 + arg % 50)
+
+
+async def _run_async_operation(db: AsyncDatabaseWithCache, operation):
+    kind, arg = operation
+    if kind == "user":
+        await db.get_user_by_id_with_cache(arg)
+    elif kind == "city":
+        await db.get_users_by_city(arg)
+    elif kind == "views":
+        await db.increment_post_views(arg)
+    else:
+        await db.update_user(arg, age=20 + arg % 50)
+
+
+async def run_load_test(concurrency: int = 200, requests_per_client: int = 25, users: int = 2000,
+                        simulate_latency: bool = False, sqlite_pool_size: int = 32):
+    """
+    Throughput of `concurrency` clients against the synchronous class (called
+    inline, as an async handler would, and from a thread pool) and against
+    AsyncDatabaseWithCache with one coroutine per client
+    """
+    print("=" * 60)
+    print(f"=== Load Test: {concurrency} concurrent clients ===")
+    print("=" * 60)
+
+    rng = random.Random(42)
+    workload = [[_pick_operation(rng, users) for _ in range(requests_per_client)] for _ in range(concurrency)]
+    total_ops = concurrency * requests_per_client
+    print(f"{total_ops} operations over {users} users "
+          f"({'simulated' if simulate_latency else 'real'} SQLite latency)\n")
+
+    results = {}
+
+    sync_db = DatabaseWithCache(db_name=":memory:", verbose=False, simulate_latency=simulate_latency)
+    sync_db.seed_users(users)
+
+    # A sync call inside an async handler blocks the event loop: requests run one at a time
+    sync_db.clear_all_cache()
+    start = time.perf_counter()
+    for client_ops in workload:
+        for operation in client_ops:
+            _run_sync_operation(sync_db, operation)
+    results["sync (inline in event loop)"] = total_ops / (time.perf_counter() - start)
+
+    sync_db.clear_all_cache()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(lambda ops: [_run_sync_operation(sync_db, op) for op in ops], workload))
+    results[f"sync ({concurrency} threads)"] = total_ops / (time.perf_counter() - start)
+    sync_db.close()
+
+    async with AsyncDatabaseWithCache(db_name=":memory:", verbose=False, simulate_latency=simulate_latency,
+                                      sqlite_pool_size=sqlite_pool_size) as db:
+        await db.seed_users(users)
+        await db.clear_all_cache()
+
+        async def client(ops):
+            for operation in ops:
+                await _run_async_operation(db, operation)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client(ops) for ops in workload))
+        results[f"async ({concurrency} coroutines, {sqlite_pool_size} DB threads)"] = \
+            total_ops / (time.perf_counter() - start)
+        await db.clear_all_cache()
+
+    baseline = next(iter(results.values()))
+    for label, ops_per_sec in results.items():
+        print(f"{label:>42}: {ops_per_sec:>10,.0f} ops/sec ({ops_per_sec / baseline:.1f}x)")
+
+
+if __name__ == "__main__":
+    asyncio.run(run_load_test(simulate_latency="simulated" in sys.argv[1:]))
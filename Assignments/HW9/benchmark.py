@@ -0,0 +1,283 @@
+"""
+Workload benchmark for DatabaseWithCache / AsyncDatabaseWithCache.
+
+Seeds N users into a SQLite file, replays a configurable workload (key
+popularity, read/write mix, thread or coroutine concurrency) against the real
+SQLite cost (no simulated sleeps) and reports throughput, latency percentiles
+and the cache hit ratio over time. Results are written as JSON so runs can be
+compared across changes:
+
+    python benchmark.py --users 1000000 --ops 200000 --concurrency 32 --output before.json
+    python benchmark.py --users 1000000 --ops 200000 --concurrency 32 --l1 --output after.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import platform
+import random
+import sqlite3
+import threading
+import time
+from typing import Dict, List
+
+from demo_og import CITIES, DatabaseWithCache, setup_database, seed_users
+
+
+class KeyChooser:
+    """Draw user ids with uniform or Zipfian popularity"""
+
+    def __init__(self, users: int, distribution: str = "zipf", zipf_s: float = 1.1, seed: int = 42):
+        if distribution not in ("zipf", "uniform"):
+            raise ValueError(f"Unknown key distribution: {distribution}")
+        self.users = users
+        self.distribution = distribution
+        self._rng = random.Random(seed)
+        if distribution == "zipf":
+            # Rank r has weight 1 / r^s; ranks map to shuffled ids so hot keys are scattered
+            self._ids = list(range(1, users + 1))
+            self._rng.shuffle(self._ids)
+            self._cum_weights = list(itertools.accumulate(1.0 / rank ** zipf_s for rank in range(1, users + 1)))
+
+    def sample(self, count: int) -> List[int]:
+        if self.distribution == "uniform":
+            return [self._rng.randint(1, self.users) for _ in range(count)]
+        return self._rng.choices(self._ids, cum_weights=self._cum_weights, k=count)
+
+
+def build_workload(args) -> List[tuple]:
+    """A fixed, seeded list of operations so every run replays the same traffic"""
+    rng = random.Random(args.seed)
+    keys = KeyChooser(args.users, args.distribution, args.zipf_s, args.seed).sample(args.ops)
+    workload = []
+    for user_id in keys:
+        roll = rng.random()
+        if roll < args.write_ratio:
+            workload.append(("write", user_id, 20 + rng.randrange(50)))
+        elif roll < args.write_ratio + args.city_ratio:
+            workload.append(("city", rng.choice(CITIES), None))
+        else:
+            workload.append(("read", user_id, None))
+    return workload
+
+
+def prepare_database(path: str, users: int):
+    """Create the users table and seed synthetic users (reused across runs)"""
+    conn = sqlite3.connect(path)
+    setup_database(conn, log=lambda message: None)
+    start = time.perf_counter()
+    seed_users(conn, users, log=lambda message: None)
+    conn.close()
+    print(f"✓ Database {path} holds {users:,} users (seeding took {time.perf_counter() - start:.1f}s)")
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Recorder:
+    """Per-operation latencies plus periodic samples of throughput and hit ratio"""
+
+    def __init__(self, db, window: float):
+        self.db = db
+        self.window = window
+        self.latencies: Dict[str, List[float]] = {"read": [], "city": [], "write": []}
+        self.completed = 0
+        self.timeline = []
+        self._last = (0.0, 0, 0, 0)
+        self._start = time.perf_counter()
+
+    def _cache_counts(self):
+        hits = getattr(self.db, "l1_hits", 0) + self.db.l2_hits
+        return hits, self.db.l2_misses
+
+    def record(self, kind: str, seconds: float):
+        self.latencies[kind].append(seconds)
+        self.completed += 1
+
+    def sample(self):
+        """Close the current window: ops/sec and hit ratio since the previous sample"""
+        now = time.perf_counter() - self._start
+        hits, misses = self._cache_counts()
+        last_time, last_done, last_hits, last_misses = self._last
+        window_hits, window_misses = hits - last_hits, misses - last_misses
+        lookups = window_hits + window_misses
+        self.timeline.append({
+            "t": round(now, 3),
+            "ops_per_sec": round((self.completed - last_done) / max(now - last_time, 1e-9), 1),
+            "hit_ratio": round(window_hits / lookups, 4) if lookups else None,
+        })
+        self._last = (now, self.completed, hits, misses)
+
+    def summary(self, elapsed: float) -> Dict:
+        hits, misses = self._cache_counts()
+        latency = {}
+        for kind, values in list(self.latencies.items()) + [("all", sum(self.latencies.values(), []))]:
+            if not values:
+                continue
+            values = sorted(values)
+            latency[kind] = {
+                "count": len(values),
+                "p50_ms": round(percentile(values, 50) * 1000, 3),
+                "p95_ms": round(percentile(values, 95) * 1000, 3),
+                "p99_ms": round(percentile(values, 99) * 1000, 3),
+                "max_ms": round(values[-1] * 1000, 3),
+            }
+        return {
+            "elapsed_sec": round(elapsed, 3),
+            "throughput_ops_per_sec": round(self.completed / elapsed, 1),
+            "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else None,
+            "db_queries": self.db.db_queries,
+            "latency": latency,
+            "timeline": self.timeline,
+        }
+
+
+def run_threads(args, workload) -> Dict:
+    db = DatabaseWithCache(db_name=args.db, verbose=False, simulate_latency=False,
+                           stampede_protection=args.stampede, l1_cache=args.l1)
+    db.clear_all_cache()
+    recorder = Recorder(db, args.window)
+    chunks = [workload[i::args.concurrency] for i in range(args.concurrency)]
+    done = threading.Event()
+
+    def worker(operations):
+        for kind, key, value in operations:
+            start = time.perf_counter()
+            if kind == "read":
+                db.get_user_by_id_with_cache(key, ttl=args.ttl)
+            elif kind == "city":
+                db.get_users_by_city(key, ttl=args.ttl)
+            else:
+                db.update_user(key, age=value)
+            recorder.record(kind, time.perf_counter() - start)
+
+    def monitor():
+        while not done.wait(args.window):
+            recorder.sample()
+
+    sampler = threading.Thread(target=monitor, daemon=True)
+    sampler.start()
+    threads = [threading.Thread(target=worker, args=(chunk,)) for chunk in chunks]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    done.set()
+    sampler.join()
+    recorder.sample()
+
+    result = recorder.summary(elapsed)
+    db.clear_all_cache()
+    db.close()
+    return result
+
+
+async def run_coroutines(args, workload) -> Dict:
+    from async_cache import AsyncDatabaseWithCache
+
+    async with AsyncDatabaseWithCache(db_name=args.db, verbose=False, simulate_latency=False,
+                                      sqlite_pool_size=args.sqlite_pool_size) as db:
+        await db.clear_all_cache()
+        recorder = Recorder(db, args.window)
+        chunks = [workload[i::args.concurrency] for i in range(args.concurrency)]
+
+        async def worker(operations):
+            for kind, key, value in operations:
+                start = time.perf_counter()
+                if kind == "read":
+                    await db.get_user_by_id_with_cache(key, ttl=args.ttl)
+                elif kind == "city":
+                    await db.get_users_by_city(key, ttl=args.ttl)
+                else:
+                    await db.update_user(key, age=value)
+                recorder.record(kind, time.perf_counter() - start)
+
+        async def monitor():
+            while True:
+                await asyncio.sleep(args.window)
+                recorder.sample()
+
+        sampler = asyncio.create_task(monitor())
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(chunk) for chunk in chunks))
+        elapsed = time.perf_counter() - start
+        sampler.cancel()
+        recorder.sample()
+
+        result = recorder.summary(elapsed)
+        await db.clear_all_cache()
+    return result
+
+
+def print_report(result: Dict):
+    print(f"\nThroughput: {result['throughput_ops_per_sec']:,.0f} ops/sec over {result['elapsed_sec']:.1f}s")
+    if result["hit_ratio"] is not None:
+        print(f"Hit ratio:  {result['hit_ratio']:.1%} ({result['db_queries']:,} DB queries)")
+    print(f"\n{'op':>6} | {'count':>8} | {'p50':>9} | {'p95':>9} | {'p99':>9} | {'max':>9}")
+    print("-" * 62)
+    for kind, stats in result["latency"].items():
+        print(f"{kind:>6} | {stats['count']:>8,} | {stats['p50_ms']:>7.2f}ms | {stats['p95_ms']:>7.2f}ms | "
+              f"{stats['p99_ms']:>7.2f}ms | {stats['max_ms']:>7.2f}ms")
+    print("\nHit ratio over time:")
+    for point in result["timeline"]:
+        ratio = f"{point['hit_ratio']:.1%}" if point["hit_ratio"] is not None else "n/a"
+        print(f"  t={point['t']:>7.1f}s  {point['ops_per_sec']:>10,.0f} ops/sec  hit ratio {ratio}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a cache workload against DatabaseWithCache")
+    parser.add_argument("--db", default="benchmark.db", help="SQLite file to seed and query")
+    parser.add_argument("--users", type=int, default=100_000, help="users to seed (up to 1M)")
+    parser.add_argument("--ops", type=int, default=50_000, help="operations to replay")
+    parser.add_argument("--concurrency", type=int, default=16, help="worker threads or coroutines")
+    parser.add_argument("--mode", choices=["threads", "async"], default="threads")
+    parser.add_argument("--distribution", choices=["zipf", "uniform"], default="zipf")
+    parser.add_argument("--zipf-s", type=float, default=1.1, help="Zipf exponent (higher = more skewed)")
+    parser.add_argument("--write-ratio", type=float, default=0.02, help="share of update_user calls")
+    parser.add_argument("--city-ratio", type=float, default=0.01, help="share of get_users_by_city calls")
+    parser.add_argument("--ttl", type=int, default=300)
+    parser.add_argument("--l1", action="store_true", help="enable the in-process L1 cache (threads mode)")
+    parser.add_argument("--stampede", action="store_true", help="enable stampede protection (threads mode)")
+    parser.add_argument("--sqlite-pool-size", type=int, default=8, help="SQLite connections (async mode)")
+    parser.add_argument("--window", type=float, default=1.0, help="seconds per hit-ratio sample")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="benchmark_results.json")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    print("=" * 60)
+    print("CACHE WORKLOAD BENCHMARK")
+    print("=" * 60)
+
+    prepare_database(args.db, args.users)
+    workload = build_workload(args)
+    print(f"Replaying {len(workload):,} ops ({args.distribution}, {args.write_ratio:.0%} writes, "
+          f"{args.city_ratio:.0%} city lookups) with {args.concurrency} {args.mode}...")
+
+    if args.mode == "threads":
+        result = run_threads(args, workload)
+    else:
+        result = asyncio.run(run_coroutines(args, workload))
+    print_report(result)
+
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "environment": {"python": platform.python_version(), "platform": platform.platform()},
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        **result,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✓ Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""
+Offline tools for choosing SemanticCache.similarity_threshold.
+
+pairs:  embed a labelled file of query pairs in batches and report, for each
+        threshold, precision and recall of "serve the cached answer to a for
+        query b", the share of wrong answers served, and the LLM latency saved
+        per query. Recommends the threshold with the best recall that meets
+        --min-precision (the highest such threshold, when several tie).
+replay: push a query log through a SemanticCache backed by a temporary
+        EmbeddedVectorStore with the LLM replaced by a stub, and report the
+        hit rate and LLM time saved at each threshold. The log is embedded
+        once and every threshold's pass reuses those vectors. Ollama is
+        never called.
+
+Pairs files are JSONL ({"a": ..., "b": ..., "paraphrase": true}) or CSV with
+a, b, paraphrase columns. Query logs are JSONL ({"query": ..., optionally
+"llm_seconds": ...}) or plain text with one query per line.
+
+    python calibrate.py pairs labelled_pairs.jsonl --backend onnx --output calibration.json
+    python calibrate.py replay queries.log --threshold 0.8 --threshold 0.85 --threshold 0.9
+"""
+import argparse
+import csv
+import io
+import json
+import platform
+import tempfile
+import time
+from contextlib import redirect_stdout
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from embedders import EMBEDDING_BACKENDS, load_embedder
+from semantic_store import EVICTION_POLICIES, EmbeddedVectorStore
+from task2 import SemanticCache
+
+TRUE_LABELS = ("1", "true", "yes", "paraphrase")
+
+
+def read_pairs(path: str) -> List[Tuple[str, str, bool]]:
+    """(a, b, is_paraphrase) triples from a JSONL or CSV file"""
+    with open(path, newline="") as f:
+        if path.endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    return [(row["a"], row["b"], str(row["paraphrase"]).strip().lower() in TRUE_LABELS) for row in rows]
+
+
+def read_query_log(path: str) -> List[Tuple[str, Optional[float]]]:
+    """(query, llm_seconds or None) in log order"""
+    with open(path) as f:
+        if path.endswith((".jsonl", ".json")):
+            entries = [json.loads(line) for line in f if line.strip()]
+            return [(entry["query"], entry.get("llm_seconds")) for entry in entries]
+        return [(line.strip(), None) for line in f if line.strip()]
+
+
+def thresholds_from(args) -> List[float]:
+    return [round(t, 4) for t in np.arange(args.start, args.stop + args.step / 2, args.step)]
+
+
+def pair_similarities(pairs: List[Tuple[str, str, bool]], backend: str, batch_size: int) -> Tuple[np.ndarray, float]:
+    """Cosine similarity of each pair, embedding every distinct text once; also returns seconds spent embedding"""
+    texts = sorted({text for a, b, _ in pairs for text in (a, b)})
+    embedder = load_embedder(backend)
+    start = time.perf_counter()
+    embeddings = embedder.encode(texts, batch_size=batch_size)
+    elapsed = time.perf_counter() - start
+    index = {text: i for i, text in enumerate(texts)}
+    a = embeddings[[index[a] for a, _, _ in pairs]]
+    b = embeddings[[index[b] for _, b, _ in pairs]]
+    # Backends return unit vectors, but normalise anyway so any encoder works
+    return np.sum(a * b, axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1)), elapsed
+
+
+def sweep(similarities: np.ndarray, labels: np.ndarray, thresholds: List[float],
+          llm_seconds: float, hit_seconds: float) -> List[Dict]:
+    """Precision, recall and latency saved per query at each threshold"""
+    rows = []
+    for threshold in thresholds:
+        served = similarities >= threshold
+        true_hits = int(np.sum(served & labels))
+        wrong_hits = int(np.sum(served & ~labels))
+        rows.append({
+            "threshold": threshold,
+            "precision": true_hits / (true_hits + wrong_hits) if true_hits + wrong_hits else None,
+            "recall": true_hits / int(labels.sum()) if labels.any() else None,
+            "wrong_answer_rate": wrong_hits / len(labels),
+            # Only correct hits count as saved: a wrong answer usually means the user asks again
+            "saved_seconds_per_query": true_hits / len(labels) * (llm_seconds - hit_seconds),
+        })
+    return rows
+
+
+def recommend(rows: List[Dict], min_precision: float) -> Tuple[Optional[Dict], str]:
+    """
+    Best recall among thresholds meeting min_precision, else the best F1.
+    Ties go to the highest threshold: same hits, widest margin over the
+    non-paraphrases seen here.
+    """
+    eligible = [row for row in rows if row["precision"] is not None and row["precision"] >= min_precision]
+    if eligible:
+        best = max(eligible, key=lambda row: (row["recall"], row["threshold"]))
+        return best, f"best recall with precision >= {min_precision:.0%}"
+
+    def f1(row):
+        if not row["precision"] or not row["recall"]:
+            return 0.0
+        return 2 * row["precision"] * row["recall"] / (row["precision"] + row["recall"])
+    scored = [row for row in rows if f1(row) > 0]
+    if not scored:
+        return None, "no threshold serves a correct hit"
+    return max(scored, key=lambda row: (f1(row), row["threshold"])), f"no threshold reaches precision {min_precision:.0%}; best F1 instead"
+
+
+def run_pairs(args) -> Dict:
+    pairs = read_pairs(args.path)
+    labels = np.array([label for _, _, label in pairs])
+    print(f"Embedding {len(pairs):,} pairs ({int(labels.sum()):,} paraphrases) with the {args.backend} backend...")
+    similarities, embed_seconds = pair_similarities(pairs, args.backend, args.batch_size)
+    rows = sweep(similarities, labels, thresholds_from(args), args.llm_seconds, args.hit_seconds)
+    best, reason = recommend(rows, args.min_precision)
+
+    print(f"\n{'threshold':>9} | {'precision':>9} | {'recall':>7} | {'wrong':>7} | {'saved/query':>11}")
+    print("-" * 56)
+    for row in rows:
+        precision = f"{row['precision']:.1%}" if row["precision"] is not None else "n/a"
+        recall = f"{row['recall']:.1%}" if row["recall"] is not None else "n/a"
+        marker = "  <- recommended" if row is best else ""
+        print(f"{row['threshold']:>9.2f} | {precision:>9} | {recall:>7} | {row['wrong_answer_rate']:>6.1%} | "
+              f"{row['saved_seconds_per_query']:>10.3f}s{marker}")
+
+    paraphrase_sims, other_sims = similarities[labels], similarities[~labels]
+    if len(paraphrase_sims) and len(other_sims):
+        print(f"\nSimilarity of paraphrases: median {np.median(paraphrase_sims):.3f}, 5th pct "
+              f"{np.percentile(paraphrase_sims, 5):.3f}; non-paraphrases: median {np.median(other_sims):.3f}, "
+              f"95th pct {np.percentile(other_sims, 95):.3f}")
+    if best is not None:
+        print(f"✓ Recommended similarity_threshold={best['threshold']:.2f} ({reason})")
+    else:
+        print(f"✗ No recommendation: {reason}")
+    return {"embed_seconds": round(embed_seconds, 3), "thresholds": rows,
+            "recommended": best["threshold"] if best else None, "reason": reason}
+
+
+class PrecomputedEmbedder:
+    """
+    encode() served from embeddings of the whole query log computed up front,
+    so replaying it at several thresholds loads the model and embeds each
+    distinct query once. Texts outside the log are embedded on demand.
+    """
+
+    def __init__(self, embedder, texts: List[str], batch_size: int):
+        self.embedder = embedder
+        unique = list(dict.fromkeys(texts))
+        self._vectors = dict(zip(unique, embedder.encode(unique, batch_size=batch_size)))
+
+    def encode(self, texts, batch_size: int = 32) -> np.ndarray:
+        missing = [text for text in dict.fromkeys(texts) if text not in self._vectors]
+        if missing:
+            self._vectors.update(zip(missing, self.embedder.encode(missing, batch_size=batch_size)))
+        return np.array([self._vectors[text] for text in texts])
+
+
+def replay_log(queries: List[Tuple[str, Optional[float]]], threshold: float, embedder: PrecomputedEmbedder,
+               args) -> Dict:
+    """One pass over the log at one threshold; the LLM is a stub, so only cache behaviour is measured"""
+    with tempfile.TemporaryDirectory() as path, redirect_stdout(io.StringIO()):
+        store = EmbeddedVectorStore(path, max_entries=args.max_entries, eviction_policy=args.eviction_policy)
+        cache = SemanticCache(store=store, similarity_threshold=threshold, embedding_backend=args.backend)
+        cache._embedding_model = embedder
+        # Stored entries keep the logged LLM time as their cost, which cost-aware eviction uses
+        costs = {query: llm_seconds for query, llm_seconds in queries if llm_seconds is not None}
+        cache._timed_ollama = lambda query: (f"[simulated answer] {query}", costs.get(query, args.llm_seconds), True)
+        hits = exact_hits = 0
+        saved = total = 0.0
+        start = time.perf_counter()
+        for chunk_start in range(0, len(queries), args.batch_size):
+            chunk = queries[chunk_start:chunk_start + args.batch_size]
+            results = cache.query_batch([query for query, _ in chunk])
+            for (_, llm_seconds), (_, is_cached, similarity, _) in zip(chunk, results):
+                cost = llm_seconds if llm_seconds is not None else args.llm_seconds
+                total += cost
+                if is_cached:
+                    hits += 1
+                    exact_hits += similarity >= 1.0 - 1e-6  # in-batch repeats compare embeddings
+                    saved += cost
+        elapsed = time.perf_counter() - start
+        entries = store.count()
+        cache.close()
+    return {
+        "threshold": threshold,
+        "hit_rate": hits / len(queries),
+        "exact_hits": exact_hits,
+        "semantic_hits": hits - exact_hits,
+        "llm_calls": len(queries) - hits,
+        "llm_seconds_saved": round(saved, 1),
+        "llm_time_saved": saved / total if total else 0.0,
+        "cached_entries": entries,
+        "replay_seconds": round(elapsed, 2),
+    }
+
+
+def run_replay(args) -> Dict:
+    queries = read_query_log(args.path)
+    thresholds = args.threshold or [0.85]
+    bound = f"max_entries={args.max_entries}, {args.eviction_policy}" if args.max_entries else "unbounded"
+    print(f"Replaying {len(queries):,} queries ({bound}, {args.backend} embeddings, LLM simulated)...")
+
+    start = time.perf_counter()
+    embedder = PrecomputedEmbedder(load_embedder(args.backend), [query for query, _ in queries], args.batch_size)
+    embed_seconds = time.perf_counter() - start
+    print(f"✓ Embedded {len(embedder._vectors):,} distinct queries in {embed_seconds:.1f}s")
+
+    rows = [replay_log(queries, threshold, embedder, args) for threshold in thresholds]
+    print(f"\n{'threshold':>9} | {'hit rate':>8} | {'exact':>7} | {'semantic':>8} | {'LLM calls':>9} | "
+          f"{'LLM time saved':>16} | {'entries':>7}")
+    print("-" * 86)
+    for row in rows:
+        print(f"{row['threshold']:>9.2f} | {row['hit_rate']:>7.1%} | {row['exact_hits']:>7,} | "
+              f"{row['semantic_hits']:>8,} | {row['llm_calls']:>9,} | "
+              f"{row['llm_seconds_saved']:>8,.0f}s ({row['llm_time_saved']:>4.0%}) | {row['cached_entries']:>7,}")
+    return {"embed_seconds": round(embed_seconds, 3), "replay": rows}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Calibrate the semantic cache similarity threshold")
+    parser.add_argument("command", choices=["pairs", "replay"])
+    parser.add_argument("path", help="labelled pairs (pairs) or query log (replay)")
+    parser.add_argument("--backend", choices=EMBEDDING_BACKENDS, default="torch", help="embedding backend")
+    parser.add_argument("--batch-size", type=int, default=64, help="texts per encode / queries per query_batch")
+    parser.add_argument("--llm-seconds", type=float, default=3.0, help="cost of an LLM call (log entries may override)")
+    parser.add_argument("--hit-seconds", type=float, default=0.02, help="cost of serving a cache hit")
+    parser.add_argument("--start", type=float, default=0.60, help="lowest threshold to sweep (pairs)")
+    parser.add_argument("--stop", type=float, default=0.98, help="highest threshold to sweep (pairs)")
+    parser.add_argument("--step", type=float, default=0.02)
+    parser.add_argument("--min-precision", type=float, default=0.95, help="precision the recommendation must meet")
+    parser.add_argument("--threshold", type=float, action="append", help="threshold to replay (repeatable)")
+    parser.add_argument("--max-entries", type=int, default=None, help="bound the replayed cache")
+    parser.add_argument("--eviction-policy", choices=EVICTION_POLICIES, default="lru")
+    parser.add_argument("--output", default=None, help="write the results as JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    print("=" * 60)
+    print(f"SEMANTIC CACHE CALIBRATION: {args.command}")
+    print("=" * 60)
+
+    result = run_pairs(args) if args.command == "pairs" else run_replay(args)
+
+    if args.output:
+        report = {
+            "config": {key: value for key, value in vars(args).items() if key != "output"},
+            "environment": {"python": platform.python_version(), "platform": platform.platform()},
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            **result,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✓ Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,151 +1,1053 @@
 import sqlite3
 import redis
 import json
+import math
+import random
+import sys
+import threading
 import time
-from typing import Optional, List, Dict
+import uuid
+import zlib
+import hashlib
+from collections import OrderedDict
+from typing import Optional, List, Dict, Iterable, Tuple
+
+# Optional: only needed by ColumnarCodec / zstd compression
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# SQLite's default SQLITE_MAX_VARIABLE_NUMBER is 999 on older builds
+SQLITE_MAX_PARAMS = 900
+
+CITIES = ["New York", "Los Angeles", "Chicago", "Houston", "Phoenix",
+          "San Francisco", "Seattle", "Boston", "Austin", "Denver"]
+
+# Release a rebuild lock only if we still own it (the lease may have expired)
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Pub/sub channel used to drop keys from every process's in-process L1 cache
+INVALIDATION_CHANNEL = "cache:invalidate"
+
+# Atomically delete every key registered under the given tag sets (KEYS),
+# plus any extra keys (ARGV), then the tag sets themselves. Returns the keys deleted.
+INVALIDATE_TAGS_SCRIPT = """
+local deleted = {}
+local function drop(key)
+    if redis.call('DEL', key) == 1 then
+        table.insert(deleted, key)
+    end
+end
+for _, tag in ipairs(KEYS) do
+    for _, key in ipairs(redis.call('SMEMBERS', tag)) do
+        drop(key)
+    end
+    redis.call('DEL', tag)
+end
+for _, key in ipairs(ARGV) do
+    drop(key)
+end
+return deleted
+"""
+
+# Columns update_user may change
+UPDATABLE_USER_FIELDS = ("name", "email", "city", "age")
+
+# Cached in place of a row that does not exist (negative caching)
+NEGATIVE_ENTRY = {"__missing__": True}
+
+# Marks stampede-safe entries ({"value", "expires_at", "delta"}), which share
+# their keys with plain entries, so readers in either mode can tell them apart
+WRAPPED_ENTRY_MARKER = "__wrapped__"
+
+# Set of post ids whose Redis view counter has not been written to the database yet
+DIRTY_VIEWS_KEY = "views:dirty"
+
+# Hash describing the Bloom filter of existing user ids shared by every
+# instance: its bitmap key ("bits"), size in bits, hash count, capacity and
+# the number of ids added ("count")
+BLOOM_KEY = "bloom:users"
+
+# For each (h1, h2) pair in ARGV: 1 if bits (h1 + i*h2) % size are all set, else 0.
+# Returns -1 if there is no filter (never built, flushed or evicted).
+BLOOM_CHECK_SCRIPT = """
+local meta = redis.call('HMGET', KEYS[1], 'bits', 'size', 'hashes')
+if not meta[1] then
+    return -1
+end
+local size, hashes = tonumber(meta[2]), tonumber(meta[3])
+local found = {}
+for j = 1, #ARGV, 2 do
+    local h1, h2 = tonumber(ARGV[j]), tonumber(ARGV[j + 1])
+    local present = 1
+    for i = 0, hashes - 1 do
+        if redis.call('GETBIT', meta[1], (h1 + i * h2) % size) == 0 then
+            present = 0
+            break
+        end
+    end
+    table.insert(found, present)
+end
+return found
+"""
+
+# Set the bits of each (h1, h2) pair in ARGV. Returns {ids added, capacity}, or -1 if there is no filter.
+BLOOM_ADD_SCRIPT = """
+local meta = redis.call('HMGET', KEYS[1], 'bits', 'size', 'hashes', 'capacity')
+if not meta[1] then
+    return -1
+end
+local size, hashes = tonumber(meta[2]), tonumber(meta[3])
+for j = 1, #ARGV, 2 do
+    local h1, h2 = tonumber(ARGV[j]), tonumber(ARGV[j + 1])
+    for i = 0, hashes - 1 do
+        redis.call('SETBIT', meta[1], (h1 + i * h2) % size, 1)
+    end
+end
+return {redis.call('HINCRBY', KEYS[1], 'count', #ARGV / 2), tonumber(meta[4])}
+"""
+
+# Point the filter at a freshly written bitmap (ARGV: bits key, size, hashes,
+# capacity, count) and delete the one it replaces
+BLOOM_SWAP_SCRIPT = """
+local old = redis.call('HGET', KEYS[1], 'bits')
+redis.call('HSET', KEYS[1], 'bits', ARGV[1], 'size', ARGV[2], 'hashes', ARGV[3],
+           'capacity', ARGV[4], 'count', ARGV[5])
+if old and old ~= ARGV[1] then
+    redis.call('DEL', old)
+end
+return 1
+"""
+
+
+def setup_database(conn: sqlite3.Connection, log=print):
+    """Create and populate sample database"""
+    cursor = conn.cursor()
+    # Create users table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            email TEXT NOT NULL,
+            city TEXT NOT NULL,
+            age INTEGER,
+            views INTEGER DEFAULT 0
+        )
+    """)
+
+    try:
+        cursor.execute("SELECT views FROM users LIMIT 1")
+    except sqlite3.OperationalError:
+        # Add views column if it doesn't exist
+        cursor.execute("ALTER TABLE users ADD COLUMN views INTEGER DEFAULT 0")
+        log("✓ Added views column to existing users table")
+    
+    # Check if we need to populate data
+    cursor.execute("SELECT COUNT(*) FROM users")
+    count = cursor.fetchone()[0]
+    
+    if count == 0:
+        log("Populating database with sample data...")
+        sample_users = [
+            (1, "Alice Johnson", "alice@example.com", "New York", 28, 0),
+            (2, "Bob Smith", "bob@example.com", "Los Angeles", 34, 0),
+            (3, "Carol White", "carol@example.com", "Chicago", 25, 0),
+            (4, "David Brown", "david@example.com", "Houston", 31, 0),
+            (5, "Eve Davis", "eve@example.com", "Phoenix", 29, 0),
+            (6, "Frank Wilson", "frank@example.com", "New York", 27, 0),
+            (7, "Grace Lee", "grace@example.com", "San Francisco", 33, 0),
+            (8, "Henry Martinez", "henry@example.com", "Seattle", 30, 0),
+            (9, "Iris Taylor", "iris@example.com", "Boston", 26, 0),
+            (10, "Jack Anderson", "jack@example.com", "Austin", 35, 0),
+        ]
+        
+        cursor.executemany(
+            "INSERT INTO users (id, name, email, city, age, views) VALUES (?, ?, ?, ?, ?, ?)",
+            sample_users
+        )
+        conn.commit()
+        log(f"✓ Inserted {len(sample_users)} users into database")
+
+
+def seed_users(conn: sqlite3.Connection, count: int, log=print):
+    """Add synthetic users until the table holds at least `count` rows"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM users")
+    next_id = cursor.fetchone()[0] + 1
+    if next_id > count:
+        return
+
+    cursor.executemany(
+        "INSERT INTO users (id, name, email, city, age, views) VALUES (?, ?, ?, ?, ?, ?)",
+        ((i, f"User {i}", f"user{i}@example.com", CITIES[i % len(CITIES)], 20 + i % 50, 0)
+         for i in range(next_id, count + 1))
+    )
+    conn.commit()
+    log(f"✓ Seeded users up to id {count}")
+
+
+def is_wrapped_entry(entry) -> bool:
+    return isinstance(entry, dict) and WRAPPED_ENTRY_MARKER in entry
+
+
+def unwrap_entry(entry):
+    """
+    The value of a cache entry written in either mode. Stampede-safe entries
+    past their logical expiry count as misses (None)
+    """
+    if not is_wrapped_entry(entry):
+        return entry
+    if time.time() >= entry["expires_at"]:
+        return None
+    return entry["value"]
+
+
+class JsonCodec:
+    """Cache values as JSON text (the original storage format)"""
+    name = "json"
+
+    def encode(self, value) -> bytes:
+        return json.dumps(value).encode()
+
+    def decode(self, data: bytes):
+        return json.loads(data)
+
+
+class ColumnarCodec:
+    """
+    Cache values as msgpack. Lists of rows sharing the same columns are stored
+    as a table (column names once, then one value tuple per row), so large
+    result sets do not repeat every column name for every row.
+    """
+    name = "columnar"
+    TABLE_EXT = 1
+
+    def __init__(self):
+        if msgpack is None:
+            raise ImportError("ColumnarCodec requires msgpack (pip install msgpack)")
+
+    def encode(self, value) -> bytes:
+        return msgpack.packb(self._pack(value), use_bin_type=True)
+
+    def decode(self, data: bytes):
+        return msgpack.unpackb(data, raw=False, strict_map_key=False, ext_hook=self._unpack_table)
+
+    def _pack(self, value):
+        if isinstance(value, dict):
+            return {key: self._pack(item) for key, item in value.items()}
+        if isinstance(value, list) and value and all(isinstance(row, dict) for row in value):
+            columns = list(value[0])
+            if all(list(row) == columns for row in value):
+                table = msgpack.packb([columns, [list(row.values()) for row in value]], use_bin_type=True)
+                return msgpack.ExtType(self.TABLE_EXT, table)
+        return value
+
+    def _unpack_table(self, code: int, data: bytes):
+        if code != self.TABLE_EXT:
+            return msgpack.ExtType(code, data)
+        columns, rows = msgpack.unpackb(data, raw=False)
+        return [dict(zip(columns, row)) for row in rows]
+
+
+class CompressedCodec:
+    """
+    Wrap another codec and compress payloads of at least `threshold` bytes
+    with zlib or zstd. A one-byte header records how the payload was stored.
+    """
+    RAW, ZLIB, ZSTD = b"\x00", b"\x01", b"\x02"
+
+    def __init__(self, inner=None, algorithm: str = "zlib", threshold: int = 1024, level: int = 3):
+        if algorithm not in ("zlib", "zstd"):
+            raise ValueError(f"Unknown compression algorithm: {algorithm}")
+        if algorithm == "zstd" and zstandard is None:
+            raise ImportError("zstd compression requires zstandard (pip install zstandard)")
+        self.inner = inner or JsonCodec()
+        self.algorithm = algorithm
+        self.threshold = threshold
+        self.level = level
+        self.name = f"{self.inner.name}+{algorithm}"
+
+    def encode(self, value) -> bytes:
+        data = self.inner.encode(value)
+        if len(data) < self.threshold:
+            return self.RAW + data
+        if self.algorithm == "zstd":
+            # zstandard (de)compressor objects are not thread-safe; they are cheap to create
+            return self.ZSTD + zstandard.ZstdCompressor(level=self.level).compress(data)
+        return self.ZLIB + zlib.compress(data, self.level)
+
+    def decode(self, data: bytes):
+        header, payload = data[:1], data[1:]
+        if header == self.ZLIB:
+            payload = zlib.decompress(payload)
+        elif header == self.ZSTD:
+            if zstandard is None:
+                raise ImportError("zstd-compressed cache entry found but zstandard is not installed")
+            payload = zstandard.ZstdDecompressor().decompress(payload)
+        return self.inner.decode(payload)
+
+
+class BloomFilter:
+    """
+    In-process Bloom filter: `in` is False only for items that were never added
+    (no false negatives), and True for absent items with roughly `error_rate`
+    probability while it holds at most `capacity` items. Bits are laid out
+    like a Redis bitmap (offset 0 is the high bit of byte 0), so the filter
+    can be built here and uploaded for BLOOM_CHECK_SCRIPT / BLOOM_ADD_SCRIPT.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        capacity = max(capacity, 1)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    @staticmethod
+    def hash_pair(item) -> Tuple[int, int]:
+        """
+        Two 32-bit hashes of item for double hashing. 32 bits keep h1 + i*h2
+        exact in the doubles Lua computes with
+        """
+        digest = hashlib.blake2b(str(item).encode(), digest_size=8).digest()
+        return int.from_bytes(digest[:4], "little"), int.from_bytes(digest[4:], "little") | 1
+
+    def _positions(self, item) -> List[int]:
+        h1, h2 = self.hash_pair(item)
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 0x80 >> (position & 7)
+        self.count += 1
+
+    def __contains__(self, item) -> bool:
+        return all(self._bits[position >> 3] & (0x80 >> (position & 7)) for position in self._positions(item))
+
+    def to_bytes(self) -> bytes:
+        return bytes(self._bits)
+
+
+class LocalCache:
+    """
+    Bounded in-process LRU cache with a per-entry TTL.
+    Evicts least recently used entries once max_entries or max_bytes is exceeded.
+    Values are shared with callers, so treat them as read-only.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 8 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[object, float, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        """Return the cached value, or None if absent or expired"""
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            value, expires_at, _ = item
+            if time.time() >= expires_at:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value, size: int, ttl: float):
+        """Store a value whose serialized size is `size` bytes for `ttl` seconds"""
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, time.time() + ttl, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def delete(self, key: str):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key: str):
+        item = self._entries.pop(key, None)
+        if item is not None:
+            self._bytes -= item[2]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class ViewCountFlusher:
+    """
+    Write-behind sync of Redis view counters to the database.
+    A background thread drains the dirty-post set every `interval` seconds, or
+    sooner once `max_pending` increments have been recorded, and writes all
+    counts with a single executemany in one transaction.
+    """
+
+    def __init__(self, db: "DatabaseWithCache", interval: float = 1.0, max_pending: int = 1000):
+        self.db = db
+        self.interval = interval
+        self.max_pending = max_pending
+        self.flushes = 0
+        self.rows_written = 0
+        self._pending = 0
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def record(self, count: int = 1):
+        """Note new increments; starts the flusher thread on first use"""
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None and not self._stopping.is_set():
+                    self._thread = threading.Thread(target=self._run, name="view-flusher", daemon=True)
+                    self._thread.start()
+        self._pending += count
+        if self._pending >= self.max_pending:
+            self._wake.set()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"✗ View count flush failed: {e}")
+
+    def flush(self) -> int:
+        """Drain the dirty set and write every count in one transaction"""
+        with self._flush_lock:
+            self._pending = 0
+            redis_client = self.db.redis_client
+
+            # Take the current dirty set atomically; increments after this re-mark their post
+            pipe = redis_client.pipeline()
+            pipe.smembers(DIRTY_VIEWS_KEY)
+            pipe.delete(DIRTY_VIEWS_KEY)
+            post_ids, _ = pipe.execute()
+            if not post_ids:
+                return 0
+
+            post_ids = sorted(post_ids, key=int)
+            counts = redis_client.mget([f"views:post:{post_id}" for post_id in post_ids])
+            # Counters are absolute, so writing the latest value is safe even if a post is flushed twice
+            rows = [(int(count), int(post_id)) for post_id, count in zip(post_ids, counts) if count is not None]
+
+            try:
+                with self.db._db_lock, self.db.conn:
+                    self.db.conn.executemany("UPDATE users SET views = ? WHERE id = ?", rows)
+            except Exception:
+                # Keep the posts dirty so the next flush retries them
+                redis_client.sadd(DIRTY_VIEWS_KEY, *post_ids)
+                raise
+
+            self.flushes += 1
+            self.rows_written += len(rows)
+            self.db._log(f"✓ Synced views for {len(rows)} posts to database")
+            return len(rows)
+
+    def stop(self):
+        """Stop the background thread and flush whatever is still pending"""
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
 
 class DatabaseWithCache:
-    def __init__(self, db_name: str = "demo.db", redis_host: str = "localhost", redis_port: int = 6379):
-        """Initialize database and Redis connections"""
-        self.conn = sqlite3.connect(db_name)
+    def __init__(self, db_name: str = "demo.db", redis_host: str = "localhost", redis_port: int = 6379,
+                 verbose: bool = True, simulate_latency: bool = True,
+                 stampede_protection: bool = False, lock_lease: float = 2.0,
+                 stale_ttl: int = 30, xfetch_beta: float = 1.0,
+                 l1_cache: bool = False, l1_max_entries: int = 1024,
+                 l1_max_bytes: int = 8 * 1024 * 1024, l1_ttl: float = 5.0,
+                 view_flush_interval: float = 1.0, view_flush_max_pending: int = 1000,
+                 codec=None, negative_ttl: int = 30, bloom_filter: bool = False,
+                 bloom_error_rate: float = 0.01):
+        """
+        Initialize database and Redis connections
+
+        With stampede_protection enabled, only one caller rebuilds an expired
+        key (guarded by a `lock:{key}` lease of lock_lease seconds) while the
+        others are served the previous value for up to stale_ttl seconds.
+        Hot keys are also refreshed early with probability driven by
+        xfetch_beta (XFetch; 0 disables early refresh).
+
+        With l1_cache enabled, parsed entries are also kept in a bounded
+        in-process LRU (for at most l1_ttl seconds) in front of Redis. Every
+        instance subscribes to INVALIDATION_CHANNEL so invalidations made by
+        any process drop the key from all L1 caches.
+
+        View counts are written behind: increment_post_views only touches
+        Redis and a background flusher syncs dirty posts to the database every
+        view_flush_interval seconds or view_flush_max_pending increments.
+
+        codec controls how cache values are stored in Redis: JsonCodec (the
+        default), ColumnarCodec, or either wrapped in CompressedCodec.
+
+        Lookups of user ids that do not exist are cached as NEGATIVE_ENTRY for
+        negative_ttl seconds (0 disables). With bloom_filter enabled, cache
+        misses first consult a Bloom filter of existing ids kept in Redis
+        (BLOOM_KEY) and shared by every instance, so ids it rules out never
+        reach SQLite. The filter is rebuilt from the database at startup,
+        by seed_users and whenever it is missing from Redis; add_user sets
+        the new id's bits for every instance at once.
+        """
+        self.verbose = verbose
+        self.simulate_latency = simulate_latency
+        self.stampede_protection = stampede_protection
+        self.lock_lease = lock_lease
+        self.stale_ttl = stale_ttl
+        self.xfetch_beta = xfetch_beta
+        self.db_queries = 0
+        self.l1 = LocalCache(l1_max_entries, l1_max_bytes) if l1_cache else None
+        self.l1_ttl = l1_ttl
+        self.l1_hits = self.l1_misses = 0
+        self.l2_hits = self.l2_misses = 0
+        self.codec = codec or JsonCodec()
+        self.negative_ttl = negative_ttl
+        self.negative_hits = 0
+        self.bloom_filter = bloom_filter
+        self.bloom_error_rate = bloom_error_rate
+        self.bloom_rejections = 0
+        self.view_flusher = ViewCountFlusher(self, view_flush_interval, view_flush_max_pending)
+
+        # Shared across threads; every use of the cursor goes through _db_lock
+        self.conn = sqlite3.connect(db_name, check_same_thread=False)
         self.conn.row_factory = sqlite3.Row
         self.cursor = self.conn.cursor()
+        self._db_lock = threading.RLock()
         
         # Connect to Redis
         self.redis_client = redis.Redis(host=redis_host, port=redis_port, decode_responses=True)
+        # Cached values go through the codec as raw bytes
+        self.binary_client = redis.Redis(host=redis_host, port=redis_port, decode_responses=False)
         
         # Test Redis connection
         try:
             self.redis_client.ping()
-            print("✓ Connected to Redis successfully")
+            self._log("✓ Connected to Redis successfully")
         except redis.ConnectionError:
             print("✗ Failed to connect to Redis. Make sure Redis is running!")
             raise
-        
+
+        self._release_lock = self.redis_client.register_script(RELEASE_LOCK_SCRIPT)
+        self._invalidate_tags_script = self.redis_client.register_script(INVALIDATE_TAGS_SCRIPT)
+        self._bloom_check_script = self.redis_client.register_script(BLOOM_CHECK_SCRIPT)
+        self._bloom_add_script = self.redis_client.register_script(BLOOM_ADD_SCRIPT)
+        self._bloom_swap_script = self.redis_client.register_script(BLOOM_SWAP_SCRIPT)
+
+        self._pubsub_thread = None
+        if self.l1 is not None:
+            pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{INVALIDATION_CHANNEL: self._on_invalidation})
+            self._pubsub_thread = pubsub.run_in_thread(sleep_time=0.1, daemon=True)
         self._setup_database()
-    
+        if bloom_filter:
+            self._build_bloom_filter()
+
+    def _log(self, message: str):
+        """Print a progress message unless running quietly (benchmarks)"""
+        if self.verbose:
+            print(message)
+
+    def _simulate_query(self, seconds: float):
+        """Simulate a slow database query"""
+        if self.simulate_latency:
+            time.sleep(seconds)
+
+    def _fetch_user(self, user_id: int) -> Optional[Dict]:
+        """Query a single user row from the database"""
+        self._simulate_query(0.1)  # Simulate slow database query
+        with self._db_lock:
+            self.db_queries += 1
+            self.cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
+            row = self.cursor.fetchone()
+        return dict(row) if row else None
+
+    def _fetch_users_by_city(self, city: str) -> List[Dict]:
+        """Query all users of a city from the database"""
+        self._simulate_query(0.15)  # Simulate slow query
+        with self._db_lock:
+            self.db_queries += 1
+            self.cursor.execute("SELECT * FROM users WHERE city = ?", (city,))
+            rows = self.cursor.fetchall()
+        return [dict(row) for row in rows]
+
+    def _on_invalidation(self, message: Dict):
+        """Pub/sub handler: drop an invalidated key (or everything for '*') from the L1 cache"""
+        key = message["data"]
+        if key == "*":
+            self.l1.clear()
+        else:
+            self.l1.delete(key)
+
+    def _publish_invalidation(self, *keys: str):
+        """
+        Drop keys from our L1 (if any) and tell every other process to do the
+        same; writers without an L1 still publish for their peers
+        """
+        if self.l1 is not None:
+            for key in keys:
+                self._on_invalidation({"data": key})
+        pipe = self.redis_client.pipeline(transaction=False)
+        for key in keys:
+            pipe.publish(INVALIDATION_CHANNEL, key)
+        pipe.execute()
+
+    def _l1_store(self, cache_key: str, entry, cached_data: bytes):
+        if self.l1 is not None:
+            self.l1.set(cache_key, entry, len(cached_data), self.l1_ttl)
+
+    def _cache_get(self, cache_key: str, use_l1: bool = True):
+        """Read a parsed entry from L1, falling back to Redis (L2)"""
+        if self.l1 is not None and use_l1:
+            entry = self.l1.get(cache_key)
+            if entry is not None:
+                self.l1_hits += 1
+                return entry
+            self.l1_misses += 1
+
+        cached_data = self.binary_client.get(cache_key)
+        if cached_data is None:
+            self.l2_misses += 1
+            return None
+        self.l2_hits += 1
+        entry = self.codec.decode(cached_data)
+        self._l1_store(cache_key, entry, cached_data)
+        return entry
+
+    def _cache_get_many(self, cache_keys: List[str]) -> List:
+        """Read parsed entries for many keys: L1 first, then one MGET for the rest"""
+        entries = [None] * len(cache_keys)
+        pending = []
+        for i, cache_key in enumerate(cache_keys):
+            entry = self.l1.get(cache_key) if self.l1 is not None else None
+            if entry is not None:
+                self.l1_hits += 1
+                entries[i] = entry
+            else:
+                pending.append(i)
+        if self.l1 is not None:
+            self.l1_misses += len(pending)
+
+        if pending:
+            cached_values = self.binary_client.mget([cache_keys[i] for i in pending])
+            for i, cached_data in zip(pending, cached_values):
+                if cached_data is None:
+                    self.l2_misses += 1
+                    continue
+                self.l2_hits += 1
+                entries[i] = self.codec.decode(cached_data)
+                self._l1_store(cache_keys[i], entries[i], cached_data)
+        return entries
+
+    def _cache_set(self, cache_key: str, entry, ttl: int, client=None, tags: Iterable[str] = ()):
+        """
+        Write an entry to Redis (or a pipeline passed as client) and to L1,
+        registering the key under each tag it depends on (`tag:{tag}` sets)
+        """
+        cached_data = self.codec.encode(entry)
+        pipe = client or self.binary_client.pipeline(transaction=False)
+        pipe.setex(cache_key, ttl, cached_data)
+        for tag in tags:
+            tag_key = f"tag:{tag}"
+            pipe.sadd(tag_key, cache_key)
+            # The tag set must outlive every key registered in it: set a TTL if
+            # it has none, otherwise only ever extend it
+            pipe.expire(tag_key, ttl, nx=True)
+            pipe.expire(tag_key, ttl, gt=True)
+        if client is None:
+            pipe.execute()
+        self._l1_store(cache_key, entry, cached_data)
+
+    @staticmethod
+    def _user_tags(user: Dict) -> List[str]:
+        """Tags a cached user row depends on"""
+        return [f"user:{user['id']}"]
+
+    @staticmethod
+    def _city_tags(city: str, users: List[Dict]) -> List[str]:
+        """Tags a cached city list depends on: the city itself and every member"""
+        return [f"city:{city}"] + [f"user:{user['id']}" for user in users]
+
+    def _invalidate_tags(self, tags: Iterable[str], extra_keys: Iterable[str] = ()) -> List[str]:
+        """
+        Delete every key depending on any of the tags (plus extra_keys) in one
+        round trip and drop them from all L1 caches; returns the keys deleted
+        """
+        extra_keys = list(extra_keys)
+        deleted = self._invalidate_tags_script(keys=[f"tag:{tag}" for tag in tags], args=extra_keys)
+        # Peers may hold extra_keys in L1 even if Redis no longer has them
+        self._publish_invalidation(*dict.fromkeys(deleted + extra_keys))
+        return deleted
+
+    def _make_entry(self, value, ttl: int, delta: float = 0.0):
+        """Build a cache entry (with expiry metadata in stampede-safe mode)"""
+        if not self.stampede_protection:
+            return value
+        return {WRAPPED_ENTRY_MARKER: 1, "value": value, "expires_at": time.time() + ttl, "delta": delta}
+
+    def _physical_ttl(self, ttl: int) -> int:
+        """Redis TTL for an entry; stampede-safe entries outlive their logical TTL to be served stale"""
+        return ttl + self.stale_ttl if self.stampede_protection else ttl
+
+    def _wrapped_cache_get(self, cache_key: str, use_l1: bool = True):
+        """
+        _cache_get for stampede-safe reads. A plain entry (written by a plain
+        or async instance) has no expiry metadata, so it counts as fresh until
+        Redis expires it
+        """
+        entry = self._cache_get(cache_key, use_l1)
+        if entry is None or is_wrapped_entry(entry):
+            return entry
+        return {WRAPPED_ENTRY_MARKER: 1, "value": entry, "expires_at": math.inf, "delta": 0.0}
+
+    def _should_recompute(self, entry: Dict) -> bool:
+        """
+        XFetch: refresh before expiry with a probability that grows as the
+        expiry approaches and with the time the value took to compute
+        """
+        jitter = -entry["delta"] * self.xfetch_beta * math.log(1.0 - random.random())
+        return time.time() + jitter >= entry["expires_at"]
+
+    def _read_through(self, cache_key: str, ttl: int, loader, label: str, tags_for=None):
+        """Stampede-safe read-through: single-flight rebuild behind a Redis lock lease"""
+        entry = self._wrapped_cache_get(cache_key)
+
+        if entry is not None and not self._should_recompute(entry):
+            self._log(f"  → CACHE HIT for {label}")
+            return entry["value"]
+
+        lock_key = f"lock:{cache_key}"
+        token = uuid.uuid4().hex
+        if self.redis_client.set(lock_key, token, nx=True, px=int(self.lock_lease * 1000)):
+            try:
+                # Someone may have rebuilt the key between our GET and taking the lock
+                current = self._wrapped_cache_get(cache_key, use_l1=False)
+                if current is not None and (entry is None or current["expires_at"] != entry["expires_at"]):
+                    self._log(f"  → CACHE HIT for {label} (rebuilt by another caller)")
+                    return current["value"]
+
+                self._log(f"  → CACHE MISS for {label} - rebuilding (lock held)")
+                start = time.time()
+                value = loader()
+                delta = time.time() - start
+                if value is not None:
+                    self._cache_set(cache_key, self._make_entry(value, ttl, delta), self._physical_ttl(ttl),
+                                    tags=tags_for(value) if tags_for else ())
+                elif self.negative_ttl:
+                    self._cache_set(cache_key, self._make_entry(NEGATIVE_ENTRY, self.negative_ttl, delta),
+                                    self._physical_ttl(self.negative_ttl))
+                return value
+            finally:
+                self._release_lock(keys=[lock_key], args=[token])
+
+        # Another caller is rebuilding: serve what we have, even if stale
+        if entry is not None:
+            self._log(f"  → STALE HIT for {label} (rebuild in progress)")
+            return entry["value"]
+
+        # Nothing to serve yet; wait briefly for the rebuild to land
+        deadline = time.time() + self.lock_lease
+        while time.time() < deadline:
+            time.sleep(0.01)
+            current = self._wrapped_cache_get(cache_key, use_l1=False)
+            if current is not None:
+                self._log(f"  → CACHE HIT for {label} (after waiting for rebuild)")
+                return current["value"]
+
+        # The lock holder is gone or too slow; go to the database ourselves
+        self._log(f"  → Rebuild wait timed out for {label} - querying database")
+        return loader()
+
     def _setup_database(self):
         """Create and populate sample database"""
-        # Create users table
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY,
-                name TEXT NOT NULL,
-                email TEXT NOT NULL,
-                city TEXT NOT NULL,
-                age INTEGER,
-                views INTEGER DEFAULT 0
-            )
-        """)
+        with self._db_lock:
+            setup_database(self.conn, self._log)
 
-        try:
-            self.cursor.execute("SELECT views FROM users LIMIT 1")
-        except sqlite3.OperationalError:
-            # Add views column if it doesn't exist
-            self.cursor.execute("ALTER TABLE users ADD COLUMN views INTEGER DEFAULT 0")
-            print("✓ Added views column to existing users table")
-        
-        # Check if we need to populate data
-        self.cursor.execute("SELECT COUNT(*) FROM users")
-        count = self.cursor.fetchone()[0]
-        
-        if count == 0:
-            print("Populating database with sample data...")
-            sample_users = [
-                (1, "Alice Johnson", "alice@example.com", "New York", 28, 0),
-                (2, "Bob Smith", "bob@example.com", "Los Angeles", 34, 0),
-                (3, "Carol White", "carol@example.com", "Chicago", 25, 0),
-                (4, "David Brown", "david@example.com", "Houston", 31, 0),
-                (5, "Eve Davis", "eve@example.com", "Phoenix", 29, 0),
-                (6, "Frank Wilson", "frank@example.com", "New York", 27, 0),
-                (7, "Grace Lee", "grace@example.com", "San Francisco", 33, 0),
-                (8, "Henry Martinez", "henry@example.com", "Seattle", 30, 0),
-                (9, "Iris Taylor", "iris@example.com", "Boston", 26, 0),
-                (10, "Jack Anderson", "jack@example.com", "Austin", 35, 0),
-            ]
-            
-            self.cursor.executemany(
-                "INSERT INTO users (id, name, email, city, age, views) VALUES (?, ?, ?, ?, ?, ?)",
-                sample_users
-            )
-            self.conn.commit()
-            print(f"✓ Inserted {len(sample_users)} users into database")
+    def _build_bloom_filter(self):
+        """
+        (Re)build the shared Bloom filter from every user id in the database,
+        with 2x headroom for inserts. The bitmap is written under a new key and
+        swapped in atomically; ids inserted meanwhile may have gone to the old
+        bitmap, so they are added again afterwards.
+        """
+        with self._db_lock:
+            user_ids = [row[0] for row in self.conn.execute("SELECT id FROM users")]
+        bloom = BloomFilter(max(2 * len(user_ids), 1024), self.bloom_error_rate)
+        for user_id in user_ids:
+            bloom.add(user_id)
+
+        bits_key = f"{BLOOM_KEY}:bits:{uuid.uuid4().hex}"
+        self.binary_client.set(bits_key, bloom.to_bytes())
+        self._bloom_swap_script(keys=[BLOOM_KEY],
+                                args=[bits_key, bloom.size, bloom.hash_count, bloom.capacity, len(user_ids)])
+
+        with self._db_lock:
+            newer_ids = [row[0] for row in self.conn.execute("SELECT id FROM users WHERE id > ?",
+                                                             (max(user_ids, default=0),))]
+        if newer_ids:
+            self._bloom_add(newer_ids)
+        self._log(f"✓ Built Bloom filter of {len(user_ids)} user ids ({len(bloom._bits) / 1024:.1f} KB)")
+
+    @staticmethod
+    def _bloom_args(user_ids: Iterable[int]) -> List[int]:
+        return [h for user_id in user_ids for h in BloomFilter.hash_pair(user_id)]
+
+    def _bloom_add(self, user_ids: List[int]):
+        """Set the ids' bits in the shared filter, rebuilding it once it holds more than its capacity"""
+        added = self._bloom_add_script(keys=[BLOOM_KEY], args=self._bloom_args(user_ids))
+        # With no filter there is nothing to update: the next check rebuilds it from the database
+        if added != -1 and added[0] > added[1]:
+            self._build_bloom_filter()  # Keep the false-positive rate near its target
+
+    def _definitely_missing_many(self, user_ids: List[int]) -> List[bool]:
+        """For each id, True if the shared Bloom filter proves the user does not exist (one round trip)"""
+        if not self.bloom_filter or not user_ids:
+            return [False] * len(user_ids)
+        args = self._bloom_args(user_ids)
+        found = self._bloom_check_script(keys=[BLOOM_KEY], args=args)
+        if found == -1:
+            self._build_bloom_filter()
+            found = self._bloom_check_script(keys=[BLOOM_KEY], args=args)
+            if found == -1:
+                return [False] * len(user_ids)
+        missing = [not present for present in found]
+        self.bloom_rejections += sum(missing)
+        return missing
+
+    def _definitely_missing(self, user_id: int) -> bool:
+        """True if the shared Bloom filter proves the user does not exist"""
+        return self._definitely_missing_many([user_id])[0]
+
+    def _from_cache(self, value):
+        """Translate a cached value for callers: negative entries mean 'no such row'"""
+        if value == NEGATIVE_ENTRY:
+            self.negative_hits += 1
+            return None
+        return value
     
     def get_user_by_id_no_cache(self, user_id: int) -> Optional[Dict]:
         """Get user from database WITHOUT caching"""
-        time.sleep(0.1)  # Simulate slow database query
-        
-        self.cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-        row = self.cursor.fetchone()
-        
-        if row:
-            return dict(row)
-        return None
+        return self._fetch_user(user_id)
     
     def get_user_by_id_with_cache(self, user_id: int, ttl: int = 300) -> Optional[Dict]:
         """Get user from database WITH Redis caching"""
         cache_key = f"user:{user_id}"
+
+        if self.stampede_protection:
+            # The filter is only consulted on a miss; a rejected id is cached as missing
+            return self._from_cache(self._read_through(
+                cache_key, ttl, lambda: None if self._definitely_missing(user_id) else self._fetch_user(user_id),
+                f"user {user_id}", self._user_tags))
         
-        # Try to get from cache first
-        cached_data = self.redis_client.get(cache_key)
+        # Try to get from cache first (a stampede-safe instance may have written it)
+        cached_data = unwrap_entry(self._cache_get(cache_key))
         
-        if cached_data:
-            print(f"  → CACHE HIT for user {user_id}")
-            return json.loads(cached_data)
+        if cached_data is not None:
+            self._log(f"  → CACHE HIT for user {user_id}")
+            return self._from_cache(cached_data)
         
+        if self._definitely_missing(user_id):
+            self._log(f"  → BLOOM FILTER MISS for user {user_id} - skipping database")
+            return None
+
         # Cache miss - get from database
-        print(f"  → CACHE MISS for user {user_id} - querying database")
-        time.sleep(0.1)  # Simulate slow database query
-        
-        self.cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-        row = self.cursor.fetchone()
+        self._log(f"  → CACHE MISS for user {user_id} - querying database")
+        user_data = self._fetch_user(user_id)
         
-        if row:
-            user_data = dict(row)
+        if user_data:
             # Store in cache with TTL (time to live)
-            self.redis_client.setex(cache_key, ttl, json.dumps(user_data))
-            print(f"  → Cached user {user_id} for {ttl} seconds")
+            self._cache_set(cache_key, user_data, ttl, tags=self._user_tags(user_data))
+            self._log(f"  → Cached user {user_id} for {ttl} seconds")
             return user_data
-        
+
+        if self.negative_ttl:
+            self._cache_set(cache_key, NEGATIVE_ENTRY, self.negative_ttl)
+            self._log(f"  → Cached missing user {user_id} for {self.negative_ttl} seconds")
         return None
     
     def get_users_by_city(self, city: str, use_cache: bool = True, ttl: int = 300) -> List[Dict]:
         """Get all users from a specific city"""
         cache_key = f"users:city:{city}"
+
+        if use_cache and self.stampede_protection:
+            return self._read_through(cache_key, ttl, lambda: self._fetch_users_by_city(city), f"city '{city}'",
+                                      lambda users: self._city_tags(city, users))
         
         if use_cache:
             # Try cache first
-            cached_data = self.redis_client.get(cache_key)
-            if cached_data:
-                print(f"  → CACHE HIT for city '{city}'")
-                return json.loads(cached_data)
-            print(f"  → CACHE MISS for city '{city}'")
+            cached_data = unwrap_entry(self._cache_get(cache_key))
+            if cached_data is not None:
+                self._log(f"  → CACHE HIT for city '{city}'")
+                return cached_data
+            self._log(f"  → CACHE MISS for city '{city}'")
         
         # Query database
-        time.sleep(0.15)  # Simulate slow query
-        self.cursor.execute("SELECT * FROM users WHERE city = ?", (city,))
-        rows = self.cursor.fetchall()
-        users = [dict(row) for row in rows]
+        users = self._fetch_users_by_city(city)
         
         if use_cache:
-            self.redis_client.setex(cache_key, ttl, json.dumps(users))
-            print(f"  → Cached {len(users)} users for city '{city}'")
-        
+            self._cache_set(cache_key, users, ttl, tags=self._city_tags(city, users))
+            self._log(f"  → Cached {len(users)} users for city '{city}'")
+
         return users
-    
+
+    def get_users_by_ids(self, user_ids: Iterable[int], ttl: int = 300) -> List[Optional[Dict]]:
+        """
+        Get many users WITH Redis caching in a constant number of round trips:
+        one MGET for all keys, one SELECT ... WHERE id IN (...) for the misses
+        and one pipelined SETEX to backfill them.
+        Returns results in input order (None for ids that do not exist)
+        """
+        user_ids = list(user_ids)
+        if not user_ids:
+            return []
+
+        cache_keys = [f"user:{user_id}" for user_id in user_ids]
+        cached_entries = self._cache_get_many(cache_keys)
+
+        results: List[Optional[Dict]] = [None] * len(user_ids)
+        missing_ids = []
+        for i, (user_id, entry) in enumerate(zip(user_ids, cached_entries)):
+            value = unwrap_entry(entry)
+            if value is not None:
+                results[i] = self._from_cache(value)
+            else:
+                missing_ids.append(user_id)
+
+        # Duplicate ids in the input only need to be fetched once
+        missing_ids = list(dict.fromkeys(missing_ids))
+        # Misses the Bloom filter rules out never reach the database
+        ruled_out = self._definitely_missing_many(missing_ids)
+        self._log(f"  → Batch lookup: {len(user_ids) - len(missing_ids)} hits, {len(missing_ids)} misses, "
+                  f"{sum(ruled_out)} ruled out by Bloom filter")
+        missing_ids = [user_id for user_id, rejected in zip(missing_ids, ruled_out) if not rejected]
+
+        if missing_ids:
+            self._simulate_query(0.1)  # Simulate slow database query
+            found = {}
+            with self._db_lock:
+                self.db_queries += 1
+                for start in range(0, len(missing_ids), SQLITE_MAX_PARAMS):
+                    chunk = missing_ids[start:start + SQLITE_MAX_PARAMS]
+                    placeholders = ",".join("?" * len(chunk))
+                    self.cursor.execute(f"SELECT * FROM users WHERE id IN ({placeholders})", chunk)
+                    for row in self.cursor.fetchall():
+                        found[row["id"]] = dict(row)
+
+            # Backfill every miss in a single round trip
+            pipe = self.binary_client.pipeline(transaction=False)
+            for user_id, user_data in found.items():
+                self._cache_set(f"user:{user_id}", self._make_entry(user_data, ttl), self._physical_ttl(ttl), pipe,
+                                tags=self._user_tags(user_data))
+            if self.negative_ttl:
+                for user_id in missing_ids:
+                    if user_id not in found:
+                        self._cache_set(f"user:{user_id}", self._make_entry(NEGATIVE_ENTRY, self.negative_ttl),
+                                        self._physical_ttl(self.negative_ttl), pipe)
+            pipe.execute()
+            self._log(f"  → Cached {len(found)} users for {ttl} seconds")
+
+            for i, user_id in enumerate(user_ids):
+                if results[i] is None and user_id in found:
+                    results[i] = found[user_id]
+
+        return results
+
+    def seed_users(self, count: int):
+        """Add synthetic users until the table holds at least `count` rows"""
+        with self._db_lock:
+            seed_users(self.conn, count, self._log)
+        if self.bloom_filter:
+            self._build_bloom_filter()
+
+    def add_user(self, name: str, email: str, city: str, age: Optional[int] = None) -> Dict:
+        """
+        Insert a new user, add them to the shared Bloom filter and drop any
+        cached 'missing' entry for the id along with the city's cached list
+        """
+        with self._db_lock, self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO users (name, email, city, age, views) VALUES (?, ?, ?, ?, 0)",
+                (name, email, city, age)
+            )
+            user_id = cursor.lastrowid
+        if self.bloom_filter:
+            self._bloom_add([user_id])
+
+        self._invalidate_tags([f"city:{city}"], extra_keys=[f"user:{user_id}"])
+        self._log(f"✓ Added user {user_id}")
+        return {"id": user_id, "name": name, "email": email, "city": city, "age": age, "views": 0}
+
     def invalidate_user_cache(self, user_id: int):
-        """Remove user from cache (useful when updating data)"""
+        """Remove user (and every cached list containing them) from cache"""
         cache_key = f"user:{user_id}"
-        result = self.redis_client.delete(cache_key)
-        if result:
-            print(f"✓ Invalidated cache for user {user_id}")
+        deleted = self._invalidate_tags([f"user:{user_id}"], extra_keys=[cache_key])
+        if deleted:
+            self._log(f"✓ Invalidated cache for user {user_id} ({len(deleted)} keys)")
         else:
-            print(f"  No cache entry found for user {user_id}")
+            self._log(f"  No cache entry found for user {user_id}")
+
+    def update_user(self, user_id: int, **fields) -> Optional[Dict]:
+        """
+        Update a user's columns and invalidate exactly the cache entries that
+        depend on them: the user row, every list containing the user and, when
+        the user moves, the lists of both the old and the new city.
+        Returns the updated user (None if the user does not exist)
+        """
+        unknown = set(fields) - set(UPDATABLE_USER_FIELDS)
+        if unknown:
+            raise ValueError(f"Cannot update user fields: {', '.join(sorted(unknown))}")
+
+        with self._db_lock:
+            self.cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
+            row = self.cursor.fetchone()
+            if row is None:
+                return None
+            old_user = dict(row)
+
+            if fields:
+                assignments = ", ".join(f"{column} = ?" for column in fields)
+                with self.conn:
+                    self.conn.execute(f"UPDATE users SET {assignments} WHERE id = ?", (*fields.values(), user_id))
+        new_user = {**old_user, **fields}
+
+        tags = {f"user:{user_id}", f"city:{old_user['city']}", f"city:{new_user['city']}"}
+        deleted = self._invalidate_tags(sorted(tags), extra_keys=[f"user:{user_id}"])
+        self._log(f"✓ Updated user {user_id}; invalidated {len(deleted)} dependent keys")
+        return new_user
     
     def clear_all_cache(self):
         """Clear all cached data"""
         self.redis_client.flushdb()
-        print("✓ Cleared all cache data")
+        self._publish_invalidation("*")
+        self._log("✓ Cleared all cache data")
     
     def get_cache_stats(self):
         """Get Redis cache statistics"""
@@ -155,50 +1057,58 @@ class DatabaseWithCache:
         print(f"  Cached keys: {keys}")
         print(f"  Total connections: {info.get('total_connections_received', 'N/A')}")
         print(f"  Commands processed: {info.get('total_commands_processed', 'N/A')}")
+        if self.l1 is not None:
+            print(f"  L1 (in-process) hit rate: {self._hit_rate(self.l1_hits, self.l1_misses)} "
+                  f"({len(self.l1)} entries)")
+        print(f"  L2 (Redis) hit rate: {self._hit_rate(self.l2_hits, self.l2_misses)}")
+        print(f"  DB queries run: {self.db_queries}")
+        print(f"  DB queries avoided for missing users: {self.negative_hits + self.bloom_rejections} "
+              f"(negative cache: {self.negative_hits}, Bloom filter: {self.bloom_rejections})")
+
+    @staticmethod
+    def _hit_rate(hits: int, misses: int) -> str:
+        total = hits + misses
+        return f"{hits / total * 100:.1f}% ({hits}/{total})" if total else "N/A"
 
     def increment_post_views(self, post_id: int) -> int:
         """
-        Increment the view count for a post using Redis caching
-        Every 10 views, sync the count back to the database
+        Increment the view count for a post in Redis only (write-behind)
+        The post is marked dirty and the background flusher syncs it to the database
         Returns the current view count
         """
         # Use Redis key for this post's views
         cache_key = f"views:post:{post_id}"
-        
-        # Increment the view count in Redis
-        view_count = self.redis_client.incr(cache_key)
-        
-        # Every 10 views, save the count back to the database
-        if view_count % 10 == 0:
-            self.cursor.execute("UPDATE users SET views = ? WHERE id = ?", (view_count, post_id))
-            self.conn.commit()
-            print("✓ Synced views to database")
-        
-        return view_count
 
-    def increment_post_views(self, post_id: int) -> int:
-        # Use Redis key for this post's views  
-        cache_key = f"views:post:{post_id}"
-        
-        # Increment the view count in Redis using INCR
-        view_count = self.redis_client.incr(cache_key)
-        
-        # Every 10 views, save the count back to the database
-        if view_count % 10 == 0:
-            self.cursor.execute("UPDATE users SET views = ? WHERE id = ?", (view_count, post_id))
-            self.conn.commit()
-            print("✓ Synced views to database")
-        
+        # INCR and mark dirty in one round trip; the SADD lands after the INCR,
+        # so a concurrent flush can only ever miss a count that is re-marked dirty
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.incr(cache_key)
+        pipe.sadd(DIRTY_VIEWS_KEY, post_id)
+        view_count, _ = pipe.execute()
+
+        self.view_flusher.record()
         return view_count
-    
+
+    def flush_view_counts(self) -> int:
+        """Sync all pending view counts to the database now; returns the number of posts written"""
+        return self.view_flusher.flush()
+
     def close(self):
         """Close database and Redis connections"""
+        if self._pubsub_thread is not None:
+            self._pubsub_thread.stop()
+        # Write any pending view counts before the connection goes away
+        self.view_flusher.stop()
         self.conn.close()
         self.redis_client.close()
+        self.binary_client.close()
 
 
 def run_demo():
-    """Run the Redis caching demonstration"""
+    """
+    Run the Redis caching demonstration
+    The timings here rely on simulated sleeps; use benchmark.py for real workload numbers
+    """
     print("=" * 60)
     print("REDIS CACHING DEMO")
     print("=" * 60 + "\n")
@@ -312,10 +1222,408 @@ def test_view_counter():
         total_views = db.increment_post_views(1)
         print(f"View #{i}: Total views = {total_views}")
         time.sleep(0.05)  # Small delay
+
+    # The background flusher has synced at least once by now; make the rest durable
+    db.flush_view_counts()
+    db.cursor.execute("SELECT views FROM users WHERE id = ?", (1,))
+    db_views = db.cursor.fetchone()[0]
+    print(f"\nViews in database: {db_views} "
+          f"({db.view_flusher.flushes} flushes, {db.view_flusher.rows_written} rows written)")
+    assert db_views == total_views
     
     db.close()
 
+def test_stampede_protection(readers: int = 50):
+    """50 concurrent readers of an expiring hot key should cause exactly one DB hit per expiry"""
+    print("=" * 60)
+    print("=== Testing Cache-Stampede Protection ===")
+    print("=" * 60)
+
+    def stampede(db: DatabaseWithCache, read) -> int:
+        """Release all readers at once and count the database queries they cause"""
+        barrier = threading.Barrier(readers)
+        errors = []
+
+        def reader():
+            barrier.wait()
+            try:
+                read()
+            except Exception as e:
+                errors.append(e)
+
+        before = db.db_queries
+        threads = [threading.Thread(target=reader) for _ in range(readers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert not errors, errors
+        return db.db_queries - before
+
+    ttl = 1
+    unsafe_db = DatabaseWithCache(verbose=False)
+    unsafe_db.clear_all_cache()
+    hits = stampede(unsafe_db, lambda: unsafe_db.get_user_by_id_with_cache(1, ttl=ttl))
+    print(f"\n[Unprotected] cold key, {readers} readers: {hits} DB queries")
+    unsafe_db.close()
+
+    # XFetch off so the only rebuilds are the forced expiries under test
+    db = DatabaseWithCache(verbose=False, stampede_protection=True, xfetch_beta=0.0)
+    db.clear_all_cache()
+
+    for label, read in [("user 1", lambda: db.get_user_by_id_with_cache(1, ttl=ttl)),
+                        ("city 'New York'", lambda: db.get_users_by_city("New York", ttl=ttl))]:
+        hits = stampede(db, read)
+        print(f"[Protected] {label}, cold key, {readers} readers: {hits} DB queries")
+        assert hits == 1, f"expected exactly one DB query, got {hits}"
+
+        for expiry in range(1, 3):
+            time.sleep(ttl + 0.2)  # Let the entry expire logically (it is still served stale)
+            hits = stampede(db, read)
+            print(f"[Protected] {label}, expiry #{expiry}, {readers} readers: {hits} DB queries")
+            assert hits == 1, f"expected exactly one DB query, got {hits}"
+
+    db.clear_all_cache()
+    db.close()
+    print("\n✅ Exactly one DB query per expiry")
+
+
+def test_l1_invalidation():
+    """Two app 'processes' with L1 caches stay coherent through pub/sub invalidation"""
+    print("=" * 60)
+    print("=== Testing L1 Cache Invalidation ===")
+    print("=" * 60)
+
+    app_a = DatabaseWithCache(verbose=False, l1_cache=True)
+    app_b = DatabaseWithCache(verbose=False, l1_cache=True)
+    app_a.clear_all_cache()
+    time.sleep(0.3)  # Let both subscribers process the flush
+
+    for _ in range(5):
+        app_a.get_user_by_id_with_cache(1)
+        app_b.get_user_by_id_with_cache(1)
+    assert app_b.l1.get("user:1") is not None, "user 1 should be in app B's L1"
+    print("\n✓ Both processes serve user 1 from their L1 caches")
+
+    app_a.invalidate_user_cache(1)
+    time.sleep(0.3)  # Pub/sub delivery is asynchronous
+    assert app_a.l1.get("user:1") is None
+    assert app_b.l1.get("user:1") is None, "app B should have dropped user 1 from its L1"
+    print("✓ Invalidation in process A dropped user 1 from process B's L1")
+
+    # A writer with no L1 of its own must still notify the processes that have one
+    writer = DatabaseWithCache(db_name=":memory:", verbose=False)
+    app_b.get_user_by_id_with_cache(2)
+    assert app_b.l1.get("user:2") is not None
+    writer.update_user(2, city="Denver")
+    time.sleep(0.3)
+    assert app_b.l1.get("user:2") is None, "an update from a process without L1 should reach app B"
+    print("✓ Update in a process without L1 dropped user 2 from process B's L1")
+    writer.close()
+
+    for name, app in (("A", app_a), ("B", app_b)):
+        print(f"\n[Process {name}]")
+        print(f"  L1 hit rate: {app._hit_rate(app.l1_hits, app.l1_misses)}")
+        print(f"  L2 hit rate: {app._hit_rate(app.l2_hits, app.l2_misses)}")
+
+    app_a.close()
+    app_b.close()
+
+
+def test_negative_caching():
+    """Lookups of ids that do not exist should stop reaching the database"""
+    print("=" * 60)
+    print("=== Testing Negative Caching and Bloom Filter ===")
+    print("=" * 60)
+
+    probe_ids = [random.randint(1000, 10 ** 6) for _ in range(200)]
+
+    for label, options in (("No negative caching", {"negative_ttl": 0}),
+                           ("Negative caching", {}),
+                           ("Negative caching + Bloom filter", {"bloom_filter": True})):
+        db = DatabaseWithCache(db_name=":memory:", verbose=False, simulate_latency=False, **options)
+        db.clear_all_cache()
+        for _ in range(3):  # A scraper probing the same random ids repeatedly
+            for user_id in probe_ids:
+                assert db.get_user_by_id_with_cache(user_id) is None
+        print(f"\n[{label}] {3 * len(probe_ids)} lookups of missing ids")
+        print(f"  DB queries: {db.db_queries}")
+        print(f"  Avoided: negative cache {db.negative_hits}, Bloom filter {db.bloom_rejections}")
+
+        if db.bloom_filter:
+            # New users must be visible straight away despite the filter and any negative entry
+            new_user = db.add_user("Kim Park", "kim@example.com", "Denver", 41)
+            assert db.get_user_by_id_with_cache(new_user["id"])["name"] == "Kim Park"
+            print(f"  ✓ Newly added user {new_user['id']} is found")
+
+        db.clear_all_cache()
+        db.close()
+
+
+def test_shared_bloom_filter():
+    """A user added by one instance is found by another whose Bloom filter was built before the insert"""
+    import os
+    import tempfile
+
+    print("=" * 60)
+    print("=== Testing Bloom Filter Shared Across Instances ===")
+    print("=" * 60)
+
+    # Both instances need the same database, so use a file rather than :memory:
+    fd, db_path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    app_a = DatabaseWithCache(db_name=db_path, verbose=False, simulate_latency=False, bloom_filter=True)
+    app_b = DatabaseWithCache(db_name=db_path, verbose=False, simulate_latency=False, bloom_filter=True)
+    app_a.clear_all_cache()
+
+    next_id = app_b.get_user_by_id_no_cache(10)["id"] + 1
+    assert app_b.get_user_by_id_with_cache(next_id) is None
+    assert app_b.bloom_rejections == 1, "the filter should rule out the id before it exists"
+
+    new_user = app_a.add_user("Kim Park", "kim@example.com", "Denver", 41)
+    assert new_user["id"] == next_id
+    assert app_b.get_user_by_id_with_cache(next_id)["name"] == "Kim Park", "instance B missed A's insert"
+    assert app_b.get_users_by_ids([next_id])[0]["name"] == "Kim Park"
+    print(f"\n✓ User {next_id} added by instance A is found by instance B")
+
+    # A flushed filter is rebuilt from the database on the next check
+    app_a.clear_all_cache()
+    assert app_b.get_user_by_id_with_cache(next_id)["name"] == "Kim Park"
+    assert app_b.get_user_by_id_with_cache(10 ** 6) is None
+    assert app_b.bloom_rejections == 2
+    print("✓ The filter is rebuilt after a flush and still rules out missing ids")
+
+    app_a.clear_all_cache()
+    app_a.close()
+    app_b.close()
+    os.remove(db_path)
+
+
+def test_tag_invalidation():
+    """update_user should drop exactly the cache entries that depend on the user"""
+    print("=" * 60)
+    print("=== Testing Dependency-Aware Invalidation ===")
+    print("=" * 60)
+
+    # In-memory copy of the sample data so the update does not touch demo.db
+    db = DatabaseWithCache(db_name=":memory:", verbose=False)
+    db.clear_all_cache()
+
+    db.get_user_by_id_with_cache(1)
+    db.get_user_by_id_with_cache(2)
+    for city in ("New York", "Chicago", "Los Angeles"):
+        db.get_users_by_city(city)
+
+    print("\n[Move user 1 from New York to Chicago]")
+    db.update_user(1, city="Chicago")
+
+    cached = {key: db.redis_client.exists(key) == 1
+              for key in ("user:1", "user:2", "users:city:New York", "users:city:Chicago",
+                          "users:city:Los Angeles")}
+    for key, present in cached.items():
+        print(f"  {key:<24} {'cached' if present else 'invalidated'}")
+    assert cached == {"user:1": False, "user:2": True, "users:city:New York": False,
+                      "users:city:Chicago": False, "users:city:Los Angeles": True}
+
+    assert db.get_user_by_id_with_cache(1)["city"] == "Chicago"
+    assert 1 not in [u["id"] for u in db.get_users_by_city("New York")]
+    assert 1 in [u["id"] for u in db.get_users_by_city("Chicago")]
+    print("\n✅ Fresh reads after update without flushing the cache")
+
+    db.clear_all_cache()
+    db.close()
+
+
+def test_mixed_entry_formats():
+    """Plain, stampede-safe and async instances sharing one Redis read each other's entries"""
+    import asyncio
+    from async_cache import AsyncDatabaseWithCache
+
+    print("=" * 60)
+    print("=== Testing Mixed Plain / Stampede-Safe Readers ===")
+    print("=" * 60)
+
+    plain = DatabaseWithCache(db_name=":memory:", verbose=False, simulate_latency=False)
+    safe = DatabaseWithCache(db_name=":memory:", verbose=False, simulate_latency=False, stampede_protection=True)
+    plain.clear_all_cache()
+
+    # Plain entries under a stampede-safe reader
+    plain.get_user_by_id_with_cache(1)
+    plain.get_users_by_city("Chicago")
+    assert safe.get_user_by_id_with_cache(1)["name"] == "Alice Johnson"
+    assert [u["id"] for u in safe.get_users_by_city("Chicago")] == [3]
+    assert safe.db_queries == 0, "plain entries should be served, not rebuilt"
+    print("\n✓ Stampede-safe reader serves plain entries")
+
+    # Wrapped entries under plain and async readers
+    plain.clear_all_cache()
+    safe.get_user_by_id_with_cache(2)
+    safe.get_users_by_city("Boston")
+    safe.get_users_by_ids([4, 10 ** 6])
+    before = plain.db_queries
+    assert plain.get_user_by_id_with_cache(2)["name"] == "Bob Smith"
+    assert [u["id"] for u in plain.get_users_by_city("Boston")] == [9]
+    assert [u and u["id"] for u in plain.get_users_by_ids([2, 4, 10 ** 6])] == [2, 4, None]
+    assert plain.get_user_by_id_with_cache(10 ** 6) is None
+    assert plain.db_queries == before, "wrapped entries should be served, not rebuilt"
+    print("✓ Plain reader serves wrapped entries (rows, lists and negative entries)")
+
+    async def async_reads():
+        async with AsyncDatabaseWithCache(db_name=":memory:", verbose=False, simulate_latency=False) as db:
+            assert (await db.get_user_by_id_with_cache(2))["name"] == "Bob Smith"
+            assert [u["id"] for u in await db.get_users_by_city("Boston")] == [9]
+            assert [u and u["id"] for u in await db.get_users_by_ids([4, 10 ** 6])] == [4, None]
+            assert db.db_queries == 0
+    asyncio.run(async_reads())
+    print("✓ Async reader serves wrapped entries")
+
+    plain.clear_all_cache()
+    plain.close()
+    safe.close()
+
+
+def benchmark_view_counter(increments: int = 20000, posts: int = 100):
+    """Increments/sec of the old inline every-10th-view sync against the write-behind flusher"""
+    import os
+    import tempfile
+
+    print("=" * 60)
+    print("=== Benchmark: Inline Sync vs Write-Behind View Counter ===")
+    print("=" * 60)
+
+    # A file-backed database so every commit pays its real cost
+    fd, db_path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    db = DatabaseWithCache(db_name=db_path, verbose=False, simulate_latency=False)
+    db.seed_users(posts)
+    post_ids = [random.randint(1, posts) for _ in range(increments)]
+
+    def inline_increment(post_id: int) -> int:
+        """The previous implementation: UPDATE + commit on the request thread every 10th view"""
+        view_count = db.redis_client.incr(f"views:post:{post_id}")
+        if view_count % 10 == 0:
+            db.cursor.execute("UPDATE users SET views = ? WHERE id = ?", (view_count, post_id))
+            db.conn.commit()
+        return view_count
+
+    results = {}
+    for label, increment in (("inline sync", inline_increment), ("write-behind", db.increment_post_views)):
+        db.clear_all_cache()
+        start = time.perf_counter()
+        for post_id in post_ids:
+            increment(post_id)
+        db.flush_view_counts()  # Count the final sync against write-behind
+        elapsed = time.perf_counter() - start
+        results[label] = increments / elapsed
+        print(f"{label:>13}: {results[label]:>10,.0f} increments/sec")
+
+    print(f"\n⚡ Write-behind: {results['write-behind'] / results['inline sync']:.1f}x the throughput "
+          f"({db.view_flusher.flushes} flushes, {db.view_flusher.rows_written} rows written)")
+
+    db.clear_all_cache()
+    db.close()
+    os.remove(db_path)
+
+
+def benchmark_codecs(sizes: Iterable[int] = (1, 100, 10000), repeats: int = 5):
+    """Bytes stored and encode/decode time of each cache codec for 1/100/10k-row results"""
+    print("=" * 60)
+    print("=== Benchmark: Cache Value Codecs ===")
+    print("=" * 60)
+
+    codecs = [JsonCodec(), CompressedCodec(JsonCodec(), "zlib")]
+    if msgpack is not None:
+        codecs += [ColumnarCodec(), CompressedCodec(ColumnarCodec(), "zlib")]
+        if zstandard is not None:
+            codecs.append(CompressedCodec(ColumnarCodec(), "zstd"))
+    else:
+        print("(msgpack not installed - skipping columnar codecs)")
+
+    print(f"\n{'rows':>6} | {'codec':<16} | {'bytes':>10} | {'vs json':>7} | {'encode':>10} | {'decode':>10}")
+    print("-" * 74)
+    for size in sizes:
+        # Same row shape as the users table
+        rows = [{"id": i, "name": f"User {i}", "email": f"user{i}@example.com",
+                 "city": CITIES[i % len(CITIES)], "age": 20 + i % 50, "views": i * 7 % 1000}
+                for i in range(1, size + 1)]
+        value = rows[0] if size == 1 else rows
+        json_bytes = None
+        for codec in codecs:
+            encode_times, decode_times = [], []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                data = codec.encode(value)
+                encode_times.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                decoded = codec.decode(data)
+                decode_times.append(time.perf_counter() - start)
+            assert decoded == value, f"{codec.name} did not round-trip"
+            json_bytes = json_bytes or len(data)
+            print(f"{size:>6} | {codec.name:<16} | {len(data):>10,} | {len(data) / json_bytes:>6.0%} | "
+                  f"{min(encode_times) * 1e6:>8.0f}µs | {min(decode_times) * 1e6:>8.0f}µs")
+
+
+def benchmark_batch_lookup(sizes: Iterable[int] = (10, 100, 1000), repeats: int = 5):
+    """Compare get_users_by_ids against a per-id get_user_by_id_with_cache loop"""
+    print("=" * 60)
+    print("=== Benchmark: Batched vs Per-ID Lookup ===")
+    print("=" * 60)
+
+    # Real SQLite + Redis cost only: no simulated sleeps, no per-key logging
+    db = DatabaseWithCache(db_name=":memory:", verbose=False, simulate_latency=False)
+    db.seed_users(max(sizes))
+
+    print(f"\n{'ids':>6} | {'mode':>5} | {'per-id loop':>12} | {'batched':>10} | {'speedup':>8}")
+    print("-" * 56)
+    for size in sizes:
+        user_ids = list(range(1, size + 1))
+        for mode in ("cold", "warm"):
+            loop_times, batch_times = [], []
+            for _ in range(repeats):
+                if mode == "cold":
+                    db.clear_all_cache()
+                start = time.perf_counter()
+                loop_results = [db.get_user_by_id_with_cache(uid) for uid in user_ids]
+                loop_times.append(time.perf_counter() - start)
+
+                if mode == "cold":
+                    db.clear_all_cache()
+                start = time.perf_counter()
+                batch_results = db.get_users_by_ids(user_ids)
+                batch_times.append(time.perf_counter() - start)
+
+                assert batch_results == loop_results, "batched results differ from per-id results"
+
+            loop_time = min(loop_times)
+            batch_time = min(batch_times)
+            print(f"{size:>6} | {mode:>5} | {loop_time * 1000:>10.2f}ms | {batch_time * 1000:>8.2f}ms | "
+                  f"{loop_time / batch_time:>7.1f}x")
+
+    db.clear_all_cache()
+    db.close()
+
+
 if __name__ == "__main__":
-    run_demo()
-    print("\n\n")
-    test_view_counter()
\ No newline at end of file
+    mode = sys.argv[1] if len(sys.argv) > 1 else "demo"
+
+    if mode == "benchmark":
+        benchmark_batch_lookup()
+        print("\n")
+        benchmark_view_counter()
+        print("\n")
+        benchmark_codecs()
+    elif mode == "stampede":
+        test_stampede_protection()
+    elif mode == "l1":
+        test_l1_invalidation()
+    elif mode == "tags":
+        test_tag_invalidation()
+    elif mode == "negative":
+        test_negative_caching()
+        test_shared_bloom_filter()
+    elif mode == "mixed":
+        test_mixed_entry_formats()
+    else:
+        run_demo()
+        print("\n\n")
+        test_view_counter()
\ No newline at end of file
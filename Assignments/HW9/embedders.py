@@ -0,0 +1,88 @@
+"""
+Embedding backends for SemanticCache.
+
+Every backend turns texts into unit-length all-MiniLM-L6-v2 embeddings with
+encode(texts, batch_size) and does its heavy imports when it is constructed,
+so importing this module (or task2) stays cheap:
+
+- "torch":     sentence-transformers on PyTorch (the reference)
+- "onnx":      the model's ONNX export run by ONNX Runtime on the CPU. Needs
+               onnxruntime, tokenizers and huggingface_hub, but not torch
+- "onnx-int8": the dynamically quantized (uint8 weights, AVX2) ONNX export
+"""
+from typing import Sequence
+
+import numpy as np
+
+from semantic_store import EMBEDDING_DIM
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx-int8")
+
+# Exports published in the model repository on the Hugging Face Hub
+ONNX_FILES = {"onnx": "onnx/model.onnx", "onnx-int8": "onnx/model_quint8_avx2.onnx"}
+
+MAX_SEQ_LENGTH = 256  # all-MiniLM-L6-v2 truncates inputs at 256 word pieces
+
+
+class TorchEmbedder:
+    """SentenceTransformer wrapped to the common encode() signature"""
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name)
+
+    def encode(self, texts: Sequence[str], batch_size: int = 32) -> np.ndarray:
+        return self.model.encode(list(texts), batch_size=batch_size)
+
+
+class OnnxEmbedder:
+    """
+    The sentence-transformers pipeline without torch: tokenize, run the ONNX
+    graph, mean-pool the token embeddings over the attention mask and
+    L2-normalize. Model files are downloaded once into the Hugging Face cache.
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL, file_name: str = ONNX_FILES["onnx"],
+                 threads: int = 0):
+        import onnxruntime
+        from huggingface_hub import hf_hub_download
+        from tokenizers import Tokenizer
+
+        self.tokenizer = Tokenizer.from_file(hf_hub_download(model_name, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=MAX_SEQ_LENGTH)
+        self.tokenizer.enable_padding(pad_id=0, pad_token="[PAD]")
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads  # 0 = one per physical core
+        self.session = onnxruntime.InferenceSession(hf_hub_download(model_name, file_name), options,
+                                                    providers=["CPUExecutionProvider"])
+        self._input_names = {graph_input.name for graph_input in self.session.get_inputs()}
+
+    def encode(self, texts: Sequence[str], batch_size: int = 32) -> np.ndarray:
+        texts = list(texts)
+        embeddings = [np.empty((0, EMBEDDING_DIM), dtype=np.float32)]
+        for start in range(0, len(texts), batch_size):
+            encodings = self.tokenizer.encode_batch(texts[start:start + batch_size])
+            feed = {
+                "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+                "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+                "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+            }
+            token_embeddings = self.session.run(None, {name: value for name, value in feed.items()
+                                                       if name in self._input_names})[0]
+            mask = feed["attention_mask"][..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+            embeddings.append((pooled / np.maximum(norms, 1e-12)).astype(np.float32))
+        return np.concatenate(embeddings)
+
+
+def load_embedder(backend: str = "torch", model_name: str = EMBEDDING_MODEL):
+    """Construct the named backend (one of EMBEDDING_BACKENDS)"""
+    if backend == "torch":
+        return TorchEmbedder(model_name)
+    if backend in ONNX_FILES:
+        return OnnxEmbedder(model_name, ONNX_FILES[backend])
+    raise ValueError(f"Unknown embedding backend: {backend} (expected one of {EMBEDDING_BACKENDS})")
@@ -0,0 +1,898 @@
+"""
+Storage backends for SemanticCache.
+
+A backend keeps (query, response, embedding) entries and answers three
+questions: which entries are nearest to some embeddings, which entry has the
+same normalized query text, and how to add or update entries. Both backends
+can bound themselves with a per-entry TTL and entry/byte limits enforced by
+an eviction policy:
+
+- "lru":  evict the entry accessed longest ago
+- "lfu":  evict the entry with the fewest hits (ties: least recently accessed)
+- "cost": GreedyDual-Size-Frequency; evict the lowest L + hits * cost / size,
+          where cost is how long the original LLM call took and L is the
+          priority of the last evicted entry (so idle entries age out)
+
+- RedisVectorStore: Redis Stack hashes searched with FT.SEARCH KNN (FLAT or HNSW)
+- EmbeddedVectorStore: in-process; an append-only memory-mapped float32 matrix
+  searched with NumPy dot products, plus an SQLite sidecar for the text
+
+Vectors can be kept at reduced precision to save memory: FLOAT16 in a Redis
+index, int8 (scaled per row) in the embedded store. Searches on those then
+over-fetch rerank_candidates neighbours and re-score them with exact cosine
+similarity between the full-precision query and a float32 copy of each
+candidate, so hit/miss decisions at the similarity threshold match float32
+storage. The embedded store reads that copy from its file; the Redis store
+keeps it in an unindexed hash field, so re-ranking there trades the hash-side
+saving for exact decisions (rerank_candidates=0 keeps only the FLOAT16 bytes).
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import redis
+from redis.client import NEVER_DECODE
+
+EMBEDDING_DIM = 384  # all-MiniLM-L6-v2
+
+EVICTION_POLICIES = ("lru", "lfu", "cost")
+
+VECTOR_TYPES = ("FLOAT32", "FLOAT16")  # RediSearch vector field TYPE
+EMBEDDED_PRECISIONS = ("float32", "int8")
+
+# Thresholded FLOAT16 range queries widen the radius by this much before re-ranking,
+# so an entry whose exact similarity clears the threshold is not cut off by rounding
+RERANK_RADIUS_MARGIN = 0.01
+
+# Unindexed hash field holding the float32 embedding that FLOAT16 entries are re-ranked on
+EXACT_EMBEDDING_FIELD = "embedding_f32"
+
+SCAN_CHUNK_ROWS = 16_384  # int8 rows widened to float32 at a time while scanning
+
+Entry = Tuple[str, str, np.ndarray, float]  # (query, response, embedding, LLM seconds)
+
+# Shared by the Redis scripts below; mirrors eviction_priority()
+PRIORITY_LUA = """
+local function priority(policy, hits, last_access, cost, size, floor)
+    if policy == 'lfu' then
+        return hits + last_access / 1e10
+    elseif policy == 'cost' then
+        return floor + (hits + 1) * cost / size
+    end
+    return last_access
+end
+"""
+
+# KEYS: entry hash, exact pointer, eviction zset, expiry zset, sizes hash, bytes counter, floor
+# ARGV: query, response, embedding, now, cost, size, ttl (0 = none), policy,
+#       float32 embedding for re-ranking ('' = none)
+STORE_ENTRY_SCRIPT = PRIORITY_LUA + """
+local old_size = redis.call('HGET', KEYS[5], KEYS[1])
+if old_size then
+    redis.call('DECRBY', KEYS[6], old_size)
+end
+redis.call('HSET', KEYS[1], 'query', ARGV[1], 'response', ARGV[2], 'embedding', ARGV[3],
+           'timestamp', math.floor(tonumber(ARGV[4])), 'cost', ARGV[5], 'size', ARGV[6], 'exact', KEYS[2])
+if ARGV[9] ~= '' then
+    redis.call('HSET', KEYS[1], '""" + EXACT_EMBEDDING_FIELD + """', ARGV[9])
+else
+    redis.call('HDEL', KEYS[1], '""" + EXACT_EMBEDDING_FIELD + """')
+end
+local hits = redis.call('HINCRBY', KEYS[1], 'hits', 0)
+redis.call('SET', KEYS[2], KEYS[1])
+local ttl = tonumber(ARGV[7])
+if ttl > 0 then
+    redis.call('EXPIRE', KEYS[1], ttl)
+    redis.call('EXPIRE', KEYS[2], ttl)
+    redis.call('ZADD', KEYS[4], tonumber(ARGV[4]) + ttl, KEYS[1])
+end
+local floor = tonumber(redis.call('GET', KEYS[7]) or '0')
+redis.call('ZADD', KEYS[3], priority(ARGV[8], hits, tonumber(ARGV[4]), tonumber(ARGV[5]), tonumber(ARGV[6]), floor), KEYS[1])
+redis.call('HSET', KEYS[5], KEYS[1], ARGV[6])
+redis.call('INCRBY', KEYS[6], ARGV[6])
+return KEYS[1]
+"""
+
+# KEYS: entry hash, eviction zset, floor   ARGV: now, policy
+RECORD_HIT_SCRIPT = PRIORITY_LUA + """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+local hits = redis.call('HINCRBY', KEYS[1], 'hits', 1)
+redis.call('HSET', KEYS[1], 'last_hit', ARGV[1])
+local fields = redis.call('HMGET', KEYS[1], 'cost', 'size')
+local floor = tonumber(redis.call('GET', KEYS[3]) or '0')
+redis.call('ZADD', KEYS[2], priority(ARGV[2], hits, tonumber(ARGV[1]), tonumber(fields[1]), tonumber(fields[2]), floor), KEYS[1])
+return hits
+"""
+
+# KEYS: eviction zset, expiry zset, sizes hash, bytes counter, floor
+# ARGV: now, max_entries (0 = unbounded), max_bytes (0 = unbounded)
+EVICT_SCRIPT = """
+local function drop(key)
+    local exact = redis.call('HGET', key, 'exact')
+    if exact and redis.call('GET', exact) == key then
+        redis.call('DEL', exact)
+    end
+    local size = redis.call('HGET', KEYS[3], key)
+    if size then
+        redis.call('DECRBY', KEYS[4], size)
+    end
+    redis.call('DEL', key)
+    redis.call('ZREM', KEYS[1], key)
+    redis.call('ZREM', KEYS[2], key)
+    redis.call('HDEL', KEYS[3], key)
+end
+for _, key in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])) do
+    drop(key)
+end
+local evicted = 0
+local max_entries, max_bytes = tonumber(ARGV[2]), tonumber(ARGV[3])
+while (max_entries > 0 and redis.call('ZCARD', KEYS[1]) > max_entries)
+        or (max_bytes > 0 and tonumber(redis.call('GET', KEYS[4]) or '0') > max_bytes) do
+    local victim = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    if #victim == 0 then
+        break
+    end
+    redis.call('SET', KEYS[5], victim[2])
+    drop(victim[1])
+    evicted = evicted + 1
+end
+return evicted
+"""
+
+
+def normalize_query(text: str) -> str:
+    """Fold case and collapse whitespace so trivially different repeats match exactly"""
+    return " ".join(text.casefold().split())
+
+
+def entry_size(query: str, response: str, vector_bytes: int = EMBEDDING_DIM * 4) -> int:
+    """Bytes an entry counts against max_bytes: text plus its stored vector"""
+    return len(query.encode()) + len(response.encode()) + vector_bytes
+
+
+def eviction_priority(policy: str, hits: int, last_access: float, cost: float, size: int,
+                      floor: float = 0.0) -> float:
+    """Lower priority is evicted first (see the module docstring for the policies)"""
+    if policy == "lfu":
+        return hits + last_access / 1e10
+    elif policy == "cost":
+        return floor + (hits + 1) * cost / size
+    return last_access
+
+
+def vector_field_args(index_type: str = "FLAT", dim: int = EMBEDDING_DIM, hnsw_m: int = 16,
+                      hnsw_ef_construction: int = 200, hnsw_ef_runtime: int = 10,
+                      vector_type: str = "FLOAT32") -> List:
+    """FT.CREATE arguments for a COSINE vector field of the given index and element type"""
+    if vector_type not in VECTOR_TYPES:
+        raise ValueError(f"Unknown vector type: {vector_type} (expected one of {VECTOR_TYPES})")
+    attributes = ["TYPE", vector_type, "DIM", str(dim), "DISTANCE_METRIC", "COSINE"]
+    if index_type == "HNSW":
+        # M: graph degree, EF_CONSTRUCTION: build-time beam width, EF_RUNTIME: query-time beam width
+        attributes += ["M", str(hnsw_m), "EF_CONSTRUCTION", str(hnsw_ef_construction),
+                       "EF_RUNTIME", str(hnsw_ef_runtime)]
+    elif index_type != "FLAT":
+        raise ValueError(f"Unknown vector index type: {index_type} (expected FLAT or HNSW)")
+    return [index_type, str(len(attributes))] + attributes
+
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-row int8 codes and scales, so that vectors ≈ codes * scales[:, None]"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1
+    return np.rint(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+def exact_similarities(query: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+    """Cosine similarity of one full-precision query to each row, computed in float32"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(query)
+    return (vectors @ np.asarray(query, dtype=np.float32)) / np.where(norms == 0, 1, norms)
+
+
+class VectorStore:
+    """
+    Interface every SemanticCache backend implements. Entries are dicts with
+    'key', 'query', 'response', 'similarity' (cosine, 1.0 = identical) and
+    'timestamp'. Searches are lean by default: they return only 'key' and
+    'similarity', and the caller fetch()es the payload of the one it uses.
+
+    ttl (seconds), max_entries and max_bytes bound the store; None means
+    unbounded. eviction_policy is one of EVICTION_POLICIES.
+    """
+    name = "base"
+
+    def __init__(self, ttl: Optional[int] = None, max_entries: Optional[int] = None,
+                 max_bytes: Optional[int] = None, eviction_policy: str = "lru"):
+        if eviction_policy not in EVICTION_POLICIES:
+            raise ValueError(f"Unknown eviction policy: {eviction_policy} (expected one of {EVICTION_POLICIES})")
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.eviction_policy = eviction_policy
+
+    def search(self, embeddings: Sequence[np.ndarray], top_k: int = 1, threshold: Optional[float] = None,
+               with_payload: bool = False) -> List[List[Dict]]:
+        """
+        Nearest cached entries for each embedding, best first. A backend may
+        leave out entries below threshold; with_payload also returns the text.
+        """
+        raise NotImplementedError
+
+    def fetch(self, keys: List) -> List[Optional[Dict]]:
+        """Full entries for keys found by search (None where one has since gone)"""
+        raise NotImplementedError
+
+    def lookup_exact(self, texts: List[str]) -> List[Optional[Dict]]:
+        """Entry whose normalized query equals each text, or None"""
+        raise NotImplementedError
+
+    def store(self, entries: List[Entry]) -> List:
+        """
+        Add entries and return their keys; an entry whose normalized query is
+        already cached updates it. Evicts as needed to stay within the limits.
+        """
+        raise NotImplementedError
+
+    def record_hits(self, keys: List):
+        """Count a cache hit on each key (repeats count again) and refresh its priority"""
+        raise NotImplementedError
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def clear(self) -> int:
+        """Remove every entry and return how many there were"""
+        raise NotImplementedError
+
+    def stats(self) -> Dict:
+        """Backend-specific figures for SemanticCache.get_cache_stats"""
+        return {}
+
+    def close(self):
+        pass
+
+
+class RedisVectorStore(VectorStore):
+    """
+    Entries are cache:{uuid} hashes indexed by RediSearch; exact:{sha256} keys
+    point from a normalized query to its hash. Eviction bookkeeping lives next
+    to the index: {index_name}:evict (priority zset), :expiry (zset of expiry
+    times), :sizes (hash) and :bytes (total), all kept in step by Lua scripts.
+    """
+    name = "redis"
+
+    def __init__(self, redis_host="localhost", redis_port=6380, index_name="semantic_idx",
+                 index_type="FLAT", hnsw_m=16, hnsw_ef_construction=200, hnsw_ef_runtime=10,
+                 use_vector_range=False, key_prefix="cache:", exact_prefix="exact:",
+                 vector_type="FLOAT32", rerank_candidates=10, **limits):
+        """
+        use_vector_range=True turns thresholded searches into VECTOR_RANGE
+        queries (only entries within 1 - threshold cosine distance) instead
+        of a plain KNN. key_prefix/exact_prefix keep a second cache (e.g. a
+        benchmark) on the same Redis apart from the default one.
+
+        vector_type="FLOAT16" halves the embedding bytes in both the hash and
+        the index. Its searches fetch the rerank_candidates nearest entries
+        and re-score them exactly against a float32 copy of each entry's
+        embedding, stored in the unindexed EXACT_EMBEDDING_FIELD and returned
+        by the search itself. rerank_candidates=0 stores no copy and keeps
+        the index's FLOAT16 similarities.
+        """
+        super().__init__(**limits)
+        if vector_type not in VECTOR_TYPES:
+            raise ValueError(f"Unknown vector type: {vector_type} (expected one of {VECTOR_TYPES})")
+        self.redis_client = redis.Redis(host=redis_host, port=redis_port, decode_responses=True)
+        self.index_name = index_name
+        self.index_type = index_type
+        self.hnsw_m = hnsw_m
+        self.hnsw_ef_construction = hnsw_ef_construction
+        self.hnsw_ef_runtime = hnsw_ef_runtime
+        self.use_vector_range = use_vector_range
+        self.vector_type = vector_type
+        self._vector_dtype = np.float16 if vector_type == "FLOAT16" else np.float32
+        # FLOAT32 distances are already exact, so only reduced precision is re-ranked
+        self.rerank_candidates = rerank_candidates if vector_type != "FLOAT32" else 0
+        self.key_prefix = key_prefix
+        self.exact_prefix = exact_prefix
+        self._bookkeeping_keys = [f"{index_name}:{name}" for name in ("evict", "expiry", "sizes", "bytes", "floor")]
+
+        # Test connections
+        try:
+            self.redis_client.ping()
+            print("✓ Connected to Redis successfully")
+        except redis.ConnectionError:
+            print("✗ Failed to connect to Redis!")
+            raise
+
+        self._store_entry = self.redis_client.register_script(STORE_ENTRY_SCRIPT)
+        self._record_hit = self.redis_client.register_script(RECORD_HIT_SCRIPT)
+        self._evict = self.redis_client.register_script(EVICT_SCRIPT)
+        self._setup_vector_index()
+
+    def _setup_vector_index(self):
+        """Create Redis vector index for semantic search"""
+        try:
+            # Try to create the index (will fail if it already exists)
+            self.redis_client.execute_command(
+                "FT.CREATE", self.index_name, "ON", "HASH",
+                "PREFIX", "1", self.key_prefix,
+                "SCHEMA",
+                "embedding", "VECTOR", *vector_field_args(self.index_type, EMBEDDING_DIM, self.hnsw_m,
+                                                          self.hnsw_ef_construction, self.hnsw_ef_runtime,
+                                                          self.vector_type),
+                "query", "TEXT",
+                "response", "TEXT",
+                "timestamp", "NUMERIC"
+            )
+            print(f"✓ Created new {self.index_type} {self.vector_type} vector index")
+        except redis.ResponseError as e:
+            if "Index already exists" in str(e):
+                print("✓ Vector index already exists")
+            else:
+                print(f"✗ Error creating index: {e}")
+                raise
+
+    def _vector_to_bytes(self, vector: np.ndarray) -> bytes:
+        """Convert numpy vector to bytes of the index's vector type for Redis storage"""
+        return np.asarray(vector).astype(self._vector_dtype).tobytes()
+
+    def _bytes_to_vector(self, vector_bytes: bytes) -> np.ndarray:
+        """Convert bytes back to numpy vector"""
+        return np.frombuffer(vector_bytes, dtype=self._vector_dtype)
+
+    def _exact_key(self, text: str) -> str:
+        """Redis key pointing from a normalized query to its cache entry"""
+        return f"{self.exact_prefix}{hashlib.sha256(normalize_query(text).encode()).hexdigest()}"
+
+    def _knn_command(self, query_embedding: np.ndarray, top_k: int, threshold: Optional[float] = None,
+                     with_payload: bool = False) -> List:
+        """
+        FT.SEARCH arguments for the top_k nearest cached queries (keys and
+        distances unless with_payload, plus the float32 copies to re-rank)
+        """
+        fields = ["similarity", "query", "response", "timestamp"] if with_payload else ["similarity"]
+        if self.rerank_candidates:
+            fields.append(EXACT_EMBEDDING_FIELD)
+        vector = self._vector_to_bytes(query_embedding)
+        if threshold is not None and self.use_vector_range:
+            radius = 1 - threshold + (RERANK_RADIUS_MARGIN if self.rerank_candidates else 0)
+            return [
+                "FT.SEARCH", self.index_name,
+                "@embedding:[VECTOR_RANGE $radius $vec]=>{$YIELD_DISTANCE_AS: similarity}",
+                "PARAMS", "4", "radius", f"{radius:.6f}", "vec", vector,
+                "SORTBY", "similarity", "LIMIT", "0", str(top_k),
+                "RETURN", str(len(fields)), *fields,
+                "DIALECT", "2"
+            ]
+        return [
+            "FT.SEARCH", self.index_name,
+            f"*=>[KNN {top_k} @embedding $vec AS similarity]",
+            "PARAMS", "2", "vec", vector,
+            "RETURN", str(len(fields)), *fields,
+            "DIALECT", "2"
+        ]
+
+    @staticmethod
+    def _parse_search_result(result) -> List[Dict]:
+        """
+        Turn a raw FT.SEARCH reply into match dicts with similarity = 1 - distance.
+        A reply read without decoding (to carry EXACT_EMBEDDING_FIELD bytes) has
+        its text decoded here; the float32 copy is kept as bytes.
+        """
+        def text(value):
+            return value.decode() if isinstance(value, bytes) else value
+
+        # Parse results
+        if len(result) <= 1:  # Only count, no results
+            return []
+
+        matches = []
+        # Results format: [count, key1, [field1, value1, field2, value2], key2, [...]]
+        for i in range(1, len(result), 2):
+            key = text(result[i])
+            fields = result[i + 1]
+
+            # Parse fields into dict
+            field_dict = {}
+            for j in range(0, len(fields), 2):
+                field_dict[text(fields[j])] = fields[j + 1]
+
+            if 'similarity' in field_dict:
+                # Convert similarity distance to similarity score (1 - distance)
+                similarity_score = 1 - float(text(field_dict['similarity']))
+
+                match = {'key': key, 'similarity': similarity_score}
+                for field in ('query', 'response', 'timestamp'):
+                    if field in field_dict:
+                        match[field] = text(field_dict[field])
+                if EXACT_EMBEDDING_FIELD in field_dict:
+                    match[EXACT_EMBEDDING_FIELD] = field_dict[EXACT_EMBEDDING_FIELD]
+                matches.append(match)
+
+        return matches
+
+    def search(self, embeddings: Sequence[np.ndarray], top_k: int = 1, threshold: Optional[float] = None,
+               with_payload: bool = False) -> List[List[Dict]]:
+        """One KNN search per embedding, all in a single pipeline round trip"""
+        candidates = max(top_k, self.rerank_candidates)
+        # The float32 copies come back as raw bytes, so re-ranking searches skip decoding
+        options = {NEVER_DECODE: []} if self.rerank_candidates else {}
+        pipe = self.redis_client.pipeline(transaction=False)
+        for query_embedding in embeddings:
+            pipe.execute_command(*self._knn_command(query_embedding, candidates, threshold, with_payload), **options)
+        results = [self._parse_search_result(result) for result in pipe.execute()]
+        if self.rerank_candidates:
+            results = [self._rerank(query_embedding, matches, top_k)
+                       for query_embedding, matches in zip(embeddings, results)]
+        return results
+
+    @staticmethod
+    def _rerank(query_embedding: np.ndarray, matches: List[Dict], top_k: int) -> List[Dict]:
+        """
+        Re-score candidates with exact cosine similarity between the query and
+        their float32 copies, and keep the top_k. Entries stored without a copy
+        (while re-ranking was off) keep their FLOAT16 similarity.
+        """
+        exact = [match for match in matches if match.get(EXACT_EMBEDDING_FIELD) is not None]
+        if exact:
+            vectors = [np.frombuffer(match[EXACT_EMBEDDING_FIELD], dtype=np.float32) for match in exact]
+            for match, similarity in zip(exact, exact_similarities(query_embedding, vectors)):
+                match['similarity'] = float(similarity)
+        for match in matches:
+            match.pop(EXACT_EMBEDDING_FIELD, None)
+        matches.sort(key=lambda match: -match['similarity'])
+        return matches[:top_k]
+
+    def fetch(self, keys: List[str]) -> List[Optional[Dict]]:
+        pipe = self.redis_client.pipeline(transaction=False)
+        for key in keys:
+            pipe.hmget(key, "query", "response", "timestamp")
+        return [
+            {'key': key, 'query': query, 'response': response, 'timestamp': timestamp}
+            if response is not None else None
+            for key, (query, response, timestamp) in zip(keys, pipe.execute())
+        ]
+
+    def lookup_exact(self, texts: List[str]) -> List[Optional[Dict]]:
+        cache_keys = self.redis_client.mget([self._exact_key(text) for text in texts])
+        pipe = self.redis_client.pipeline(transaction=False)
+        for cache_key in cache_keys:
+            if cache_key is not None:
+                pipe.hmget(cache_key, "query", "response", "timestamp")
+        entries = iter(pipe.execute())
+
+        matches = []
+        for cache_key in cache_keys:
+            entry = next(entries) if cache_key is not None else None
+            if entry is None or entry[1] is None:  # no pointer, or the entry behind it is gone
+                matches.append(None)
+            else:
+                matches.append({'key': cache_key, 'query': entry[0], 'response': entry[1],
+                                'similarity': 1.0, 'timestamp': entry[2]})
+        return matches
+
+    def store(self, entries: List[Entry]) -> List[str]:
+        if not entries:
+            return []
+        # Repeats within the batch are stored once (the last answer wins), and a
+        # repeat of an already cached query updates that entry instead of adding another
+        latest = list({normalize_query(entry[0]): entry for entry in entries}.values())
+        existing = [match['key'] if match else None for match in self.lookup_exact([e[0] for e in latest])]
+        now = time.time()
+
+        pipe = self.redis_client.pipeline(transaction=False)
+        key_of = {}
+        # FLOAT16 entries carry a float32 copy to re-rank on; it counts towards their size
+        vector_bytes = EMBEDDING_DIM * np.dtype(self._vector_dtype).itemsize
+        if self.rerank_candidates:
+            vector_bytes += EMBEDDING_DIM * np.dtype(np.float32).itemsize
+        for (query, response, query_embedding, cost), cache_key in zip(latest, existing):
+            cache_key = cache_key or f"{self.key_prefix}{uuid.uuid4().hex}"
+            key_of[normalize_query(query)] = cache_key
+            exact_copy = np.asarray(query_embedding, dtype=np.float32).tobytes() if self.rerank_candidates else ""
+            self._store_entry(
+                keys=[cache_key, self._exact_key(query), *self._bookkeeping_keys],
+                args=[query, response, self._vector_to_bytes(query_embedding), now, cost,
+                      entry_size(query, response, vector_bytes), self.ttl or 0, self.eviction_policy, exact_copy],
+                client=pipe
+            )
+        # Reaps expired entries before counting, so they never push live ones out
+        self._evict(keys=self._bookkeeping_keys, args=[now, self.max_entries or 0, self.max_bytes or 0], client=pipe)
+        pipe.execute()
+        return [key_of[normalize_query(entry[0])] for entry in entries]
+
+    def record_hits(self, keys: List[str]):
+        if not keys:
+            return
+        evict_key, floor_key = self._bookkeeping_keys[0], self._bookkeeping_keys[4]
+        now = time.time()
+        pipe = self.redis_client.pipeline(transaction=False)
+        for key in keys:
+            self._record_hit(keys=[key, evict_key, floor_key], args=[now, self.eviction_policy], client=pipe)
+        pipe.execute()
+
+    def count(self) -> int:
+        """Tracked entries, less those past their expiry that the next store() will reap"""
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.zcard(self._bookkeeping_keys[0])
+        pipe.zcount(self._bookkeeping_keys[1], "-inf", time.time())
+        tracked, expired = pipe.execute()
+        return tracked - expired
+
+    def clear(self) -> int:
+        # SCAN instead of KEYS, so a large cache does not block Redis
+        count = 0
+        for prefix in (self.key_prefix, self.exact_prefix):
+            keys = [key for key in self.redis_client.scan_iter(match=f"{prefix}*", count=1_000)
+                    if key not in self._bookkeeping_keys]
+            if prefix == self.key_prefix:
+                count = len(keys)
+            for start in range(0, len(keys), 1_000):
+                self.redis_client.delete(*keys[start:start + 1_000])
+        self.redis_client.delete(*self._bookkeeping_keys)
+        return count
+
+    def stats(self) -> Dict:
+        info = self.redis_client.info()
+        return {
+            "cached_bytes": int(self.redis_client.get(self._bookkeeping_keys[3]) or 0),
+            "eviction_policy": self.eviction_policy,
+            "vector_type": self.vector_type,
+            "redis_memory": info.get("used_memory_human", "N/A"),
+            "total_connections": info.get("total_connections_received", "N/A")
+        }
+
+    def close(self):
+        self.redis_client.close()
+
+
+class EmbeddedVectorStore(VectorStore):
+    """
+    Redis-free backend for single-process tools and tests. Normalized float32
+    embeddings are appended to <path>/embeddings.f32 and read back through a
+    memory map, so a restart only maps the file instead of re-embedding. Row
+    i of the matrix belongs to the SQLite row with vector_row = i; rows of
+    evicted or expired entries are masked out of searches until compact()
+    rewrites the file.
+
+    precision="int8" scans an in-memory int8 copy of the matrix (a quarter
+    of the bytes, plus one float32 scale per row) and re-ranks the
+    rerank_candidates best rows with their float32 vectors from the file.
+    The file itself stays float32, so a store can be reopened at either
+    precision.
+    """
+    name = "embedded"
+
+    def __init__(self, path: str = "semantic_cache", dim: int = EMBEDDING_DIM, precision: str = "float32",
+                 rerank_candidates: int = 10, **limits):
+        super().__init__(**limits)
+        if precision not in EMBEDDED_PRECISIONS:
+            raise ValueError(f"Unknown precision: {precision} (expected one of {EMBEDDED_PRECISIONS})")
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.dim = dim
+        self.precision = precision
+        self.rerank_candidates = rerank_candidates if precision != "float32" else 0
+        self._row_bytes = dim * np.dtype(np.float32).itemsize
+        # Bytes per entry held in memory for scanning (and counted against max_bytes)
+        self._vector_bytes = dim + 4 if precision == "int8" else self._row_bytes
+        self._vectors_path = os.path.join(path, "embeddings.f32")
+        self._lock = threading.RLock()
+
+        self.conn = sqlite3.connect(os.path.join(path, "entries.db"), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                vector_row INTEGER PRIMARY KEY,
+                query TEXT NOT NULL,
+                normalized TEXT NOT NULL UNIQUE,
+                response TEXT NOT NULL,
+                timestamp INTEGER NOT NULL,
+                cost REAL NOT NULL DEFAULT 0,
+                size INTEGER NOT NULL DEFAULT 0,
+                hits INTEGER NOT NULL DEFAULT 0,
+                last_hit REAL,
+                expires_at REAL,
+                priority REAL NOT NULL DEFAULT 0
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_priority ON entries(priority)")
+        self.conn.commit()
+
+        # Drop a partially written trailing row left by a crash mid-append
+        with open(self._vectors_path, "ab") as f:
+            size = f.tell()
+            f.truncate(size - size % self._row_bytes)
+        self._rows = size // self._row_bytes
+        self._matrix = None
+        self._mapped_rows = -1
+        self._load_row_state()
+        self._load_codes()
+        print(f"✓ Opened embedded vector store at {path} ({self._rows:,} {precision} vectors)")
+
+    def _load_row_state(self):
+        """Rebuild the per-row live mask and expiry times, byte total and eviction floor from SQLite"""
+        self._live = np.zeros(self._rows, dtype=bool)
+        self._expires = np.full(self._rows, np.inf)
+        for row, expires_at in self.conn.execute("SELECT vector_row, expires_at FROM entries"):
+            if row < self._rows:
+                self._live[row] = True
+                self._expires[row] = np.inf if expires_at is None else expires_at
+        total, floor = self.conn.execute("SELECT COALESCE(SUM(size), 0), COALESCE(MIN(priority), 0) FROM entries").fetchone()
+        self._bytes = total
+        self._floor = floor if self.eviction_policy == "cost" else 0.0
+
+    def _load_codes(self):
+        """Quantize the vector file into the in-memory int8 codes (int8 precision only)"""
+        if self.precision != "int8":
+            return
+        self._codes = np.empty((max(self._rows, 1024), self.dim), dtype=np.int8)
+        self._scales = np.empty(len(self._codes), dtype=np.float32)
+        matrix = self._vectors()
+        for start in range(0, self._rows, SCAN_CHUNK_ROWS):
+            stop = min(start + SCAN_CHUNK_ROWS, self._rows)
+            self._codes[start:stop], self._scales[start:stop] = quantize_int8(matrix[start:stop])
+
+    def _append_codes(self, vectors: np.ndarray):
+        """Quantize rows about to be appended, doubling the code buffers when full"""
+        if self.precision != "int8":
+            return
+        needed = self._rows + len(vectors)
+        if needed > len(self._codes):
+            capacity = max(needed, 2 * len(self._codes))
+            codes = np.empty((capacity, self.dim), dtype=np.int8)
+            scales = np.empty(capacity, dtype=np.float32)
+            codes[:self._rows], scales[:self._rows] = self._codes[:self._rows], self._scales[:self._rows]
+            self._codes, self._scales = codes, scales
+        self._codes[self._rows:needed], self._scales[self._rows:needed] = quantize_int8(vectors)
+
+    def _scores(self, queries: np.ndarray) -> np.ndarray:
+        """Similarity of each query to every row: exact for float32, approximate for int8"""
+        if self.precision == "float32":
+            return queries @ self._vectors().T  # cosine similarity, both sides are unit length
+        scores = np.empty((len(queries), self._rows), dtype=np.float32)
+        for start in range(0, self._rows, SCAN_CHUNK_ROWS):
+            stop = min(start + SCAN_CHUNK_ROWS, self._rows)
+            scores[:, start:stop] = (queries @ self._codes[start:stop].astype(np.float32).T) * self._scales[start:stop]
+        return scores
+
+    def _vectors(self) -> np.ndarray:
+        """Memory-mapped (rows, dim) matrix, remapped after appends"""
+        if self._mapped_rows != self._rows:
+            self._matrix = (np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(self._rows, self.dim))
+                            if self._rows else np.empty((0, self.dim), dtype=np.float32))
+            self._mapped_rows = self._rows
+        return self._matrix
+
+    def _normalize(self, embeddings: Sequence[np.ndarray]) -> np.ndarray:
+        vectors = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def _fetch_rows(self, rows: List[int]) -> Dict[int, tuple]:
+        placeholders = ",".join("?" * len(rows))
+        cursor = self.conn.execute(
+            f"SELECT vector_row, query, response, timestamp FROM entries WHERE vector_row IN ({placeholders})", rows
+        )
+        return {row[0]: row[1:] for row in cursor}
+
+    def search(self, embeddings: Sequence[np.ndarray], top_k: int = 1, threshold: Optional[float] = None,
+               with_payload: bool = False) -> List[List[Dict]]:
+        queries = self._normalize(embeddings)
+        with self._lock:
+            matrix = self._vectors()
+            if not len(matrix):
+                return [[] for _ in queries]
+
+            scores = self._scores(queries)
+            scores[:, ~(self._live & (self._expires > time.time()))] = -np.inf
+            k = min(max(top_k, self.rerank_candidates), scores.shape[1])
+            candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+
+            results = []
+            for query, query_scores, rows in zip(queries, scores, candidates):
+                rows = sorted(int(row) for row in rows if np.isfinite(query_scores[row]))
+                if self.rerank_candidates and rows:
+                    # Exact cosine from the float32 rows; only these pages of the file are touched
+                    similarities = dict(zip(rows, (matrix[rows] @ query).tolist()))
+                else:
+                    similarities = {row: float(query_scores[row]) for row in rows}
+                rows = sorted(rows, key=lambda row: -similarities[row])[:top_k]
+                results.append([{'key': row, 'similarity': similarities[row]} for row in rows])
+
+            if with_payload:
+                entries = self._fetch_rows(sorted({match['key'] for matches in results for match in matches}))
+                for matches in results:
+                    for match in matches:
+                        match['query'], match['response'], match['timestamp'] = entries[match['key']]
+        return results
+
+    def fetch(self, keys: List[int]) -> List[Optional[Dict]]:
+        with self._lock:
+            entries = self._fetch_rows(list(set(keys))) if keys else {}
+        return [
+            {'key': key, 'query': entries[key][0], 'response': entries[key][1], 'timestamp': entries[key][2]}
+            if key in entries else None
+            for key in keys
+        ]
+
+    def lookup_exact(self, texts: List[str]) -> List[Optional[Dict]]:
+        normalized = [normalize_query(text) for text in texts]
+        placeholders = ",".join("?" * len(normalized))
+        with self._lock:
+            cursor = self.conn.execute(
+                f"SELECT normalized, vector_row, query, response, timestamp, hits FROM entries "
+                f"WHERE normalized IN ({placeholders}) AND (expires_at IS NULL OR expires_at > ?)",
+                normalized + [time.time()]
+            )
+            found = {row[0]: row[1:] for row in cursor}
+        return [
+            {'key': found[n][0], 'query': found[n][1], 'response': found[n][2],
+             'similarity': 1.0, 'timestamp': found[n][3], 'hits': found[n][4]} if n in found else None
+            for n in normalized
+        ]
+
+    def store(self, entries: List[Entry]) -> List[int]:
+        if not entries:
+            return []
+        with self._lock:
+            # Entries that were evicted or expired are gone from SQLite, so a repeat becomes a new row
+            self._evict()
+            existing = self.lookup_exact([entry[0] for entry in entries])
+            now = time.time()
+            expires_at = now + self.ttl if self.ttl else None
+            updates, new_by_text = [], {}
+            for (query, response, embedding, cost), match in zip(entries, existing):
+                size = entry_size(query, response, self._vector_bytes)
+                if match is not None:
+                    # Same normalized text embeds to the same vector; only the answer changes
+                    priority = eviction_priority(self.eviction_policy, match['hits'], now, cost, size, self._floor)
+                    updates.append((query, response, int(now), cost, size, expires_at, priority, match['key']))
+                else:
+                    new_by_text[normalize_query(query)] = (query, response, embedding, cost, size)
+            new_entries = list(new_by_text.values())
+
+            # Append vectors before committing their rows, so a committed row always has its vector
+            if new_entries:
+                vectors = self._normalize([entry[2] for entry in new_entries])
+                with open(self._vectors_path, "ab") as f:
+                    f.write(vectors.tobytes())
+                self._append_codes(vectors)
+            first_row = self._rows
+            for _, _, _, _, size, _, _, row in updates:
+                self._bytes += size - self.conn.execute(
+                    "SELECT size FROM entries WHERE vector_row = ?", (row,)).fetchone()[0]
+                self._expires[row] = np.inf if expires_at is None else expires_at
+            self.conn.executemany(
+                "UPDATE entries SET query = ?, response = ?, timestamp = ?, cost = ?, size = ?, "
+                "expires_at = ?, priority = ? WHERE vector_row = ?", updates
+            )
+            self.conn.executemany(
+                "INSERT INTO entries (vector_row, query, normalized, response, timestamp, cost, size, expires_at, priority) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(first_row + i, query, normalize_query(query), response, int(now), cost, size, expires_at,
+                  eviction_priority(self.eviction_policy, 0, now, cost, size, self._floor))
+                 for i, (query, response, _, cost, size) in enumerate(new_entries)]
+            )
+            self._rows += len(new_entries)
+            self._live = np.concatenate([self._live, np.ones(len(new_entries), dtype=bool)])
+            self._expires = np.concatenate([self._expires, np.full(len(new_entries), np.inf if expires_at is None
+                                                                   else expires_at)])
+            self._bytes += sum(entry[4] for entry in new_entries)
+            self._evict()
+            self.conn.commit()
+
+            # Look the keys up again: eviction may have dropped entries or compacted the rows
+            return [match['key'] if match else None for match in self.lookup_exact([entry[0] for entry in entries])]
+
+    def _evict(self):
+        """Drop expired entries, then the lowest-priority ones until within max_entries and max_bytes"""
+        victims = [row for row, in self.conn.execute(
+            "SELECT vector_row FROM entries WHERE expires_at <= ?", (time.time(),))]
+        self._drop(victims)
+
+        over_entries = int(self._live.sum()) - self.max_entries if self.max_entries else 0
+        over_bytes = self._bytes - self.max_bytes if self.max_bytes else 0
+        if over_entries <= 0 and over_bytes <= 0:
+            return
+        victims, freed = [], 0
+        for row, size, priority in self.conn.execute("SELECT vector_row, size, priority FROM entries ORDER BY priority"):
+            if len(victims) >= over_entries and freed >= over_bytes:
+                break
+            victims.append(row)
+            freed += size
+            if self.eviction_policy == "cost":
+                self._floor = priority
+        self._drop(victims)
+
+    def _drop(self, rows: List[int]):
+        if not rows:
+            return
+        for start in range(0, len(rows), 500):
+            chunk = rows[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            self._bytes -= self.conn.execute(
+                f"SELECT COALESCE(SUM(size), 0) FROM entries WHERE vector_row IN ({placeholders})", chunk).fetchone()[0]
+            self.conn.execute(f"DELETE FROM entries WHERE vector_row IN ({placeholders})", chunk)
+        self._live[rows] = False
+        # Reclaim the file once most of it is dead rows
+        if self._rows > 1024 and self._live.sum() < self._rows // 2:
+            self.compact()
+
+    def compact(self):
+        """Rewrite the vector file with only live rows and renumber their SQLite rows to match"""
+        with self._lock:
+            live_rows = np.flatnonzero(self._live)
+            vectors = np.array(self._vectors()[live_rows])
+            # Rows only move down, so renumbering in ascending order never collides on the primary key
+            self.conn.executemany("UPDATE entries SET vector_row = ? WHERE vector_row = ?",
+                                  [(new, int(old)) for new, old in enumerate(live_rows) if new != old])
+            self.conn.commit()
+
+            self._matrix = None  # release the map before replacing the file
+            self._mapped_rows = -1
+            tmp_path = self._vectors_path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(vectors.tobytes())
+            os.replace(tmp_path, self._vectors_path)
+            self._rows = len(live_rows)
+            self._load_row_state()
+            self._load_codes()
+
+    def record_hits(self, keys: List[int]):
+        if not keys:
+            return
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                row = self.conn.execute("SELECT hits, cost, size FROM entries WHERE vector_row = ?", (key,)).fetchone()
+                if row is None:
+                    continue
+                hits = row[0] + 1
+                self.conn.execute(
+                    "UPDATE entries SET hits = ?, last_hit = ?, priority = ? WHERE vector_row = ?",
+                    (hits, now, eviction_priority(self.eviction_policy, hits, now, row[1], row[2], self._floor), key)
+                )
+            self.conn.commit()
+
+    def count(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def clear(self) -> int:
+        with self._lock:
+            count = self.count()
+            self.conn.execute("DELETE FROM entries")
+            self.conn.commit()
+            self._matrix = None  # release the map before truncating the file
+            self._mapped_rows = -1
+            open(self._vectors_path, "wb").close()
+            self._rows = 0
+            self._load_row_state()
+            self._load_codes()
+        return count
+
+    def stats(self) -> Dict:
+        return {
+            "cached_bytes": self._bytes,
+            "eviction_policy": self.eviction_policy,
+            "precision": self.precision,
+            "vector_bytes_per_entry": self._vector_bytes,
+            "vector_file_bytes": self._rows * self._row_bytes,
+            "vectors": self._rows,
+        }
+
+    def close(self):
+        with self._lock:
+            self._matrix = None
+            self.conn.close()
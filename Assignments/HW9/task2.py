@@ -1,163 +1,428 @@
 import redis
 import requests
 import numpy as np
+import io
 import json
+import os
+import queue
+import subprocess
+import sys
+import tempfile
+import threading
 import time
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
-from typing import Dict, List, Tuple, Optional
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import redirect_stdout
+from typing import Dict, Iterator, List, Tuple, Optional
+from requests.adapters import HTTPAdapter
+
+from embedders import EMBEDDING_BACKENDS, load_embedder
+from semantic_store import (
+    EMBEDDED_PRECISIONS,
+    EMBEDDING_DIM,
+    EVICTION_POLICIES,
+    VECTOR_TYPES,
+    EmbeddedVectorStore,
+    RedisVectorStore,
+    VectorStore,
+    normalize_query,
+    vector_field_args,
+)
+
+
+class EmbeddingBatcher:
+    """
+    Coalesce embedding requests from many threads into batched encode calls
+
+    Callers submit() a text and get a Future. A background thread collects
+    requests until max_batch_size items are queued or the oldest has waited
+    max_wait_ms, runs one encode over the batch and resolves the futures.
+    Requests submitted before stop() are still answered; submit() after it
+    raises RuntimeError.
+    """
+
+    def __init__(self, encode, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._queue_waits = deque(maxlen=10_000)
+        # Orders submits against stop, so nothing is queued behind the stop sentinel
+        self._submit_lock = threading.Lock()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        future = Future()
+        with self._submit_lock:
+            if self._stopped:
+                raise RuntimeError("EmbeddingBatcher is stopped")
+            self._queue.put((text, future, time.perf_counter()))
+        return future
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = item[2] + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._process(batch)
+
+    def _process(self, batch: List[tuple]):
+        started = time.perf_counter()
+        with self._stats_lock:
+            self._batch_sizes[len(batch)] += 1
+            self._queue_waits.extend(started - enqueued for _, _, enqueued in batch)
+
+        live = [(text, future) for text, future, _ in batch if future.set_running_or_notify_cancel()]
+        if not live:
+            return
+        try:
+            vectors = self.encode([text for text, _ in live])
+        except Exception as e:
+            for _, future in live:
+                future.set_exception(e)
+            return
+        for (_, future), vector in zip(live, vectors):
+            future.set_result(vector)
+
+    def stats(self) -> Dict:
+        """Batch-size histogram and queue wait times (ms) of recent requests"""
+        with self._stats_lock:
+            histogram = dict(sorted(self._batch_sizes.items()))
+            waits = sorted(self._queue_waits)
+        batches = sum(histogram.values())
+        items = sum(size * count for size, count in histogram.items())
+        return {
+            "batches": batches,
+            "items": items,
+            "avg_batch_size": items / batches if batches else 0.0,
+            "batch_size_histogram": histogram,
+            "avg_queue_wait_ms": float(np.mean(waits)) * 1000 if waits else 0.0,
+            "p95_queue_wait_ms": waits[int(0.95 * (len(waits) - 1))] * 1000 if waits else 0.0,
+            "max_queue_wait_ms": waits[-1] * 1000 if waits else 0.0,
+        }
+
+    def stop(self):
+        """Answer the requests already queued, then stop the thread (idempotent)"""
+        with self._submit_lock:
+            if not self._stopped:
+                self._stopped = True
+                self._queue.put(None)
+        self._thread.join()
+
+
+class OllamaError(Exception):
+    """Ollama could not produce a response; the message is what callers show the user"""
+
+
+class CircuitBreaker:
+    """
+    Stop calling a failing service for a while instead of waiting on it
+
+    closed: calls go through. After failure_threshold consecutive failures the
+    breaker opens and calls fail fast. Once reset_timeout has passed it lets
+    a single trial call through (half-open): success closes it, failure opens
+    it again for another reset_timeout.
+    """
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half-open" if time.time() - self._opened_at >= self.reset_timeout else "open"
+
+    def allow(self) -> bool:
+        """Whether a call may go out now (claims the single trial slot when half-open)"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.time() - self._opened_at < self.reset_timeout or self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                self._opened_at = time.time()
+            self._trial_in_flight = False
+
+    def record_abandoned(self):
+        """The caller gave up before the outcome was known: count nothing, free the trial slot"""
+        with self._lock:
+            self._trial_in_flight = False
+
 
 class SemanticCache:
-    def __init__(self, redis_host="localhost", redis_port=6380, similarity_threshold=0.85):
-        """Initialize semantic cache with Redis and embedding model"""
-        self.redis_client = redis.Redis(host=redis_host, port=redis_port, decode_responses=True)
+    def __init__(self, redis_host="localhost", redis_port=6380, similarity_threshold=0.85,
+                 index_name="semantic_idx", index_type="FLAT", hnsw_m=16,
+                 hnsw_ef_construction=200, hnsw_ef_runtime=10, multithreaded=False,
+                 batch_max_size=32, batch_max_wait_ms=5.0, store: Optional[VectorStore] = None,
+                 ttl=None, max_entries=None, max_bytes=None, eviction_policy="lru",
+                 ollama_pool_size=8, breaker_failures=3, breaker_reset=30.0, vector_type="FLOAT32",
+                 embedding_backend="torch", warm_up=False):
+        """
+        Initialize semantic cache with a storage backend and embedding model
+
+        store defaults to a RedisVectorStore built from the Redis and index
+        arguments below; pass an EmbeddedVectorStore to run without Redis.
+        ttl (seconds), max_entries, max_bytes and eviction_policy ("lru",
+        "lfu" or "cost") bound that default store; a store passed in is
+        configured with its own limits.
+
+        Ollama is called over one pooled HTTP session (up to ollama_pool_size
+        connections). After breaker_failures failed calls in a row, calls fail
+        fast for breaker_reset seconds before a health probe is retried.
+
+        index_type selects brute-force FLAT search (exact, cost grows linearly
+        with entries) or an approximate HNSW graph tuned by hnsw_m,
+        hnsw_ef_construction and hnsw_ef_runtime. An existing index keeps the
+        type it was created with, so use a new index_name when switching.
+        The same holds for vector_type: "FLOAT16" indexes half-size embeddings
+        and re-ranks the nearest candidates with exact cosine similarity
+        against a float32 copy kept in each entry's hash.
+
+        The embedding model loads on the first lookup that needs it (exact
+        hits never do). embedding_backend picks "torch", "onnx" or
+        "onnx-int8" (see embedders.py); warm_up=True loads it and runs one
+        encode on a background thread, so construction still returns at once.
+
+        multithreaded=True routes single-query embeddings through an
+        EmbeddingBatcher, so threads sharing this instance are encoded
+        together in batches of up to batch_max_size, waiting at most
+        batch_max_wait_ms.
+        """
+        self.store = store or RedisVectorStore(redis_host, redis_port, index_name, index_type, hnsw_m,
+                                               hnsw_ef_construction, hnsw_ef_runtime, ttl=ttl,
+                                               max_entries=max_entries, max_bytes=max_bytes,
+                                               eviction_policy=eviction_policy, vector_type=vector_type)
         self.similarity_threshold = similarity_threshold
         self.ollama_url = "http://localhost:11434"
+        self.http = requests.Session()
+        self.http.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=ollama_pool_size))
+        self.ollama_breaker = CircuitBreaker(breaker_failures, breaker_reset)
         
-        # Initialize sentence transformer for embeddings
-        print("Loading embedding model...")
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')  # 384 dimensions
-        print("✓ Embedding model loaded")
-        
-        # Test connections
-        try:
-            self.redis_client.ping()
-            print("✓ Connected to Redis successfully")
-        except redis.ConnectionError:
-            print("✗ Failed to connect to Redis!")
-            raise
-            
-        self._setup_vector_index()
+        # The embedding model is loaded on first use, so exact-match hits never pay for it
+        if embedding_backend not in EMBEDDING_BACKENDS:
+            raise ValueError(f"Unknown embedding backend: {embedding_backend} (expected one of {EMBEDDING_BACKENDS})")
+        self.embedding_backend = embedding_backend
+        self._embedding_model = None
+        self._model_lock = threading.Lock()
+        self.embedding_batcher = None
+        if multithreaded:
+            self.embedding_batcher = EmbeddingBatcher(
+                lambda texts: self.embedding_model.encode(texts, batch_size=len(texts)),
+                max_batch_size=batch_max_size, max_wait_ms=batch_max_wait_ms
+            )
+        if warm_up:
+            threading.Thread(target=self._warm_up, name="embedding-warm-up", daemon=True).start()
     
+    @property
+    def embedding_model(self):
+        """Embedding backend (all-MiniLM-L6-v2, 384 dimensions), loaded on first access"""
+        if self._embedding_model is None:
+            with self._model_lock:
+                if self._embedding_model is None:
+                    print(f"Loading embedding model ({self.embedding_backend})...")
+                    self._embedding_model = load_embedder(self.embedding_backend)
+                    print("✓ Embedding model loaded")
+        return self._embedding_model
     
-    def _setup_vector_index(self):
-        """Create Redis vector index for semantic search"""
+    def _warm_up(self):
+        """Load the model and run one encode so the first real lookup skips both"""
         try:
-            # Try to create the index (will fail if it already exists)
-            self.redis_client.execute_command(
-                "FT.CREATE", "semantic_idx", "ON", "HASH", 
-                "PREFIX", "1", "cache:", 
-                "SCHEMA", 
-                "embedding", "VECTOR", "FLAT", "6", "TYPE", "FLOAT32", "DIM", "384", "DISTANCE_METRIC", "COSINE",
-                "query", "TEXT",
-                "response", "TEXT", 
-                "timestamp", "NUMERIC"
-            )
-            print("✓ Created new vector index")
-        except redis.ResponseError as e:
-            if "Index already exists" in str(e):
-                print("✓ Vector index already exists")
-            else:
-                print(f"✗ Error creating index: {e}")
-                raise
+            self.embedding_model.encode(["warm up"])
+        except Exception as e:
+            # The first lookup retries the load and raises to its caller
+            print(f"✗ Embedding warm-up failed: {e}")
     
     def _get_embedding(self, text: str) -> np.ndarray:
-        """Get embedding vector for text using SentenceTransformer"""
+        """Get embedding vector for text using the embedding backend"""
+        if self.embedding_batcher is not None:
+            return self.embedding_batcher.submit(text).result()
         embedding = self.embedding_model.encode([text])
         return embedding[0]
     
-    def _vector_to_bytes(self, vector: np.ndarray) -> bytes:
-        """Convert numpy vector to bytes for Redis storage"""
-        return vector.astype(np.float32).tobytes()
-    
-    def _bytes_to_vector(self, vector_bytes: bytes) -> np.ndarray:
-        """Convert bytes back to numpy vector"""
-        return np.frombuffer(vector_bytes, dtype=np.float32)
+    def _get_embeddings(self, texts: List[str]) -> np.ndarray:
+        """Embed many texts in one batched forward pass"""
+        return self.embedding_model.encode(texts, batch_size=len(texts) or 1)
     
-    def _search_similar_queries(self, query_embedding: np.ndarray, top_k: int = 5) -> List[Dict]:
-        """Search for semantically similar cached queries"""
+    def _search_similar_queries(self, query_embedding: np.ndarray, top_k: int = 1) -> List[Dict]:
+        """Search for semantically similar cached queries (keys and similarities only)"""
         try:
-            # Convert embedding to bytes for Redis search
-            query_vector = self._vector_to_bytes(query_embedding)
-            
-            # Perform vector search using Redis FT.SEARCH
-            result = self.redis_client.execute_command(
-                "FT.SEARCH", "semantic_idx",
-                f"*=>[KNN {top_k} @embedding $vec AS similarity]",
-                "PARAMS", "2", "vec", query_vector,
-                "RETURN", "4", "query", "response", "similarity", "timestamp",
-                "DIALECT", "2"
-            )
-            
-            # Parse results
-            if len(result) <= 1:  # Only count, no results
-                return []
-            
-            matches = []
-            # Results format: [count, key1, [field1, value1, field2, value2], key2, [...]]
-            for i in range(1, len(result), 2):
-                key = result[i]
-                fields = result[i + 1]
-                
-                # Parse fields into dict
-                field_dict = {}
-                for j in range(0, len(fields), 2):
-                    field_dict[fields[j]] = fields[j + 1]
-                
-                if 'similarity' in field_dict:
-                    # Convert similarity distance to similarity score (1 - distance)
-                    similarity_score = 1 - float(field_dict['similarity'])
-                    
-                    matches.append({
-                        'key': key,
-                        'query': field_dict.get('query', ''),
-                        'response': field_dict.get('response', ''),
-                        'similarity': similarity_score,
-                        'timestamp': field_dict.get('timestamp', '')
-                    })
-            
-            return matches
-            
+            return self.store.search([query_embedding], top_k, threshold=self.similarity_threshold)[0]
         except Exception as e:
             print(f"Error in vector search: {e}")
             return []
     
+    def _search_similar_queries_batch(self, query_embeddings: np.ndarray, top_k: int = 1) -> List[List[Dict]]:
+        """Search for the cached queries nearest to each embedding in one backend call"""
+        try:
+            return self.store.search(query_embeddings, top_k, threshold=self.similarity_threshold)
+        except Exception as e:
+            print(f"Error in vector search: {e}")
+            return [[] for _ in query_embeddings]
+    
     def _call_ollama(self, query: str, model: str = "llama3.1:latest") -> str: # llama3.1 used previously
         """Make a request to Ollama LLM"""
         try:
-            # First check if Ollama is running
-            health_check = requests.get(f"{self.ollama_url}/api/tags", timeout=5)
-            if health_check.status_code != 200:
-                return "Error: Ollama service is not running. Please start with 'ollama serve'"
+            return self._generate(query, model)
+        except OllamaError as e:
+            return str(e)
+    
+    @staticmethod
+    def _parse_generate(response: requests.Response) -> str:
+        """Answer text of a non-streaming /api/generate response"""
+        try:
+            body = response.json()
+            return body['response'].strip()
+        except (ValueError, KeyError, TypeError, AttributeError):
+            raise OllamaError(f"Error: unexpected Ollama response: {response.text[:200]}")
+    
+    def _ollama_request(self, query: str, model: str, stream: bool, parse=None):
+        """
+        POST /api/generate through the circuit breaker. The /api/tags health
+        check only runs as the trial call after the breaker has been open.
+        Returns the response, or parse(response) if given: parsing runs
+        inside the breaker, so a malformed body counts as a failure too. A
+        streamed response is only recorded as a success by its reader, once
+        the stream has completed (see _generate_stream).
+        """
+        if not self.ollama_breaker.allow():
+            raise OllamaError("Error: Ollama service is not running. Please start with 'ollama serve'")
+        try:
+            if self.ollama_breaker.state == "half-open":
+                health_check = self.http.get(f"{self.ollama_url}/api/tags", timeout=5)
+                if health_check.status_code != 200:
+                    raise OllamaError("Error: Ollama service is not running. Please start with 'ollama serve'")
             
-            response = requests.post(
+            response = self.http.post(
                 f"{self.ollama_url}/api/generate",
                 json={
                     "model": model,
                     "prompt": query,
-                    "stream": False
+                    "stream": stream
                 },
-                timeout=60  # Increased timeout
+                timeout=60,  # Increased timeout
+                stream=stream
             )
-            
-            if response.status_code == 200:
-                return response.json()['response'].strip()
-            else:
-                return f"Error: Ollama returned status {response.status_code}"
-
+            if response.status_code != 200:
+                response.close()
+                raise OllamaError(f"Error: Ollama returned status {response.status_code}")
+            result = parse(response) if parse is not None else response
+            if not stream:
+                self.ollama_breaker.record_success()
+            return result
+        
         except requests.exceptions.ConnectionError:
-            return "Error: Cannot connect to Ollama. Please start with 'ollama serve'"
+            self.ollama_breaker.record_failure()
+            raise OllamaError("Error: Cannot connect to Ollama. Please start with 'ollama serve'")
+        except OllamaError:
+            self.ollama_breaker.record_failure()
+            raise
         except Exception as e:
-            return f"Error calling Ollama: {str(e)}"
-    
-    def _store_in_cache(self, query: str, response: str, query_embedding: np.ndarray):
-        """Store query and response in Redis with vector embedding"""
-        cache_key = f"cache:{int(time.time() * 1000)}"  # Unique key with timestamp
-        
-        # Store in Redis hash
-        self.redis_client.hset(cache_key, mapping={
-            "query": query,
-            "response": response,
-            "embedding": self._vector_to_bytes(query_embedding),
-            "timestamp": int(time.time())
-        })
+            self.ollama_breaker.record_failure()
+            raise OllamaError(f"Error calling Ollama: {str(e)}")
     
-    def query(self, user_query: str) -> Tuple[str, bool, float, float]:
+    def _generate(self, query: str, model: str = "llama3.1:latest") -> str:
+        """Whole Ollama response in one piece; raises OllamaError"""
+        return self._ollama_request(query, model, stream=False, parse=self._parse_generate)
+    
+    def _generate_stream(self, query: str, model: str = "llama3.1:latest") -> Iterator[str]:
         """
-        Main query function with semantic caching
-        Returns: (response, is_cached, similarity_score, response_time)
+        Ollama response chunks as they are generated; raises OllamaError on a
+        dropped connection, a malformed or error chunk, or a stream that ends
+        before its done chunk, after the chunks received so far
         """
-        start_time = time.time()
+        response = self._ollama_request(query, model, stream=True)
+        with response:
+            try:
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get('error'):
+                        raise OllamaError(f"Error: Ollama reported: {chunk['error']}")
+                    if chunk.get('response'):
+                        yield chunk['response']
+                    if chunk.get('done'):
+                        break
+                else:
+                    raise OllamaError("Error: Ollama stream ended before the response was done")
+            except OllamaError:
+                self.ollama_breaker.record_failure()
+                raise
+            except requests.exceptions.RequestException as e:
+                self.ollama_breaker.record_failure()
+                raise OllamaError(f"Error calling Ollama: {str(e)}")
+            except (ValueError, TypeError, AttributeError):
+                self.ollama_breaker.record_failure()
+                raise OllamaError(f"Error: unexpected Ollama response: {line[:200].decode(errors='replace')}")
+            except GeneratorExit:
+                self.ollama_breaker.record_abandoned()
+                raise
+            self.ollama_breaker.record_success()
+    
+    def _timed_ollama(self, query: str) -> Tuple[str, float, bool]:
+        """
+        Ollama response, how long it took (the entry's cost for cost-aware
+        eviction) and whether it succeeded; failures come back as the error
+        message and are not cached
+        """
+        llm_start = time.time()
+        try:
+            response, ok = self._generate(query), True
+        except OllamaError as e:
+            response, ok = str(e), False
+        return response, time.time() - llm_start, ok
+    
+    def _store_in_cache(self, query: str, response: str, query_embedding: np.ndarray, cost: float = 0.0):
+        """Store query and response with its embedding (updating an exact repeat in place)"""
+        self.store.store([(query, response, query_embedding, cost)])
+    
+    def _find_cached(self, user_query: str) -> Tuple[Optional[Dict], Optional[np.ndarray]]:
+        """
+        Cached entry answering user_query (with its 'similarity'), or None;
+        plus the query embedding when one had to be computed
+        """
+        # Exact repeat (after case/whitespace folding): answer without running the model
+        exact_match = self.store.lookup_exact([user_query])[0]
+        if exact_match is not None:
+            self.store.record_hits([exact_match['key']])
+            print(f"⚡ EXACT HIT - '{exact_match['query']}'")
+            return exact_match, None
         
         # Get embedding for the query
         query_embedding = self._get_embedding(user_query)
@@ -165,50 +430,197 @@ class SemanticCache:
         # Search for similar cached queries
         similar_queries = self._search_similar_queries(query_embedding)
         
-        # Check if we have a cache hit above threshold
+        # Check if we have a cache hit above threshold, then fetch only that entry's response
+        best_match = None
         if similar_queries and similar_queries[0]['similarity'] >= self.similarity_threshold:
+            best_match = self.store.fetch([similar_queries[0]['key']])[0]  # None if evicted meanwhile
+        
+        if best_match is not None:
             # Cache hit!
-            best_match = similar_queries[0]
-            response_time = time.time() - start_time
+            best_match['similarity'] = similar_queries[0]['similarity']
+            self.store.record_hits([best_match['key']])
             
             print(f"🎯 CACHE HIT - Similarity: {best_match['similarity']:.3f}")
             print(f"   Original query: '{best_match['query']}'")
             print(f"   Current query:  '{user_query}'")
-            
-            return best_match['response'], True, best_match['similarity'], response_time
+            return best_match, query_embedding
         
-        else:
-            # Cache miss - call Ollama
-            best_similarity = similar_queries[0]['similarity'] if similar_queries else 0.0
-            print(f"❌ CACHE MISS - Best similarity: {best_similarity:.3f}")            
-            
-            # Call Ollama LLM
-            llm_start = time.time()
-            response = self._call_ollama(user_query)
-            llm_time = time.time() - llm_start
+        best_similarity = similar_queries[0]['similarity'] if similar_queries else 0.0
+        print(f"❌ CACHE MISS - Best similarity: {best_similarity:.3f}")
+        return None, query_embedding
+    
+    def query(self, user_query: str) -> Tuple[str, bool, float, float]:
+        """
+        Main query function with semantic caching
+        Returns: (response, is_cached, similarity_score, response_time)
+        """
+        start_time = time.time()
+        
+        cached, query_embedding = self._find_cached(user_query)
+        if cached is not None:
+            response_time = time.time() - start_time
+            return cached['response'], True, cached['similarity'], response_time
+        
+        # Cache miss - call Ollama LLM
+        response, llm_time, ok = self._timed_ollama(user_query)
+        
+        # Store in cache for future use
+        if ok:
+            self._store_in_cache(user_query, response, query_embedding, cost=llm_time)
+        
+        total_time = time.time() - start_time
+        
+        print(f"   Ollama response time: {llm_time:.3f}s")
+        
+        return response, False, 0.0, total_time
+    
+    def query_stream(self, user_query: str, stats: Optional[Dict] = None) -> Iterator[str]:
+        """
+        Like query(), but yields the response as Ollama generates it. A cache
+        hit yields the stored response at once; a miss is cached only after the
+        stream completes. If given, stats is filled in with is_cached,
+        similarity, time_to_first_token and total_time.
+        """
+        start_time = time.time()
+        if stats is None:
+            stats = {}
+        
+        cached, query_embedding = self._find_cached(user_query)
+        if cached is not None:
+            stats.update(is_cached=True, similarity=cached['similarity'],
+                         time_to_first_token=time.time() - start_time)
+            yield cached['response']
+            stats['total_time'] = time.time() - start_time
+            return
+        
+        stats.update(is_cached=False, similarity=0.0)
+        chunks = []
+        llm_start = time.time()
+        try:
+            for chunk in self._generate_stream(user_query):
+                if not chunks:
+                    stats['time_to_first_token'] = time.time() - start_time
+                chunks.append(chunk)
+                yield chunk
+        except OllamaError as e:
+            stats.setdefault('time_to_first_token', time.time() - start_time)
+            stats['total_time'] = time.time() - start_time
+            yield str(e)
+            return
+        
+        stats.setdefault('time_to_first_token', time.time() - start_time)
+        response = "".join(chunks).strip()
+        if response:  # complete, but an empty answer is not worth serving again
+            self._store_in_cache(user_query, response, query_embedding, cost=time.time() - llm_start)
+        stats['total_time'] = time.time() - start_time
+    
+    def query_batch(self, user_queries: List[str], max_concurrency: int = 4) -> List[Tuple[str, bool, float, float]]:
+        """
+        Answer many queries with one embedding pass and one KNN pipeline
+        Returns the same (response, is_cached, similarity_score, response_time)
+        tuples as calling query() on each item in order; response_time is the
+        wall time of the whole batch.
+
+        A miss can be answered by an earlier miss in the same batch, exactly as
+        query() would find that entry after storing it. Only the first query of
+        such a group goes to Ollama, at most max_concurrency calls at a time,
+        and every new entry is written in one pipeline. Exact repeats are
+        answered before any embedding is computed, as in query().
+        """
+        start_time = time.time()
+        if not user_queries:
+            return []
+        
+        exact_matches = self.store.lookup_exact(user_queries)
+        pending = [i for i, match in enumerate(exact_matches) if match is None]
+        rows = {i: row for row, i in enumerate(pending)}
+        if pending:
+            embeddings = self._get_embeddings([user_queries[i] for i in pending])
+            cached_matches = self._search_similar_queries_batch(embeddings)
+            normalized = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
             
-            # Store in cache for future use
-            self._store_in_cache(user_query, response, query_embedding)
+            # Second phase: fetch responses only for the matches that clear the threshold
+            winners = [matches[0] for matches in cached_matches
+                       if matches and matches[0]['similarity'] >= self.similarity_threshold]
+            for match, entry in zip(winners, self.store.fetch([match['key'] for match in winners])):
+                if entry is None:
+                    match['similarity'] = 0.0  # evicted since the search, no longer a candidate
+                else:
+                    match.update(entry)
+        
+        # Resolve each query in order: exact hit, hit in Redis, hit on an earlier miss of this batch, or new miss
+        decisions = []  # (source, similarity) where source is a match dict or the index of a new miss
+        new_misses = []
+        new_miss_texts = {}
+        for i, user_query in enumerate(user_queries):
+            if exact_matches[i] is not None:
+                decisions.append((exact_matches[i], 1.0))
+                continue
+            if normalize_query(user_query) in new_miss_texts:
+                decisions.append((new_miss_texts[normalize_query(user_query)], 1.0))
+                continue
             
-            total_time = time.time() - start_time
+            matches = cached_matches[rows[i]]
+            best_source = matches[0] if matches else None
+            best_similarity = matches[0]['similarity'] if matches else 0.0
+            if new_misses:
+                batch_similarities = normalized[[rows[j] for j in new_misses]] @ normalized[rows[i]]
+                j = int(np.argmax(batch_similarities))
+                if batch_similarities[j] > best_similarity:
+                    best_source, best_similarity = new_misses[j], float(batch_similarities[j])
             
-            print(f"   Ollama response time: {llm_time:.3f}s")
+            if best_source is not None and best_similarity >= self.similarity_threshold:
+                decisions.append((best_source, best_similarity))
+            else:
+                decisions.append((i, 0.0))
+                new_misses.append(i)
+                new_miss_texts[normalize_query(user_query)] = i
+        
+        # Call Ollama for the new misses concurrently
+        responses, costs, failed, new_keys = {}, {}, set(), {}
+        if new_misses:
+            with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+                for i, (response, llm_time, ok) in zip(new_misses, pool.map(lambda i: self._timed_ollama(user_queries[i]), new_misses)):
+                    responses[i], costs[i] = response, llm_time
+                    if not ok:
+                        failed.add(i)
             
-            return response, False, 0.0, total_time
+            stored = [i for i in new_misses if i not in failed]  # errors are not cached
+            keys = self.store.store([(user_queries[i], responses[i], embeddings[rows[i]], costs[i]) for i in stored])
+            new_keys = dict(zip(stored, keys))
+        
+        # Count hits in order, including hits on entries this batch just stored
+        self.store.record_hits([
+            source['key'] if isinstance(source, dict) else new_keys.get(source)
+            for i, (source, _) in enumerate(decisions)
+            if source != i and (isinstance(source, dict) or new_keys.get(source) is not None)
+        ])
+        
+        total_time = time.time() - start_time
+        results = []
+        for i, (source, similarity) in enumerate(decisions):
+            if isinstance(source, dict):
+                results.append((source['response'], True, similarity, total_time))
+            elif source == i or source in failed:
+                # A failed call was not cached, so query() would have missed on its followers too
+                results.append((responses[source], False, 0.0, total_time))
+            else:
+                results.append((responses[source], True, similarity, total_time))
+        
+        hits = len(user_queries) - len(new_misses)
+        print(f"📦 BATCH of {len(user_queries)}: {hits} cache hits, {len(new_misses)} Ollama calls in {total_time:.3f}s")
+        return results
     
     def get_cache_stats(self) -> Dict:
         """Get cache statistics"""
         try:
-            # Count cached items
-            keys = self.redis_client.keys("cache:*")
-            cache_count = len(keys)
-            
-            info = self.redis_client.info()
-            
             return {
-                "cached_queries": cache_count,
-                "redis_memory": info.get("used_memory_human", "N/A"),
-                "total_connections": info.get("total_connections_received", "N/A")
+                "backend": self.store.name,
+                "cached_queries": self.store.count(),
+                **self.store.stats(),
+                "embedding_backend": self.embedding_backend,
+                "embedding_model_loaded": self._embedding_model is not None,
+                "ollama_circuit": self.ollama_breaker.state
             }
         except Exception as e:
             return {"error": str(e)}
@@ -216,51 +628,59 @@ class SemanticCache:
     def clear_cache(self):
         """Clear all cached data"""
         try:
-            keys = self.redis_client.keys("cache:*")
-            if keys:
-                self.redis_client.delete(*keys)
-                print(f"✓ Cleared {len(keys)} cached queries")
+            cleared = self.store.clear()
+            if cleared:
+                print(f"✓ Cleared {cleared} cached queries")
             else:
                 print("✓ Cache was already empty")
         except Exception as e:
             print(f"Error clearing cache: {e}")
+    
+    def close(self):
+        """Stop the embedding batcher thread (if any) and close the storage backend"""
+        if self.embedding_batcher is not None:
+            self.embedding_batcher.stop()
+        self.store.close()
+
+
+# Test queries - mix of exact, paraphrased, and new queries
+TEST_QUERIES = [
+    # Original queries
+    "What is machine learning?",
+    "Explain artificial intelligence", 
+    "How do neural networks work?",
+    "What is the difference between AI and ML?",
+    "Tell me about Python programming",
+    
+    # Exact duplicates (should be cache hits)
+    "What is machine learning?",
+    "Explain artificial intelligence",
+    
+    # Paraphrased queries (should be cache hits if similarity > 0.85)
+    "Can you explain what machine learning is?",
+    "What does artificial intelligence mean?",
+    "How do neural nets function?",
+    "What's the difference between artificial intelligence and machine learning?",
+    "Tell me about programming in Python",
+    
+    # Completely new queries
+    "What is quantum computing?",
+    "How does blockchain work?",
+    "Explain cloud computing",
+]
 
 
-def test_semantic_cache():
+def test_semantic_cache(store: Optional[VectorStore] = None):
     """Test the semantic caching system with diverse queries"""
     print("=" * 80)
     print("SEMANTIC CACHE TESTING WITH OLLAMA")
     print("=" * 80)
     
     # Initialize cache
-    cache = SemanticCache()
+    cache = SemanticCache(store=store)
     cache.clear_cache()
     
-    # Test queries - mix of exact, paraphrased, and new queries
-    test_queries = [
-        # Original queries
-        "What is machine learning?",
-        "Explain artificial intelligence", 
-        "How do neural networks work?",
-        "What is the difference between AI and ML?",
-        "Tell me about Python programming",
-        
-        # Exact duplicates (should be cache hits)
-        "What is machine learning?",
-        "Explain artificial intelligence",
-        
-        # Paraphrased queries (should be cache hits if similarity > 0.85)
-        "Can you explain what machine learning is?",
-        "What does artificial intelligence mean?",
-        "How do neural nets function?",
-        "What's the difference between artificial intelligence and machine learning?",
-        "Tell me about programming in Python",
-        
-        # Completely new queries
-        "What is quantum computing?",
-        "How does blockchain work?",
-        "Explain cloud computing",
-    ]
+    test_queries = TEST_QUERIES
     
     results = []
     cache_hits = 0
@@ -324,5 +744,599 @@ def test_semantic_cache():
     return results
 
 
+def test_embedding_batcher(threads: int = 8, requests_per_thread: int = 25):
+    """Concurrent submits are all answered, and submit() after stop() fails instead of hanging"""
+    print("=" * 80)
+    print("EMBEDDING BATCHER")
+    print("=" * 80)
+    
+    # A stand-in encoder: this checks the batcher, not the model
+    batcher = EmbeddingBatcher(lambda texts: [np.full(4, len(text), dtype=np.float32) for text in texts],
+                               max_batch_size=16, max_wait_ms=2.0)
+    texts = [f"query {i}" * (i % 5 + 1) for i in range(threads * requests_per_thread)]
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        vectors = list(pool.map(lambda text: batcher.submit(text).result(timeout=5), texts))
+    assert all(vector[0] == len(text) for text, vector in zip(texts, vectors)), "results went to the wrong caller"
+    print(f"\n✓ {len(texts)} concurrent requests answered in {batcher.stats()['batches']} batches")
+    
+    pending = [batcher.submit(text) for text in texts[:10]]
+    batcher.stop()
+    assert all(future.result(timeout=0) is not None for future in pending), "queued requests lost on stop"
+    try:
+        batcher.submit("too late")
+    except RuntimeError:
+        print("✓ Requests queued before stop() are answered; submit() after it raises")
+    else:
+        raise AssertionError("submit() after stop() should raise")
+    batcher.stop()  # Stopping twice is harmless
+
+
+def test_streaming(queries: Optional[List[str]] = None):
+    """Stream answers token by token and compare time-to-first-token with total time"""
+    print("=" * 80)
+    print("STREAMING RESPONSES: time to first token vs total time")
+    print("=" * 80)
+    
+    cache = SemanticCache()
+    cache.clear_cache()
+    queries = queries or [
+        "What is machine learning?",
+        "Can you explain what machine learning is?",  # paraphrase: served from cache at once
+        "How does blockchain work?",
+    ]
+    
+    results = []
+    for query in queries:
+        print(f"\nQuery: {query}\n  ", end="")
+        stats = {}
+        for chunk in cache.query_stream(query, stats):
+            print(chunk, end="", flush=True)
+        print()
+        status = "🎯 CACHED" if stats['is_cached'] else "🔄 OLLAMA"
+        print(f"  {status} | TTFT: {stats['time_to_first_token']:.3f}s | Total: {stats['total_time']:.3f}s")
+        results.append({'query': query, **stats})
+    
+    misses = [r for r in results if not r['is_cached']]
+    if misses:
+        print(f"\nAvg TTFT on misses: {np.mean([r['time_to_first_token'] for r in misses]):.3f}s "
+              f"vs avg total {np.mean([r['total_time'] for r in misses]):.3f}s")
+    print(f"Ollama circuit: {cache.ollama_breaker.state}")
+    cache.close()
+    return results
+
+
+def benchmark_vector_index(sizes: Tuple[int, ...] = (10_000, 100_000, 1_000_000), queries: int = 200,
+                           redis_host="localhost", redis_port=6380, hnsw_m=16,
+                           hnsw_ef_construction=200, hnsw_ef_runtime=10, noise: float = 0.05):
+    """
+    KNN latency and recall@1 of HNSW against exact FLAT search on synthetic
+    normalized embeddings. Each query is a stored vector plus Gaussian noise,
+    and recall@1 is how often HNSW returns the same nearest neighbour as FLAT.
+    Note: 1M entries need roughly 3.5 GB of Redis memory across both indexes.
+    """
+    print("=" * 80)
+    print(f"VECTOR INDEX BENCHMARK: FLAT vs HNSW (M={hnsw_m}, EF_CONSTRUCTION={hnsw_ef_construction}, "
+          f"EF_RUNTIME={hnsw_ef_runtime})")
+    print("=" * 80)
+
+    client = redis.Redis(host=redis_host, port=redis_port)
+    rng = np.random.default_rng(42)
+
+    def knn_top1(index_name: str, vector: np.ndarray) -> Tuple[Optional[str], float]:
+        start = time.perf_counter()
+        result = client.execute_command(
+            "FT.SEARCH", index_name, "*=>[KNN 1 @embedding $vec AS distance]",
+            "PARAMS", "2", "vec", vector.astype(np.float32).tobytes(),
+            "RETURN", "1", "distance", "DIALECT", "2"
+        )
+        elapsed = time.perf_counter() - start
+        top = result[1].decode().split(":")[-1] if len(result) > 1 else None
+        return top, elapsed
+
+    print(f"\n{'entries':>9} | {'load':>8} | {'FLAT p50':>9} | {'FLAT p95':>9} | "
+          f"{'HNSW p50':>9} | {'HNSW p95':>9} | {'recall@1':>8}")
+    print("-" * 80)
+    for size in sizes:
+        indexes = {"FLAT": f"bench_flat_{size}", "HNSW": f"bench_hnsw_{size}"}
+        for index_type, index_name in indexes.items():
+            try:
+                client.execute_command("FT.DROPINDEX", index_name, "DD")
+            except redis.ResponseError:
+                pass
+            client.execute_command(
+                "FT.CREATE", index_name, "ON", "HASH", "PREFIX", "1", f"{index_name}:",
+                "SCHEMA", "embedding", "VECTOR",
+                *vector_field_args(index_type, EMBEDDING_DIM, hnsw_m, hnsw_ef_construction, hnsw_ef_runtime)
+            )
+
+        # Load in chunks so 1M x 384 floats never sit in memory at once
+        query_ids = set(rng.choice(size, size=min(queries, size), replace=False).tolist())
+        query_vectors = {}
+        load_start = time.perf_counter()
+        for chunk_start in range(0, size, 10_000):
+            chunk = rng.standard_normal((min(10_000, size - chunk_start), EMBEDDING_DIM)).astype(np.float32)
+            chunk /= np.linalg.norm(chunk, axis=1, keepdims=True)
+            pipe = client.pipeline(transaction=False)
+            for offset, vector in enumerate(chunk):
+                entry_id = chunk_start + offset
+                vector_bytes = vector.tobytes()
+                for index_name in indexes.values():
+                    pipe.hset(f"{index_name}:{entry_id}", "embedding", vector_bytes)
+                if entry_id in query_ids:
+                    query_vectors[entry_id] = vector
+            pipe.execute()
+        load_time = time.perf_counter() - load_start
+
+        latencies = {"FLAT": [], "HNSW": []}
+        matches = 0
+        for vector in query_vectors.values():
+            probe = vector + rng.normal(0, noise, EMBEDDING_DIM).astype(np.float32)
+            probe /= np.linalg.norm(probe)
+            flat_top, flat_time = knn_top1(indexes["FLAT"], probe)
+            hnsw_top, hnsw_time = knn_top1(indexes["HNSW"], probe)
+            latencies["FLAT"].append(flat_time)
+            latencies["HNSW"].append(hnsw_time)
+            matches += flat_top == hnsw_top
+
+        flat_ms = np.percentile(latencies["FLAT"], [50, 95]) * 1000
+        hnsw_ms = np.percentile(latencies["HNSW"], [50, 95]) * 1000
+        print(f"{size:>9,} | {load_time:>7.1f}s | {flat_ms[0]:>7.2f}ms | {flat_ms[1]:>7.2f}ms | "
+              f"{hnsw_ms[0]:>7.2f}ms | {hnsw_ms[1]:>7.2f}ms | {matches / len(query_vectors):>8.1%}")
+
+        for index_name in indexes.values():
+            client.execute_command("FT.DROPINDEX", index_name, "DD")
+
+    client.close()
+
+
+def benchmark_query_batch(rounds: int = 4, batch_size: int = 32, max_concurrency: int = 4,
+                          llm_latency: Optional[float] = None):
+    """
+    Queries/sec of query() called per item vs query_batch() over the same
+    traffic (TEST_QUERIES repeated `rounds` times), plus a check that both
+    reach the same hit/miss decisions and similarities.
+    llm_latency replaces Ollama with a fixed-delay answer so the numbers
+    isolate the embedding and Redis path.
+    """
+    print("=" * 80)
+    print("BATCH QUERY BENCHMARK: query() vs query_batch()")
+    print("=" * 80)
+    
+    cache = SemanticCache()
+    if llm_latency is not None:
+        def simulated_ollama(query: str, model: str = None) -> str:
+            time.sleep(llm_latency)
+            return f"Simulated answer to: {query}"
+        cache._generate = simulated_ollama
+    
+    traffic = TEST_QUERIES * rounds
+    cache.query(traffic[0])  # warm up the model outside the timed runs
+    
+    cache.clear_cache()
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        single = [cache.query(q) for q in traffic]
+    single_time = time.perf_counter() - start
+    
+    cache.clear_cache()
+    start = time.perf_counter()
+    batched = []
+    with redirect_stdout(io.StringIO()):
+        for i in range(0, len(traffic), batch_size):
+            batched.extend(cache.query_batch(traffic[i:i + batch_size], max_concurrency=max_concurrency))
+    batch_time = time.perf_counter() - start
+    cache.clear_cache()
+    
+    decisions_match = all(
+        a[1] == b[1] and abs(a[2] - b[2]) < 1e-3 and (llm_latency is None or a[0] == b[0])
+        for a, b in zip(single, batched)
+    )
+    hits = sum(1 for r in single if r[1])
+    print(f"\n{len(traffic)} queries, {hits} cache hits, batch size {batch_size}, "
+          f"{'simulated' if llm_latency is not None else 'Ollama'} LLM")
+    print(f"query():        {len(traffic) / single_time:>8.1f} queries/sec ({single_time:.2f}s)")
+    print(f"query_batch():  {len(traffic) / batch_time:>8.1f} queries/sec ({batch_time:.2f}s)")
+    print(f"Speedup:        {single_time / batch_time:>8.1f}x")
+    print(f"Same results:   {'✓' if decisions_match else '✗'}")
+    return single, batched
+
+
+def benchmark_embedding_batcher(threads: int = 16, requests_per_thread: int = 50,
+                                max_batch_size: int = 32, max_wait_ms: float = 5.0):
+    """
+    Embeddings/sec and per-request latency when many threads embed
+    concurrently: each thread calling encode() itself vs sharing an
+    EmbeddingBatcher. Prints the batcher's batch-size histogram and queue waits.
+    """
+    print("=" * 80)
+    print(f"EMBEDDING MICRO-BATCHING: {threads} threads x {requests_per_thread} requests")
+    print("=" * 80)
+    
+    model = load_embedder()
+    model.encode(TEST_QUERIES)  # warm up
+    texts = [f"{TEST_QUERIES[i % len(TEST_QUERIES)]} ({i})" for i in range(threads * requests_per_thread)]
+    
+    def run(embed) -> Tuple[float, List[float]]:
+        latencies = []
+        lock = threading.Lock()
+        
+        def worker(chunk):
+            for text in chunk:
+                start = time.perf_counter()
+                embed(text)
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+        
+        workers = [threading.Thread(target=worker, args=(texts[i::threads],)) for i in range(threads)]
+        start = time.perf_counter()
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        return time.perf_counter() - start, sorted(latencies)
+    
+    direct_time, direct_latencies = run(lambda text: model.encode([text])[0])
+    batcher = EmbeddingBatcher(lambda batch: model.encode(batch, batch_size=len(batch)),
+                               max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+    batched_time, batched_latencies = run(lambda text: batcher.submit(text).result())
+    stats = batcher.stats()
+    batcher.stop()
+    
+    print(f"\n{'mode':>10} | {'emb/sec':>9} | {'p50':>9} | {'p95':>9}")
+    print("-" * 46)
+    for name, elapsed, latencies in [("direct", direct_time, direct_latencies),
+                                     ("batched", batched_time, batched_latencies)]:
+        print(f"{name:>10} | {len(texts) / elapsed:>9.1f} | {latencies[len(latencies) // 2] * 1000:>7.2f}ms | "
+              f"{latencies[int(0.95 * (len(latencies) - 1))] * 1000:>7.2f}ms")
+    
+    print(f"\nBatches: {stats['batches']}, avg size {stats['avg_batch_size']:.1f}, "
+          f"queue wait avg {stats['avg_queue_wait_ms']:.2f}ms / p95 {stats['p95_queue_wait_ms']:.2f}ms "
+          f"/ max {stats['max_queue_wait_ms']:.2f}ms")
+    print("Batch-size histogram:")
+    for size, count in stats["batch_size_histogram"].items():
+        print(f"  {size:>3}: {count}")
+    return stats
+
+
+def benchmark_embedded_store(sizes: Tuple[int, ...] = (10_000, 100_000, 300_000), queries: int = 200,
+                             path: str = "semantic_cache_bench"):
+    """
+    Lookup latency of EmbeddedVectorStore on synthetic embeddings, and how
+    long reopening the store takes (map the file, no re-embedding).
+    """
+    print("=" * 80)
+    print("EMBEDDED VECTOR STORE BENCHMARK")
+    print("=" * 80)
+    
+    rng = np.random.default_rng(42)
+    print(f"\n{'entries':>9} | {'load':>8} | {'reopen':>8} | {'search p50':>10} | {'search p95':>10}")
+    print("-" * 60)
+    for size in sizes:
+        store = EmbeddedVectorStore(path)
+        store.clear()
+        load_start = time.perf_counter()
+        for chunk_start in range(0, size, 10_000):
+            count = min(10_000, size - chunk_start)
+            vectors = rng.standard_normal((count, EMBEDDING_DIM)).astype(np.float32)
+            store.store([(f"synthetic query {chunk_start + i}", f"response {chunk_start + i}", vectors[i], 1.0)
+                         for i in range(count)])
+        load_time = time.perf_counter() - load_start
+        store.close()
+        
+        reopen_start = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            store = EmbeddedVectorStore(path)
+        reopen_time = time.perf_counter() - reopen_start
+        
+        latencies = []
+        for _ in range(queries):
+            probe = rng.standard_normal(EMBEDDING_DIM).astype(np.float32)
+            start = time.perf_counter()
+            store.search([probe])
+            latencies.append(time.perf_counter() - start)
+        p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+        print(f"{size:>9,} | {load_time:>7.1f}s | {reopen_time * 1000:>6.1f}ms | {p50:>8.3f}ms | {p95:>8.3f}ms")
+        
+        store.clear()
+        store.close()
+
+
+def benchmark_eviction_policies(cache_sizes: Tuple[int, ...] = (100, 250, 500, 1000, 2000), requests: int = 20_000,
+                                topics: int = 5_000, zipf_s: float = 0.9, threshold: float = 0.85, seed: int = 42):
+    """
+    Simulated hit rate vs cache size for each eviction policy, driving the
+    EmbeddedVectorStore eviction code with a synthetic trace: topics with
+    Zipf popularity, each request a paraphrase (topic vector plus noise), and
+    per-topic LLM cost (lognormal seconds) and response length. Also reports
+    the share of LLM seconds saved, which is what cost-aware eviction targets.
+    """
+    print("=" * 80)
+    print(f"EVICTION POLICY SIMULATION: {requests:,} requests over {topics:,} topics (zipf s={zipf_s})")
+    print("=" * 80)
+    
+    rng = np.random.default_rng(seed)
+    topic_vectors = rng.standard_normal((topics, EMBEDDING_DIM)).astype(np.float32)
+    topic_costs = rng.lognormal(mean=0.5, sigma=1.0, size=topics)
+    topic_responses = ["x" * int(n) for n in rng.lognormal(mean=7, sigma=1.0, size=topics)]
+    popularity = 1.0 / np.arange(1, topics + 1) ** zipf_s
+    trace = rng.choice(topics, size=requests, p=popularity / popularity.sum())
+    # Noise of 0.3 per component keeps paraphrases of one topic at cosine ~0.92-0.96
+    vectors = topic_vectors[trace] + rng.normal(0, 0.3, (requests, EMBEDDING_DIM)).astype(np.float32)
+    total_cost = topic_costs[trace].sum()
+    
+    print(f"\n{'size':>6} | " + " | ".join(f"{policy:>5} hit / saved" for policy in EVICTION_POLICIES))
+    print("-" * 70)
+    for size in cache_sizes:
+        row = []
+        for policy in EVICTION_POLICIES:
+            with tempfile.TemporaryDirectory() as path:
+                with redirect_stdout(io.StringIO()):
+                    store = EmbeddedVectorStore(path, max_entries=size, eviction_policy=policy)
+                hits, saved = 0, 0.0
+                for r, topic in enumerate(trace):
+                    matches = store.search([vectors[r]], top_k=1)[0]
+                    if matches and matches[0]['similarity'] >= threshold:
+                        hits += 1
+                        saved += topic_costs[topic]
+                        store.record_hits([matches[0]['key']])
+                    else:
+                        store.store([(f"topic {topic} request {r}", topic_responses[topic], vectors[r],
+                                      topic_costs[topic])])
+                store.close()
+            row.append(f"{hits / requests:>8.1%} / {saved / total_cost:>5.1%}")
+        print(f"{size:>6} | " + " | ".join(row))
+
+
+def benchmark_lookup_payload(response_sizes: Tuple[int, ...] = (2 * 1024, 20 * 1024), entries: int = 1_000,
+                             lookups: int = 500, redis_host="localhost", redis_port=6380):
+    """
+    Bytes Redis sends and lookup latency per cache hit: the old single-phase
+    KNN returning query and response for the top 5 neighbours vs the two-phase
+    lookup (KNN returning key + distance for the top 1, then HMGET of the
+    winner). Bytes come from the server's total_net_output_bytes counter.
+    """
+    print("=" * 80)
+    print("LOOKUP PAYLOAD BENCHMARK: full top-5 KNN vs two-phase key-only KNN + fetch")
+    print("=" * 80)
+    
+    rng = np.random.default_rng(42)
+    with redirect_stdout(io.StringIO()):
+        store = RedisVectorStore(redis_host, redis_port, index_name="payload_bench_idx",
+                                 key_prefix="payload_bench:", exact_prefix="payload_bench_exact:")
+    client = store.redis_client
+    
+    def output_bytes() -> int:
+        return client.info("stats")["total_net_output_bytes"]
+    
+    baseline = output_bytes()
+    info_overhead = output_bytes() - baseline  # bytes of one INFO reply
+    
+    def measure(lookup, probes) -> Tuple[float, float, float]:
+        latencies = []
+        before = output_bytes()
+        for probe in probes:
+            start = time.perf_counter()
+            lookup(probe)
+            latencies.append(time.perf_counter() - start)
+        sent = output_bytes() - before - info_overhead
+        p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+        return sent / len(probes), p50, p95
+    
+    def full_lookup(probe):
+        return store.search([probe], top_k=5, with_payload=True)[0][0]['response']
+    
+    def two_phase_lookup(probe):
+        best = store.search([probe], top_k=1)[0][0]
+        return store.fetch([best['key']])[0]['response']
+    
+    print(f"\n{'response':>9} | {'lookup':>10} | {'bytes/lookup':>12} | {'p50':>8} | {'p95':>8}")
+    print("-" * 60)
+    for size in response_sizes:
+        store.clear()
+        vectors = rng.standard_normal((entries, EMBEDDING_DIM)).astype(np.float32)
+        for start in range(0, entries, 500):
+            store.store([(f"synthetic query {i}", "x" * size, vectors[i], 1.0)
+                         for i in range(start, min(start + 500, entries))])
+        probes = vectors[rng.integers(0, entries, lookups)] + rng.normal(0, 0.05, (lookups, EMBEDDING_DIM)).astype(np.float32)
+        
+        for name, lookup in [("full top-5", full_lookup), ("two-phase", two_phase_lookup)]:
+            sent, p50, p95 = measure(lookup, probes)
+            print(f"{size:>8,}B | {name:>10} | {sent:>11,.0f}B | {p50:>6.2f}ms | {p95:>6.2f}ms")
+    
+    store.clear()
+    client.execute_command("FT.DROPINDEX", "payload_bench_idx")
+    store.close()
+
+
+def benchmark_vector_precision(entries: int = 50_000, queries: int = 200, threshold: float = 0.85,
+                               rerank_candidates: int = 10, redis_host="localhost", redis_port=6380):
+    """
+    Memory per entry, search latency and recall@1 of reduced-precision
+    embeddings (FLOAT16 Redis index, int8 embedded store) against float32,
+    with and without exact re-ranking. Recall@1 uses synthetic vectors: each
+    probe is a stored vector plus noise, its true neighbour found by NumPy.
+    The paraphrase check replays TEST_QUERIES as a cache (search, hit at
+    threshold, store on a miss) and counts hit/miss decisions that differ
+    from the float32 run on the same backend.
+    Memory per entry is the resident vector bytes for the embedded store and
+    the growth of Redis used_memory (hash + index) for Redis.
+    """
+    print("=" * 80)
+    print(f"VECTOR PRECISION BENCHMARK: {entries:,} entries, threshold {threshold}")
+    print("=" * 80)
+    
+    rng = np.random.default_rng(42)
+    vectors = rng.standard_normal((entries, EMBEDDING_DIM)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    probes = vectors[rng.integers(0, entries, queries)] + rng.normal(0, 0.05, (queries, EMBEDDING_DIM)).astype(np.float32)
+    nearest = np.argmax(probes @ vectors.T, axis=1)
+    paraphrases = load_embedder().encode(TEST_QUERIES)
+    
+    def replay(store: VectorStore) -> List[Tuple[bool, float]]:
+        store.clear()
+        decisions = []
+        for query, embedding in zip(TEST_QUERIES, paraphrases):
+            matches = store.search([embedding], top_k=1, threshold=threshold)[0]
+            similarity = matches[0]['similarity'] if matches else 0.0
+            decisions.append((similarity >= threshold, similarity))
+            if similarity < threshold:
+                store.store([(query, f"answer to {query}", embedding, 1.0)])
+        return decisions
+    
+    def load(store: VectorStore) -> Dict:
+        """Store the synthetic entries and map each returned key to its row in vectors"""
+        store.clear()
+        index_of = {}
+        for start in range(0, entries, 1_000):
+            keys = store.store([(f"synthetic query {i}", f"response {i}", vectors[i], 1.0)
+                                for i in range(start, min(start + 1_000, entries))])
+            index_of.update({key: start + j for j, key in enumerate(keys)})
+        return index_of
+    
+    def measure(store: VectorStore, memory_per_entry, baseline: Optional[List]) -> List:
+        """One row per re-rank setting; returns the decisions to compare later rows against"""
+        settings = [rerank_candidates, 0] if store.rerank_candidates else [0]
+        for rerank in settings:
+            store.rerank_candidates = rerank
+            index_of = load(store)
+            bytes_per_entry = memory_per_entry()
+            latencies, found = [], 0
+            for probe, expected in zip(probes, nearest):
+                start = time.perf_counter()
+                matches = store.search([probe], top_k=1)[0]
+                latencies.append(time.perf_counter() - start)
+                found += bool(matches) and index_of.get(matches[0]['key']) == expected
+            
+            decisions = replay(store)
+            baseline = baseline or decisions
+            changed = sum(hit != base_hit for (hit, _), (base_hit, _) in zip(decisions, baseline))
+            drift = max(abs(sim - base_sim) for (_, sim), (_, base_sim) in zip(decisions, baseline))
+            label = f"{store.name} {getattr(store, 'vector_type', None) or store.precision}"
+            if len(settings) > 1:
+                label += " + rerank" if rerank else " no rerank"
+            print(f"{label:<26} | {bytes_per_entry:>8,.0f}B | {np.percentile(latencies, 50) * 1000:>8.3f}ms | "
+                  f"{found / queries:>8.1%} | {sum(hit for hit, _ in decisions):>4} | {changed:>7} | {drift:>10.5f}")
+        return baseline
+    
+    print(f"\n{'backend / precision':<26} | {'mem/entry':>9} | {'search p50':>10} | {'recall@1':>8} | "
+          f"{'hits':>4} | {'changed':>7} | {'max |Δsim|':>10}")
+    print("-" * 92)
+    
+    baseline = None
+    for precision in EMBEDDED_PRECISIONS:
+        with tempfile.TemporaryDirectory() as path:
+            with redirect_stdout(io.StringIO()):
+                store = EmbeddedVectorStore(path, precision=precision, rerank_candidates=rerank_candidates)
+            baseline = measure(store, lambda: store.stats()["vector_bytes_per_entry"], baseline)
+            store.close()
+    
+    baseline = None
+    for vector_type in VECTOR_TYPES:
+        index_name = f"precision_{vector_type.lower()}_idx"
+        # Entry keys must not share a prefix with the {index_name}:* bookkeeping keys,
+        # or clear()/count() and the index itself would pick those up too
+        key_prefix = f"precision_{vector_type.lower()}_entry:"
+        try:
+            with redirect_stdout(io.StringIO()):
+                store = RedisVectorStore(redis_host, redis_port, index_name=index_name, key_prefix=key_prefix,
+                                         exact_prefix=f"precision_{vector_type.lower()}_exact:",
+                                         vector_type=vector_type, rerank_candidates=rerank_candidates)
+        except redis.ConnectionError:
+            print(f"(Redis at {redis_host}:{redis_port} unavailable, skipping the Redis rows)")
+            break
+        store.clear()
+        used_before = store.redis_client.info("memory")["used_memory"]  # load() clears, so this stays the base
+        baseline = measure(store, lambda: (store.redis_client.info("memory")["used_memory"] - used_before) / entries,
+                           baseline)
+        store.clear()
+        store.redis_client.execute_command("FT.DROPINDEX", index_name)
+        store.close()
+
+
+# Run in a fresh interpreter per backend so import and load times are cold-start numbers
+STARTUP_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import task2
+imported = time.perf_counter()
+embedder = task2.load_embedder(sys.argv[1])
+loaded = time.perf_counter()
+embedder.encode(["warm up"])
+first = time.perf_counter()
+latencies = []
+for i in range(int(sys.argv[2])):
+    query_start = time.perf_counter()
+    embedder.encode([task2.TEST_QUERIES[i % len(task2.TEST_QUERIES)]])
+    latencies.append(time.perf_counter() - query_start)
+batch_start = time.perf_counter()
+embeddings = embedder.encode(task2.TEST_QUERIES, batch_size=len(task2.TEST_QUERIES))
+print(json.dumps({"import": imported - start, "load": loaded - imported, "first": first - loaded,
+                  "latencies": latencies, "batch": time.perf_counter() - batch_start,
+                  "embeddings": embeddings.tolist()}))
+"""
+
+
+def benchmark_embedding_startup(backends: Tuple[str, ...] = EMBEDDING_BACKENDS, queries: int = 100):
+    """
+    Cold-start cost and encode latency of each embedding backend, each in a
+    fresh Python process: importing task2, loading the model, the first
+    encode, then single-query encode p50/p95 and one batch of TEST_QUERIES.
+    Agreement is the lowest cosine similarity between a backend's embedding
+    of a TEST_QUERIES entry and the torch one.
+    """
+    print("=" * 80)
+    print("EMBEDDING BACKEND STARTUP AND ENCODE LATENCY")
+    print("=" * 80)
+    
+    results = {}
+    for backend in backends:
+        run = subprocess.run([sys.executable, "-c", STARTUP_PROBE, backend, str(queries)], capture_output=True,
+                             text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        if run.returncode != 0:
+            error = (run.stderr.strip().splitlines() or ["no output"])[-1]
+            print(f"{backend}: unavailable ({error})")
+            continue
+        results[backend] = json.loads(run.stdout.strip().splitlines()[-1])
+    
+    print(f"\n{'backend':>10} | {'import':>8} | {'load':>8} | {'1st enc':>8} | {'enc p50':>8} | {'enc p95':>8} | "
+          f"{'batch 15':>8} | {'vs torch':>8}")
+    print("-" * 90)
+    reference = np.array(results["torch"]["embeddings"]) if "torch" in results else None
+    for backend, result in results.items():
+        p50, p95 = np.percentile(result["latencies"], [50, 95]) * 1000
+        agreement = "n/a"
+        if reference is not None:
+            agreement = f"{np.min(np.sum(np.array(result['embeddings']) * reference, axis=1)):.4f}"
+        print(f"{backend:>10} | {result['import']:>7.2f}s | {result['load']:>7.2f}s | {result['first'] * 1000:>6.1f}ms | "
+              f"{p50:>6.2f}ms | {p95:>6.2f}ms | {result['batch'] * 1000:>6.1f}ms | {agreement:>8}")
+    return results
+
+
 if __name__ == "__main__":
-    test_semantic_cache()
\ No newline at end of file
+    mode = sys.argv[1] if len(sys.argv) > 1 else "test"
+
+    if mode == "stream":
+        test_streaming()
+    elif mode == "batcher":
+        test_embedding_batcher()
+    elif mode == "benchmark-index":
+        benchmark_vector_index()
+    elif mode == "benchmark-batcher":
+        benchmark_embedding_batcher()
+    elif mode == "benchmark-embedded":
+        benchmark_embedded_store()
+    elif mode == "benchmark-eviction":
+        benchmark_eviction_policies()
+    elif mode == "benchmark-payload":
+        benchmark_lookup_payload()
+    elif mode == "benchmark-precision":
+        benchmark_vector_precision()
+    elif mode == "benchmark-startup":
+        benchmark_embedding_startup()
+    elif mode == "benchmark-batch":
+        simulated = len(sys.argv) > 2 and sys.argv[2] == "simulated"
+        benchmark_query_batch(llm_latency=0.5 if simulated else None)
+    else:
+        # python task2.py test embedded -> run without Redis
+        embedded = len(sys.argv) > 2 and sys.argv[2] == "embedded"
+        test_semantic_cache(EmbeddedVectorStore() if embedded else None)
\ No newline at end of file